@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Measure the memory connection wrappers retain per edge.
+
+Every row of the fully seeded database is wrapped in a connection the way a
+resolver would, and each node's id and edge's cursor are resolved. The
+retained size excludes the ORM objects, which are loaded beforehand.
+"""
+import sys
+import tracemalloc
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from generate_mock_data import seed_db
+from nido_backend.db_models import (
+    Base,
+    DBAssociate,
+    DBBillingCharge,
+    DBGroup,
+    DBResidence,
+)
+from nido_backend.gql_query import (
+    Associate,
+    BillingCharge,
+    Group,
+    Residence,
+    build_connection,
+)
+from nido_backend.gql_schema import SchemaContext
+
+NODE_CLASSES = [Associate, BillingCharge, Group, Residence]
+
+
+def retained_bytes_per_edge(context, NodeClass, rows):
+    # Only context is used without an orderBy argument.
+    info = SimpleNamespace(context=context)
+    start = tracemalloc.get_traced_memory()[0]
+    connection = build_connection(
+        info, NodeClass, NodeClass.dbtype, rows, {}, lambda: len(rows)
+    )
+    resolved = [(edge.node.id(), edge.cursor()) for edge in connection.edges]
+    # A query selecting the same rows again, like a node appearing in
+    # several lists, gets wrappers that are shared if reuse_nodes is set.
+    again = build_connection(
+        info, NodeClass, NodeClass.dbtype, rows, {}, lambda: len(rows)
+    )
+    resolved += [(edge.node.id(), edge.cursor()) for edge in again.edges]
+    retained = tracemalloc.get_traced_memory()[0] - start
+    del connection, again, resolved
+    return retained / (2 * len(rows))
+
+
+def main(reuse_nodes):
+    db_engine = create_engine("sqlite://")
+    Base.metadata.create_all(db_engine)
+    with Session(db_engine) as db_session:
+        seed_db(db_session, True)
+        context = SchemaContext([], db_session, 1, 1)
+        context.reuse_nodes = reuse_nodes
+        rows = {
+            NodeClass: db_session.scalars(select(NodeClass.dbtype)).all()
+            for NodeClass in NODE_CLASSES
+        }
+        tracemalloc.start()
+        print(f"reuse_nodes={reuse_nodes}")
+        for NodeClass in NODE_CLASSES:
+            context.nodes = {}
+            per_edge = retained_bytes_per_edge(context, NodeClass, rows[NodeClass])
+            print(
+                f"{NodeClass.__name__:16} {len(rows[NodeClass]):6} rows "
+                f"{per_edge:8.1f} bytes/edge"
+            )
+        tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main("reuse" in sys.argv[1:])
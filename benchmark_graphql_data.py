@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""Compare GraphQL result wrappers on the largest seeded resident directory.
+
+GraphQLDataDict is the wrapper the in-process client used before results
+were converted once by to_graphql_data. It re-wraps nested dicts and lists,
+and converts the attribute name to camelCase, on every access.
+"""
+import sys
+import tempfile
+import timeit
+
+from flask import g, render_template
+from sqlalchemy import select
+
+from generate_mock_data import seed_db
+from nido_backend.db_models import Base, DBAssociate
+from nido_backend.gql_schema import SchemaContext
+from nido_frontend import create_app
+from nido_frontend.main import to_graphql_data
+
+RESIDENT_DIR_QUERY = """
+query ResidentDir {
+  activeUser {
+    isAdmin
+  }
+  activeCommunity {
+    name
+    residences {
+      edges {
+        node {
+          locality
+          postcode
+          region
+          street
+          unitNo
+          occupants {
+            edges {
+              node {
+                fullName
+                groups {
+                  name
+                }
+                emails: contactMethods {
+                  ... on EmailContact {
+                    email
+                  }
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}"""
+
+
+class GraphQLDataDict(dict):
+    def __getattr__(self, attr):
+        words = [
+            word.title() if i > 0 else word for i, word in enumerate(attr.split("_"))
+        ]
+        camel_case_attr = "".join(words)
+        result = self.get(camel_case_attr)
+        if isinstance(result, dict):
+            return GraphQLDataDict(result)
+        elif isinstance(result, list):
+            return [GraphQLDataDict(i) for i in result]
+        else:
+            return result
+
+
+def render_resident_dir(data):
+    community = data.active_community
+    residences = [edge.node for edge in data.active_community.residences.edges]
+    return render_template(
+        "resident-dir.html",
+        main_menu_links=[],
+        community=community,
+        residences=residences,
+        show_street=True,
+    )
+
+
+def main(number):
+    db_dir = tempfile.mkdtemp()
+    app = create_app(
+        {
+            "SECRET_KEY": "benchmark",
+            "DATABASE_URL": f"sqlite:///{db_dir}/nido_db.sqlite3",
+            "LOG_SQL": False,
+            "GRAPHQL_MAX_QUERY_COST": 10**9,
+        }
+    )
+    db_session = app.Session()
+    Base.metadata.create_all(bind=db_session.get_bind())
+    seed_db(db_session, True)
+    app.Session.remove()
+
+    with app.test_request_context():
+        app.preprocess_request()
+        # The second community has the most residences.
+        user_id = g.db_session.scalar(
+            select(DBAssociate.user_id).where(DBAssociate.community_id == 2).limit(1)
+        )
+        context = SchemaContext([], g.db_session, user_id, 2)
+        result = g.gql_client.gql_schema.execute_sync(
+            RESIDENT_DIR_QUERY, context_value=context
+        )
+        assert result.errors is None, result.errors
+        raw = result.data
+        occupants = sum(
+            len(edge["node"]["occupants"]["edges"])
+            for edge in raw["activeCommunity"]["residences"]["edges"]
+        )
+        print(
+            f"{len(raw['activeCommunity']['residences']['edges'])} residences, "
+            f"{occupants} occupants, {number} runs"
+        )
+
+        wrappers = {
+            "GraphQLDataDict": GraphQLDataDict,
+            "to_graphql_data": to_graphql_data,
+        }
+        rendered = {
+            name: render_resident_dir(wrap(raw)) for name, wrap in wrappers.items()
+        }
+        assert len(set(rendered.values())) == 1
+
+        print(f"{'':16} {'wrap ms':>9} {'render ms':>10} {'total ms':>9}")
+        for name, wrap in wrappers.items():
+            data = wrap(raw)
+            wrap_time = timeit.timeit(lambda: wrap(raw), number=number) / number
+            render_time = (
+                timeit.timeit(lambda: render_resident_dir(data), number=number) / number
+            )
+            print(
+                f"{name:16} {wrap_time * 1000:9.2f} {render_time * 1000:10.2f} "
+                f"{(wrap_time + render_time) * 1000:9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -14,11 +14,14 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from importlib.resources import as_file, files
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from oso import AuthorizationError, ForbiddenError, NotFoundError, Oso
+from sqlalchemy import ColumnElement, false
 
 from .db_models import DBBillingCharge, DBContactMethod, DBGroup, DBRight, DBUser
 from .enums import PermissionsFlag
+from .principal import Principal
 
 oso = Oso(read_action="query")
 
@@ -32,3 +35,77 @@ oso.register_class(PermissionsFlag, name="Permissions")
 
 with as_file(files("nido_backend").joinpath("auth_rules.polar")) as rules:
     oso.load_files([rules])
+
+
+# The "query" rules of auth_rules.polar compiled to SQL, so list fields can
+# filter rows in the database instead of asking Oso about each one. Each
+# takes the principal and the entity to filter, and returns None when every
+# row is allowed. Keep these in step with the policy; the tests compare them.
+QUERY_FILTERS: Dict[Any, Callable[[Principal, Any], Optional[ColumnElement]]] = {
+    DBBillingCharge: lambda principal, entity: None,
+    DBContactMethod: lambda principal, entity: None,
+    DBGroup: lambda principal, entity: entity.id.in_(
+        principal.group_ids | principal.managed_group_ids
+    ),
+}
+
+
+def has_authorized_filter(action: str, DBModelClass: Any) -> bool:
+    """Whether authorized_filter can compile `action` on `DBModelClass`."""
+    return action == "query" and DBModelClass in QUERY_FILTERS
+
+
+def authorized_filter(
+    principal: Optional[Principal], action: str, DBModelClass: Any, entity: Any
+) -> Optional[ColumnElement]:
+    """SQL for the rows of `entity` that `principal` may perform `action` on."""
+    if not has_authorized_filter(action, DBModelClass):
+        raise NotImplementedError(f"No SQL filter for {action} on {DBModelClass}")
+    if principal is None:
+        return false()
+    return QUERY_FILTERS[DBModelClass](principal, entity)
+
+
+class DecisionCache:
+    """Oso decisions memoized for the length of a single request.
+
+    Decisions are keyed by actor id, action, resource class and resource id,
+    so asking about the same row again doesn't evaluate the policy again.
+    Resources without an id yet, such as ones about to be created, are
+    always evaluated. Call clear() after changing anything the policy reads,
+    like group memberships.
+    """
+
+    def __init__(self, oso: Oso = oso):
+        self.oso = oso
+        self.hits = 0
+        self.misses = 0
+        self._decisions: Dict[Tuple[Any, str, type, int], bool] = {}
+
+    def is_allowed(self, actor: Any, action: str, resource: Any) -> bool:
+        resource_id = getattr(resource, "id", None)
+        if resource_id is None:
+            self.misses += 1
+            return self.oso.is_allowed(actor, action, resource)
+        key = (getattr(actor, "id", None), action, type(resource), resource_id)
+        decision = self._decisions.get(key)
+        if decision is None:
+            self.misses += 1
+            decision = self._decisions[key] = self.oso.is_allowed(
+                actor, action, resource
+            )
+        else:
+            self.hits += 1
+        return decision
+
+    def authorize(self, actor: Any, action: str, resource: Any):
+        """Raise like Oso.authorize unless `actor` may `action` `resource`."""
+        if self.is_allowed(actor, action, resource):
+            return
+        read_action = self.oso.read_action
+        if action == read_action or not self.is_allowed(actor, read_action, resource):
+            raise self.oso.not_found_error()
+        raise self.oso.forbidden_error()
+
+    def clear(self):
+        self._decisions.clear()
@@ -15,24 +15,28 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import datetime
-from dataclasses import field, make_dataclass
 from functools import reduce
+from itertools import chain
 from typing import List, Optional
 
 import sqlalchemy.schema as sql_schema
 import sqlalchemy.types as sql_types
-from sqlalchemy import ForeignKey
+from sqlalchemy import Engine, ForeignKey, case, delete, event
 from sqlalchemy import func as sql_func
-from sqlalchemy import select
-from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
+from sqlalchemy import insert, inspect, select, text, true, update
+from sqlalchemy.ext.hybrid import hybrid_method
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
     MappedAsDataclass,
+    Session,
     column_property,
     mapped_column,
+    object_session,
     relationship,
 )
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 
 from .enums import (
     ApplicationStatus,
@@ -42,30 +46,39 @@ from .enums import (
 )
 
 
-class BooleanFlag(sql_types.TypeDecorator):
-    impl = sql_types.Boolean
+class FlagMask(sql_types.TypeDecorator):
+    """Stores a Flag enum as an integer with one bit per member."""
+
+    impl = sql_types.Integer
     cache_ok = True
 
-    def __init__(self, true_flag, false_flag, *arg, **kw):
-        self.true_flag = true_flag
-        self.false_flag = false_flag
+    def __init__(self, flag_class, *arg, **kw):
+        self.flag_class = flag_class
         sql_types.TypeDecorator.__init__(self, *arg, **kw)
 
     def process_bind_param(self, value, dialect):
         if value is None:
             return value
-        try:
-            return value & self.true_flag == self.true_flag
-        except:
-            return value
+        return self.flag_class(value).value
 
     def process_result_value(self, value, dialect):
         if value is None:
             return value
-        elif value is True:
-            return self.true_flag
-        else:
-            return self.false_flag
+        return self.flag_class(value)
+
+    @property
+    def python_type(self):
+        return self.flag_class
+
+
+def as_permissions(request) -> PermissionsFlag:
+    """Combine a PermissionsFlag, its integer value, member names, or a list
+    of any of those into one PermissionsFlag."""
+    if isinstance(request, str):
+        return PermissionsFlag[request]
+    if isinstance(request, (list, tuple, set, frozenset)):
+        return reduce(lambda a, b: a | as_permissions(b), request, PermissionsFlag(0))
+    return PermissionsFlag(request)
 
 
 class Base(DeclarativeBase, MappedAsDataclass):
@@ -80,6 +93,9 @@ class DBCommunity(Base, DBNode):
     __tablename__ = "community"
 
     name: Mapped[str]
+    # Bumped whenever the community's groups, memberships or rights change,
+    # so cached authorization data can tell when it's stale.
+    permissions_version: Mapped[int] = mapped_column(init=False, default=0)
 
     associates: Mapped[List["DBAssociate"]] = relationship(
         back_populates="community", init=False, repr=False
@@ -190,6 +206,7 @@ class DBResidence(Base, DBNode):
     __table_args__ = (
         sql_schema.UniqueConstraint("id", "community_id"),
         sql_schema.CheckConstraint("on_market = true OR available_starting IS NULL"),
+        sql_schema.Index("ix_residence_street", "community_id", "street", "unit_no"),
     )
 
     community_id: Mapped[int] = mapped_column(
@@ -442,6 +459,87 @@ class DBGroup(Base, DBNode):
         repr=False,
     )
 
+    def is_managed_by(self, user: DBUser) -> bool:
+        """Whether `user` is a member of a group that manages this one,
+        directly or through a chain of managing groups."""
+        db_session = object_session(self)
+        state = inspect(self)
+        if (
+            db_session is None
+            or not state.persistent
+            or state.attrs.managing_group_id.history.has_changes()
+        ):
+            # group_closure isn't up to date until the group is flushed.
+            seen = set()
+            manager = self.managed_by
+            while manager is not None and id(manager) not in seen:
+                if any(m.user_id == user.id for m in manager.custom_members):
+                    return True
+                seen.add(id(manager))
+                manager = manager.managed_by
+            return False
+        stmt = (
+            select(DBGroupClosure.ancestor_id)
+            .join(
+                DBGroupMembership,
+                DBGroupMembership.group_id == DBGroupClosure.ancestor_id,
+            )
+            .join(DBAssociate, DBAssociate.id == DBGroupMembership.member_id)
+            .where(DBGroupClosure.descendant_id == self.id)
+            .where(DBAssociate.user_id == user.id)
+            .limit(1)
+        )
+        return db_session.scalar(stmt) is not None
+
+
+# Filters with `ieq` compare lower(column), which the unique constraint on
+# (community_id, name) and ix_residence_street can't serve.
+sql_schema.Index(
+    "ix_group_name_lower", DBGroup.community_id, sql_func.lower(DBGroup.name)
+)
+sql_schema.Index(
+    "ix_residence_street_lower",
+    DBResidence.community_id,
+    sql_func.lower(DBResidence.street),
+)
+sql_schema.Index(
+    "ix_residence_unit_no_lower",
+    DBResidence.community_id,
+    sql_func.lower(DBResidence.unit_no),
+)
+
+
+class DBGroupClosure(Base):
+    """Every group that manages another, directly or transitively.
+
+    A row means members of the ancestor group manage the descendant group
+    through a chain of `depth` managing groups, so a group that manages
+    itself has a row of depth 1 with itself. Kept up to date by
+    refresh_group_closure whenever groups are flushed.
+    """
+
+    __tablename__ = "group_closure"
+    __table_args__ = (
+        sql_schema.ForeignKeyConstraint(
+            ["ancestor_id", "community_id"],
+            ["group.id", "group.community_id"],
+            ondelete="CASCADE",
+        ),
+        sql_schema.ForeignKeyConstraint(
+            ["descendant_id", "community_id"],
+            ["group.id", "group.community_id"],
+            ondelete="CASCADE",
+        ),
+        sql_schema.Index("ix_group_closure_descendant", "descendant_id", "ancestor_id"),
+    )
+
+    community_id: Mapped[int] = mapped_column(
+        ForeignKey("community.id", ondelete="CASCADE")
+    )
+    ancestor_id: Mapped[int] = mapped_column(primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(primary_key=True)
+    depth: Mapped[int]
+
 
 class DBGroupMembership(Base):
     __tablename__ = "group_membership"
@@ -472,30 +570,7 @@ class DBGroupMembership(Base):
     )
 
 
-# Creates a class with SQLALchemy mapped Boolean columns for each member
-# of PermissionsFlag.
-PermissionsMixin = make_dataclass(
-    "PermissionsMixin",
-    [
-        (
-            member.name.lower(),
-            Mapped[BooleanFlag],
-            field(
-                default=mapped_column(
-                    BooleanFlag(member, PermissionsFlag(0)),
-                    default=PermissionsFlag(0),
-                    init=False,
-                )
-            ),
-        )
-        for member in PermissionsFlag
-        if member.name is not None
-    ],
-    bases=(MappedAsDataclass,),
-)
-
-
-class DBRight(Base, DBNode, PermissionsMixin):  # type: ignore
+class DBRight(Base, DBNode):
     __tablename__ = "right"
     __table_args__ = (
         sql_schema.UniqueConstraint("id", "community_id"),
@@ -518,30 +593,27 @@ class DBRight(Base, DBNode, PermissionsMixin):  # type: ignore
     parent_right_id: Mapped[int] = mapped_column(server_default="0", init=False)
 
     name: Mapped[str]
-
-    @hybrid_property
-    def permissions(self):
-        return reduce(
-            lambda a, b: a | b, [getattr(self, m.name.lower()) for m in PermissionsFlag]
-        )
-
-    @permissions.inplace.expression
-    @classmethod
-    def _permissions_expression(cls):
-        return reduce(
-            lambda a, b: a + b,
-            [m.value for m in PermissionsFlag if getattr(cls, m.name.lower())],
-        )
-
-    @permissions.inplace.setter
-    def _permissions_setter(self, value: PermissionsFlag):
-        for member in PermissionsFlag:
-            setattr(self, member.name.lower(), member & value)  # type: ignore
+    # One bit per PermissionsFlag member, so adding a member needs no new
+    # column. See migrate_boolean_permissions for databases from before.
+    permissions: Mapped[PermissionsFlag] = mapped_column(
+        FlagMask(PermissionsFlag),
+        default=PermissionsFlag(0),
+        server_default="0",
+        index=True,
+        init=False,
+    )
 
     @hybrid_method
     def permits(self, request):
+        request = as_permissions(request)
         return self.permissions & request == request
 
+    @permits.inplace.expression
+    @classmethod
+    def _permits_expression(cls, request):
+        mask = as_permissions(request).value
+        return cls.permissions.op("&")(mask) == mask
+
     community: Mapped[DBCommunity] = relationship(
         back_populates="rights", init=False, repr=False
     )
@@ -567,6 +639,88 @@ class DBRight(Base, DBNode, PermissionsMixin):  # type: ignore
         repr=False,
     )
 
+    def is_delegable_by(self, user: DBUser) -> bool:
+        """Whether `user` holds this right's parent, and the parent permits
+        delegating every permission this right has."""
+        request = PermissionsFlag.CAN_DELEGATE | self.permissions
+        db_session = object_session(self)
+        parent_right = self.parent_right
+        if (
+            db_session is None
+            or parent_right is None
+            or not inspect(parent_right).persistent
+            or db_session.is_modified(parent_right)
+        ):
+            # right_closure isn't up to date until the parent is flushed.
+            return (
+                parent_right is not None
+                and parent_right.permits(request)
+                and any(
+                    member.user_id == user.id
+                    for group in parent_right.groups
+                    for member in group.custom_members
+                )
+            )
+        stmt = (
+            select(DBGroup.id)
+            .join(DBGroupMembership, DBGroupMembership.group_id == DBGroup.id)
+            .join(DBAssociate, DBAssociate.id == DBGroupMembership.member_id)
+            .join(DBRightClosure, DBRightClosure.descendant_id == DBGroup.right_id)
+            .where(DBRightClosure.depth == 0)
+            .where(DBRightClosure.descendant_id == parent_right.id)
+            .where(DBRightClosure.permits(request))
+            .where(DBAssociate.user_id == user.id)
+            .limit(1)
+        )
+        return db_session.scalar(stmt) is not None
+
+
+class DBRightClosure(Base):
+    """Every right delegated from another, directly or transitively.
+
+    A row means the descendant right was delegated from the ancestor through
+    `depth` delegations, and every right has a row of depth 0 with itself.
+    `effective_permissions` is the descendant's permissions narrowed by all
+    of its ancestors', and is the same on each of the descendant's rows.
+    Kept up to date by refresh_right_closure whenever rights are flushed.
+    """
+
+    __tablename__ = "right_closure"
+    __table_args__ = (
+        sql_schema.ForeignKeyConstraint(
+            ["ancestor_id", "community_id"],
+            ["right.id", "right.community_id"],
+            ondelete="CASCADE",
+        ),
+        sql_schema.ForeignKeyConstraint(
+            ["descendant_id", "community_id"],
+            ["right.id", "right.community_id"],
+            ondelete="CASCADE",
+        ),
+        sql_schema.Index("ix_right_closure_descendant", "descendant_id", "depth"),
+    )
+
+    community_id: Mapped[int] = mapped_column(
+        ForeignKey("community.id", ondelete="CASCADE")
+    )
+    ancestor_id: Mapped[int] = mapped_column(primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(primary_key=True)
+    depth: Mapped[int]
+    effective_permissions: Mapped[PermissionsFlag] = mapped_column(
+        FlagMask(PermissionsFlag)
+    )
+
+    @hybrid_method
+    def permits(self, request):
+        request = as_permissions(request)
+        return self.effective_permissions & request == request
+
+    @permits.inplace.expression
+    @classmethod
+    def _permits_expression(cls, request):
+        mask = as_permissions(request).value
+        return cls.effective_permissions.op("&")(mask) == mask
+
 
 class DBAssociateContactListing(Base):
     __tablename__ = "associate_contact_listing"
@@ -816,6 +970,11 @@ class DBDirFileGroupPermissions(Base):
     group_id: Mapped[int] = mapped_column(primary_key=True)
 
 
+def default_to_amount(context) -> int:
+    # Until a transaction is applied, the whole amount remains.
+    return context.get_current_parameters()["amount"]
+
+
 class DBBillingPayment(Base, DBNode):
     __tablename__ = "billing_payment"
     __table_args__ = (
@@ -833,6 +992,9 @@ class DBBillingPayment(Base, DBNode):
     payer_id: Mapped[int]
 
     amount: Mapped[int] = mapped_column()
+    remaining_balance: Mapped[int] = mapped_column(
+        init=False, insert_default=default_to_amount
+    )
     payment_date: Mapped[datetime.datetime]
 
     community: Mapped[DBCommunity] = relationship(viewonly=True, init=False, repr=False)
@@ -863,6 +1025,10 @@ class DBBillingCharge(Base, DBNode):
             "(residence_id IS NULL AND occupant_id IS NOT NULL) OR "
             "(occupant_id IS NULL AND residence_id IS NOT NULL)"
         ),
+        sql_schema.Index("ix_billing_charge_due_date", "community_id", "due_date"),
+        sql_schema.Index(
+            "ix_billing_charge_residence_due_date", "residence_id", "due_date"
+        ),
     )
     # CASCADE when community is deleted, because deleting the community can
     # only mean that they are no longer interested in using the service. But
@@ -878,6 +1044,9 @@ class DBBillingCharge(Base, DBNode):
 
     name: Mapped[str]
     amount: Mapped[int] = mapped_column()
+    remaining_balance: Mapped[int] = mapped_column(
+        init=False, insert_default=default_to_amount
+    )
     charge_date: Mapped[datetime.datetime] = mapped_column(
         init=False, server_default=sql_func.now()
     )
@@ -1013,25 +1182,525 @@ class DBBillingTransaction(Base):
         self.payment_closing_balance = (
             self.payment_opening_balance - self.transaction_amount
         )
-
-
-DBBillingCharge.remaining_balance = column_property(
-    sql_func.coalesce(
-        select(sql_func.min(DBBillingTransaction.charge_closing_balance))
-        .where(DBBillingTransaction.charge_id == DBBillingCharge.id)
+        self.charge.remaining_balance = self.charge_closing_balance
+        self.payment.remaining_balance = self.payment_closing_balance
+
+
+LEDGER_COLUMNS = {
+    DBBillingCharge: (
+        DBBillingTransaction.charge_id,
+        DBBillingTransaction.charge_closing_balance,
+    ),
+    DBBillingPayment: (
+        DBBillingTransaction.payment_id,
+        DBBillingTransaction.payment_closing_balance,
+    ),
+}
+
+
+def ledger_remaining_balance(DBModelClass):
+    """The remaining balance of a charge or payment according to the ledger.
+
+    Transactions only ever reduce a balance, so the lowest closing balance
+    is the latest one.
+    """
+    ledger_id_col, closing_balance_col = LEDGER_COLUMNS[DBModelClass]
+    return sql_func.coalesce(
+        select(sql_func.min(closing_balance_col))
+        .where(ledger_id_col == DBModelClass.id)
         .correlate_except(DBBillingTransaction)
         .scalar_subquery(),
-        DBBillingCharge.amount,
+        DBModelClass.amount,
+    )
+
+
+def update_remaining_balances(connection, session, DBModelClass, ids):
+    if not ids:
+        return
+    connection.execute(
+        update(DBModelClass)
+        .where(DBModelClass.id.in_(ids))
+        .values(remaining_balance=ledger_remaining_balance(DBModelClass))
+    )
+    stmt = select(DBModelClass.id, DBModelClass.remaining_balance).where(
+        DBModelClass.id.in_(ids)
     )
-)
+    for model_id, remaining_balance in connection.execute(stmt):
+        instance = session.identity_map.get(identity_key(DBModelClass, model_id))
+        if instance is not None:
+            set_committed_value(instance, "remaining_balance", remaining_balance)
+
+
+@event.listens_for(DBBillingTransaction, "after_delete")
+def restore_remaining_balances(mapper, connection, transaction):
+    session = object_session(transaction)
+    update_remaining_balances(
+        connection, session, DBBillingCharge, [transaction.charge_id]
+    )
+    update_remaining_balances(
+        connection, session, DBBillingPayment, [transaction.payment_id]
+    )
+
+
+@event.listens_for(DBBillingCharge, "before_delete")
+@event.listens_for(DBBillingPayment, "before_delete")
+def delete_ledger_transactions(mapper, connection, target):
+    # The database would cascade the delete to the ledger, but then the
+    # other side of each transaction would keep a stale remaining balance.
+    ledger_id_col, _ = LEDGER_COLUMNS[mapper.class_]
+    OtherDBClass = (
+        DBBillingPayment if mapper.class_ is DBBillingCharge else DBBillingCharge
+    )
+    other_id_col, _ = LEDGER_COLUMNS[OtherDBClass]
+    other_ids = connection.scalars(
+        select(other_id_col).where(ledger_id_col == target.id)
+    ).all()
+    connection.execute(delete(DBBillingTransaction).where(ledger_id_col == target.id))
+    update_remaining_balances(
+        connection, object_session(target), OtherDBClass, other_ids
+    )
+
+
+@event.listens_for(DBBillingCharge, "before_update")
+@event.listens_for(DBBillingPayment, "before_update")
+def update_remaining_balance_amount(mapper, connection, target):
+    if not inspect(target).attrs.amount.history.has_changes():
+        return
+    ledger_id_col, closing_balance_col = LEDGER_COLUMNS[mapper.class_]
+    closing_balance = connection.scalar(
+        select(sql_func.min(closing_balance_col)).where(ledger_id_col == target.id)
+    )
+    # The row still holds the old amount, so fall back to the new one here.
+    target.remaining_balance = (
+        closing_balance if closing_balance is not None else target.amount
+    )
+
+
+def check_remaining_balances(db_session, fix: bool = False):
+    """Compare stored remaining balances against the billing ledger.
+
+    Returns `(table name, id, stored balance, ledger balance)` for every row
+    that disagrees, and corrects them when `fix` is set.
+    """
+    mismatches = []
+    for DBModelClass in LEDGER_COLUMNS:
+        ledger_balance = ledger_remaining_balance(DBModelClass)
+        stmt = select(
+            DBModelClass.id, DBModelClass.remaining_balance, ledger_balance
+        ).where(DBModelClass.remaining_balance != ledger_balance)
+        rows = db_session.execute(stmt).all()
+        mismatches.extend((DBModelClass.__tablename__, *row) for row in rows)
+        if fix:
+            update_remaining_balances(
+                db_session.connection(),
+                db_session,
+                DBModelClass,
+                [row[0] for row in rows],
+            )
+    return mismatches
+
+
+def increment_permissions_version(connection, community_ids):
+    """Mark the principals cached for the given communities as stale.
+
+    Flushed changes to groups, memberships and rights do this on their own;
+    statements that change them without the ORM need to call it.
+    """
+    community = DBCommunity.__table__
+    connection.execute(
+        update(community)
+        .where(community.c.id.in_(community_ids))
+        .values(permissions_version=community.c.permissions_version + 1)
+    )
+
+
+def permissions_community_id(session, obj) -> Optional[int]:
+    if obj.community_id is None and isinstance(obj, DBGroupMembership):
+        # New memberships only get community_id from their group during
+        # the flush.
+        group = obj.group or session.get(DBGroup, obj.group_id)
+        return group.community_id if group is not None else None
+    if obj.community_id is None and isinstance(obj, DBAssociate):
+        return obj.community.id if obj.community is not None else None
+    return obj.community_id
+
+
+def changes_permissions(obj) -> bool:
+    if isinstance(obj, (DBGroup, DBGroupMembership, DBRight)):
+        return True
+    # A principal holds the memberships of the user's associates.
+    return (
+        isinstance(obj, DBAssociate)
+        and inspect(obj).attrs.user_id.history.has_changes()
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def bump_permissions_version(session, flush_context, instances):
+    community_ids = {
+        permissions_community_id(session, obj)
+        for obj in chain(session.new, session.deleted)
+        if isinstance(obj, (DBAssociate, DBGroup, DBGroupMembership, DBRight))
+    }
+    community_ids.update(
+        permissions_community_id(session, obj)
+        for obj in session.dirty
+        if changes_permissions(obj)
+    )
+    community_ids.discard(None)
+    if community_ids:
+        increment_permissions_version(session.connection(), community_ids)
+
+
+def update_group_closure(connection, community_ids):
+    """Rebuild the group_closure rows of the given communities.
+
+    Flushes only refresh the groups they change; see refresh_group_closure.
+    """
+    group = DBGroup.__table__
+    managing_group_ids = {
+        row.id: (row.community_id, row.managing_group_id)
+        for row in connection.execute(
+            select(group.c.id, group.c.community_id, group.c.managing_group_id).where(
+                group.c.community_id.in_(community_ids)
+            )
+        )
+    }
+    closure = []
+    for descendant_id, (community_id, ancestor_id) in managing_group_ids.items():
+        # Follow the chain of managing groups until it ends or loops.
+        seen = set()
+        depth = 1
+        while ancestor_id in managing_group_ids and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            closure.append(
+                {
+                    "community_id": community_id,
+                    "ancestor_id": ancestor_id,
+                    "descendant_id": descendant_id,
+                    "depth": depth,
+                }
+            )
+            ancestor_id = managing_group_ids[ancestor_id][1]
+            depth += 1
+    connection.execute(
+        delete(DBGroupClosure).where(DBGroupClosure.community_id.in_(community_ids))
+    )
+    if closure:
+        connection.execute(insert(DBGroupClosure), closure)
+
+
+def refresh_group_closure(connection, group_ids):
+    """Recompute the group_closure rows of the given groups and of every
+    group they manage.
+
+    Only the chains of those groups are walked. A chain that reaches a group
+    outside of them continues the way that group's rows already record.
+    """
+    group = DBGroup.__table__
+    closure = DBGroupClosure.__table__
+    affected_ids = set(group_ids)
+    affected_ids.update(
+        connection.scalars(
+            select(closure.c.descendant_id).where(closure.c.ancestor_id.in_(group_ids))
+        )
+    )
+    connection.execute(delete(closure).where(closure.c.descendant_id.in_(affected_ids)))
+    managing_group_ids = {
+        row.id: (row.community_id, row.managing_group_id)
+        for row in connection.execute(
+            select(group.c.id, group.c.community_id, group.c.managing_group_id).where(
+                group.c.id.in_(affected_ids)
+            )
+        )
+    }
+    chains = {}
+    for descendant_id, (community_id, ancestor_id) in managing_group_ids.items():
+        ancestor_ids = []
+        while ancestor_id in managing_group_ids and ancestor_id not in ancestor_ids:
+            ancestor_ids.append(ancestor_id)
+            ancestor_id = managing_group_ids[ancestor_id][1]
+        chains[descendant_id] = (ancestor_ids, ancestor_id)
+
+    # The chain of an unaffected group never passes through an affected one,
+    # so it can be appended as is.
+    unaffected_ids = {
+        ancestor_id
+        for _, ancestor_id in chains.values()
+        if ancestor_id not in affected_ids
+    }
+    unaffected_chains = {
+        group_id: [group_id]
+        for group_id in connection.scalars(
+            select(group.c.id).where(group.c.id.in_(unaffected_ids))
+        )
+    }
+    for row in connection.execute(
+        select(closure.c.ancestor_id, closure.c.descendant_id)
+        .where(closure.c.descendant_id.in_(unaffected_chains))
+        .order_by(closure.c.depth)
+    ):
+        if row.ancestor_id != row.descendant_id:
+            unaffected_chains[row.descendant_id].append(row.ancestor_id)
+
+    rows = []
+    for descendant_id, (ancestor_ids, ancestor_id) in chains.items():
+        ancestor_ids += unaffected_chains.get(ancestor_id, [])
+        rows.extend(
+            {
+                "community_id": managing_group_ids[descendant_id][0],
+                "ancestor_id": ancestor_id,
+                "descendant_id": descendant_id,
+                "depth": depth,
+            }
+            for depth, ancestor_id in enumerate(ancestor_ids, 1)
+        )
+    if rows:
+        connection.execute(insert(closure), rows)
 
 
-DBBillingPayment.remaining_balance = column_property(
-    sql_func.coalesce(
-        select(sql_func.min(DBBillingTransaction.payment_closing_balance))
-        .where(DBBillingTransaction.payment_id == DBBillingPayment.id)
-        .correlate_except(DBBillingTransaction)
-        .scalar_subquery(),
-        DBBillingPayment.amount,
+@event.listens_for(Session, "after_flush")
+def maintain_group_closure(session, flush_context):
+    group_ids = {
+        obj.id
+        for obj in chain(session.new, session.deleted)
+        if isinstance(obj, DBGroup)
+    }
+    group_ids.update(
+        obj.id
+        for obj in session.dirty
+        if isinstance(obj, DBGroup)
+        and inspect(obj).attrs.managing_group_id.history.has_changes()
+    )
+    if group_ids:
+        refresh_group_closure(session.connection(), group_ids)
+
+
+def update_right_closure(connection, community_ids):
+    """Rebuild the right_closure rows of the given communities.
+
+    Flushes only refresh the rights they change; see refresh_right_closure.
+    """
+    right = DBRight.__table__
+    rights = {
+        row.id: (row.community_id, row.parent_right_id, row.permissions)
+        for row in connection.execute(
+            select(
+                right.c.id,
+                right.c.community_id,
+                right.c.parent_right_id,
+                right.c.permissions,
+            ).where(right.c.community_id.in_(community_ids))
+        )
+    }
+
+    closure = []
+    for descendant_id, (community_id, parent_id, permissions) in rights.items():
+        # Follow the chain of parents up to a root, which is its own parent.
+        ancestor_ids = [descendant_id]
+        while parent_id in rights and parent_id not in ancestor_ids:
+            ancestor_ids.append(parent_id)
+            permissions &= rights[parent_id][2]
+            parent_id = rights[parent_id][1]
+        closure.extend(
+            {
+                "community_id": community_id,
+                "ancestor_id": ancestor_id,
+                "descendant_id": descendant_id,
+                "depth": depth,
+                "effective_permissions": permissions,
+            }
+            for depth, ancestor_id in enumerate(ancestor_ids)
+        )
+    connection.execute(
+        delete(DBRightClosure).where(DBRightClosure.community_id.in_(community_ids))
+    )
+    if closure:
+        connection.execute(insert(DBRightClosure), closure)
+
+
+def create_missing_indexes(connection) -> List[str]:
+    """Create the indexes added to the models since a database was created.
+
+    create_all only creates indexes along with their tables. Returns the
+    names of the indexes created.
+    """
+    inspector = inspect(connection)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                created.append(index.name)
+    return created
+
+
+def migrate_boolean_permissions(connection) -> bool:
+    """Move the permissions of rights from the boolean column that each
+    PermissionsFlag member used to have into the permissions mask.
+
+    Returns whether the table had any boolean columns to migrate.
+    """
+    right = DBRight.__table__
+    existing = {c["name"] for c in inspect(connection).get_columns(right.name)}
+    flag_columns = [
+        (member, sql_schema.Column(member.name.lower(), sql_types.Boolean))
+        for member in PermissionsFlag
+        if member.name is not None and member.name.lower() in existing
+    ]
+    if not flag_columns:
+        return False
+
+    preparer = connection.dialect.identifier_preparer
+    table_name = preparer.format_table(right)
+    if "permissions" not in existing:
+        connection.execute(
+            text(
+                f"ALTER TABLE {table_name} "
+                "ADD COLUMN permissions INTEGER NOT NULL DEFAULT 0"
+            )
+        )
+    old_right = sql_schema.Table(
+        right.name,
+        sql_schema.MetaData(),
+        sql_schema.Column("permissions", sql_types.Integer),
+        *[column for _, column in flag_columns],
+    )
+    mask = reduce(
+        lambda a, b: a + b,
+        [
+            case((column == true(), member.value), else_=0)
+            for member, column in flag_columns
+        ],
+    )
+    connection.execute(update(old_right).values(permissions=mask))
+    for _, column in flag_columns:
+        connection.execute(
+            text(f"ALTER TABLE {table_name} DROP COLUMN {preparer.quote(column.name)}")
+        )
+    for index in right.indexes:
+        index.create(connection, checkfirst=True)
+    return True
+
+
+def refresh_right_closure(connection, right_ids):
+    """Recompute the right_closure rows of the given rights and of every
+    right delegated from them.
+
+    Like refresh_group_closure, a chain that reaches an unaffected right
+    continues the way that right's rows already record, along with the
+    effective permissions they hold.
+    """
+    right = DBRight.__table__
+    closure = DBRightClosure.__table__
+    affected_ids = set(right_ids)
+    affected_ids.update(
+        connection.scalars(
+            select(closure.c.descendant_id).where(closure.c.ancestor_id.in_(right_ids))
+        )
     )
-)
+    connection.execute(delete(closure).where(closure.c.descendant_id.in_(affected_ids)))
+    rights = {
+        row.id: (row.community_id, row.parent_right_id, row.permissions)
+        for row in connection.execute(
+            select(
+                right.c.id,
+                right.c.community_id,
+                right.c.parent_right_id,
+                right.c.permissions,
+            ).where(right.c.id.in_(affected_ids))
+        )
+    }
+    chains = {}
+    for descendant_id, (community_id, parent_id, permissions) in rights.items():
+        ancestor_ids = [descendant_id]
+        while parent_id in rights and parent_id not in ancestor_ids:
+            ancestor_ids.append(parent_id)
+            permissions &= rights[parent_id][2]
+            parent_id = rights[parent_id][1]
+        chains[descendant_id] = (ancestor_ids, permissions, parent_id)
+
+    unaffected_ids = {
+        parent_id
+        for _, _, parent_id in chains.values()
+        if parent_id not in affected_ids
+    }
+    unaffected_chains = {}
+    for row in connection.execute(
+        select(
+            closure.c.ancestor_id,
+            closure.c.descendant_id,
+            closure.c.effective_permissions,
+        )
+        .where(closure.c.descendant_id.in_(unaffected_ids))
+        .order_by(closure.c.depth)
+    ):
+        ancestor_ids, _ = unaffected_chains.setdefault(
+            row.descendant_id, ([], row.effective_permissions)
+        )
+        ancestor_ids.append(row.ancestor_id)
+
+    rows = []
+    for descendant_id, (ancestor_ids, permissions, parent_id) in chains.items():
+        if parent_id in unaffected_chains:
+            parent_ancestor_ids, parent_permissions = unaffected_chains[parent_id]
+            ancestor_ids += parent_ancestor_ids
+            permissions &= parent_permissions
+        rows.extend(
+            {
+                "community_id": rights[descendant_id][0],
+                "ancestor_id": ancestor_id,
+                "descendant_id": descendant_id,
+                "depth": depth,
+                "effective_permissions": permissions,
+            }
+            for depth, ancestor_id in enumerate(ancestor_ids)
+        )
+    if rows:
+        connection.execute(insert(closure), rows)
+
+
+@event.listens_for(Session, "after_flush")
+def maintain_right_closure(session, flush_context):
+    right_ids = {
+        obj.id
+        for obj in chain(session.new, session.deleted)
+        if isinstance(obj, DBRight)
+    }
+    right_ids.update(
+        obj.id
+        for obj in session.dirty
+        if isinstance(obj, DBRight)
+        and (
+            inspect(obj).attrs.parent_right_id.history.has_changes()
+            or inspect(obj).attrs.permissions.history.has_changes()
+        )
+    )
+    if right_ids:
+        refresh_right_closure(session.connection(), right_ids)
+
+
+def use_sqlite_transactions(engine: Engine) -> Engine:
+    """Have SQLAlchemy begin the transactions of a SQLite engine.
+
+    pysqlite only emits BEGIN right before a statement that writes, so a
+    SAVEPOINT issued earlier starts a transaction of its own and releasing
+    it commits everything. The driver's isolation_level is set to None,
+    which stops it emitting BEGIN, and BEGIN is emitted when SQLAlchemy
+    begins a transaction instead. Other engines are returned unchanged.
+    """
+    if engine.dialect.name != "sqlite":
+        return engine
+
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    return engine
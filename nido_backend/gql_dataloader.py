@@ -0,0 +1,121 @@
+#  Nido gql_dataloader.py
+#  Copyright (C) John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Row, inspect
+from sqlalchemy.orm import InstrumentedAttribute, Session
+
+from .db_models import DBBillingCharge, DBResidence
+from .gql_helpers import (
+    build_balance_stmt,
+    build_relationship_stmt,
+    set_relationship_values,
+)
+
+
+class RelationshipLoader:
+    """Batches the relationship loads of resolvers within a single request.
+
+    Execution is synchronous, so there is no event loop tick to collect keys
+    on. Instead, the first time a resolver asks for a relationship that
+    recursive_eager_load didn't prefetch, the loader gathers every object of
+    the same class in the request's session that is also missing it, and
+    loads them all with one `IN (...)` query. The siblings that the
+    resolver asks for next are then already loaded.
+    """
+
+    def __init__(self, db_session: Session, batch_size: int = 500):
+        self.db_session = db_session
+        self.batch_size = batch_size
+
+    def load(self, instance: Any, relationship_attr: InstrumentedAttribute) -> Any:
+        key = relationship_attr.key
+        state = inspect(instance)
+        if state.key is None or key not in state.unloaded:
+            # Pending objects and already loaded relationships need no query.
+            return getattr(instance, key)
+
+        ParentDBClass = relationship_attr.class_
+        pending: Dict[int, Any] = {state.identity[0]: instance}
+        for obj in list(self.db_session.identity_map.values()):
+            if not isinstance(obj, ParentDBClass):
+                continue
+            obj_state = inspect(obj)
+            if obj_state.was_deleted or key not in obj_state.unloaded:
+                continue
+            pending.setdefault(obj_state.identity[0], obj)
+
+        parent_ids = list(pending.keys())
+        for i in range(0, len(parent_ids), self.batch_size):
+            batch_ids = parent_ids[i : i + self.batch_size]
+            self._load_batch(
+                relationship_attr, {k: pending[k] for k in batch_ids}, batch_ids
+            )
+        return getattr(instance, key)
+
+    def _load_batch(
+        self,
+        relationship_attr: InstrumentedAttribute,
+        parents: Dict[int, Any],
+        parent_ids: List[int],
+    ):
+        child_stmt, ChildDBClass, parent_id_col = build_relationship_stmt(
+            relationship_attr.class_, relationship_attr
+        )
+        child_stmt = child_stmt.where(parent_id_col.in_(parent_ids))
+        order_by = relationship_attr.property.order_by
+        if order_by and ChildDBClass is relationship_attr.mapper.class_:
+            child_stmt = child_stmt.order_by(parent_id_col, *order_by)
+        else:
+            child_stmt = child_stmt.order_by(parent_id_col, ChildDBClass.id)
+        child_rows = self.db_session.execute(child_stmt).all()
+        set_relationship_values(relationship_attr, parents, child_rows)
+
+
+class BalanceLoader:
+    """Batches the billing balances of residences within a single request.
+
+    Like RelationshipLoader, the first residence asked for brings along
+    every other residence in the session, and all of their balances are
+    summed in one grouped statement.
+    """
+
+    def __init__(self, db_session: Session, batch_size: int = 500):
+        self.db_session = db_session
+        self.batch_size = batch_size
+        self.today = datetime.date.today()
+        self.balances: Dict[int, Optional[Row]] = {}
+
+    def load(self, residence: DBResidence) -> Optional[Row]:
+        if residence.id in self.balances:
+            return self.balances[residence.id]
+
+        pending = {residence.id}
+        for obj in list(self.db_session.identity_map.values()):
+            if isinstance(obj, DBResidence) and obj.id not in self.balances:
+                pending.add(obj.id)
+        residence_ids = list(pending)
+        for i in range(0, len(residence_ids), self.batch_size):
+            batch_ids = residence_ids[i : i + self.batch_size]
+            stmt = build_balance_stmt(self.today, DBBillingCharge.residence_id).where(
+                DBBillingCharge.residence_id.in_(batch_ids)
+            )
+            self.balances.update({k: None for k in batch_ids})
+            for row in self.db_session.execute(stmt):
+                self.balances[row.residence_id] = row
+        return self.balances[residence.id]
@@ -0,0 +1,381 @@
+#  Nido gql_extensions.py
+#  Copyright (C) John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+from graphql import DocumentNode
+from graphql import ExecutionResult as GraphQLExecutionResult
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLObjectType,
+    IntValueNode,
+    OperationDefinitionNode,
+    OperationType,
+    SelectionSetNode,
+    VariableNode,
+    get_named_type,
+    get_nullable_type,
+    get_operation_ast,
+    is_composite_type,
+    is_list_type,
+    specified_rules,
+)
+from graphql.execution.collect_fields import collect_fields
+from graphql.execution.execute import CollectedErrors
+from graphql.execution.execute import ExecutionContext as GraphQLExecutionContext
+from graphql.pyutils import Path, Undefined
+from strawberry import Schema
+from strawberry.extensions import SchemaExtension
+from strawberry.schema.execute import parse_document, validate_document
+from strawberry.types import ExecutionContext
+
+
+def hash_query(query: str) -> str:
+    # SHA-256 hex digests are what automatic persisted query clients send.
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class DocumentCache:
+    """Parsed and validated GraphQL documents, keyed by the hash of the query.
+
+    Documents registered ahead of time, such as the frontend's queries, are
+    persisted: they're never evicted and can be executed by hash alone. Any
+    other query that validates is kept in a LRU cache of `maxsize` entries.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._persisted: Dict[str, Tuple[str, DocumentNode]] = {}
+        self._recent: OrderedDict[str, Tuple[str, DocumentNode]] = OrderedDict()
+
+    def get(self, query_hash: str) -> Optional[Tuple[str, DocumentNode]]:
+        if entry := self._persisted.get(query_hash):
+            return entry
+        with self._lock:
+            entry = self._recent.get(query_hash)
+            if entry is not None:
+                self._recent.move_to_end(query_hash)
+        return entry
+
+    def get_query(self, query_hash: str) -> Optional[str]:
+        entry = self.get(query_hash)
+        return entry[0] if entry else None
+
+    def add(self, query: str, document: DocumentNode, persist: bool = False):
+        query_hash = hash_query(query)
+        with self._lock:
+            if persist:
+                self._persisted[query_hash] = (query, document)
+                self._recent.pop(query_hash, None)
+            elif query_hash not in self._persisted:
+                self._recent[query_hash] = (query, document)
+                self._recent.move_to_end(query_hash)
+                while len(self._recent) > self.maxsize:
+                    self._recent.popitem(last=False)
+        return query_hash
+
+    def register(self, schema: Schema, query: str) -> List[GraphQLError]:
+        """Parse, validate and persist a query, returning any errors found."""
+        try:
+            document = parse_document(query)
+        except GraphQLError as error:
+            return [error]
+        errors = validate_document(schema._schema, document, tuple(specified_rules))
+        if not errors:
+            self.add(query, document, persist=True)
+        return errors
+
+    def register_all(
+        self, schema: Schema, queries: Iterable[str]
+    ) -> Dict[str, List[GraphQLError]]:
+        failures = {}
+        for query in queries:
+            if errors := self.register(schema, query):
+                failures[query] = errors
+        return failures
+
+
+class CachedDocuments(SchemaExtension):
+    """Skip parsing and validation for documents found in a DocumentCache.
+
+    Pass it to the schema with functools.partial so each operation gets its
+    own instance; Strawberry shares extensions passed as instances between
+    concurrent operations.
+    """
+
+    def __init__(
+        self, *, execution_context: ExecutionContext, document_cache: DocumentCache
+    ):
+        self.execution_context = execution_context
+        self.document_cache = document_cache
+
+    def on_parse(self) -> Iterator[None]:
+        execution_context = self.execution_context
+        if execution_context.query and not execution_context.graphql_document:
+            entry = self.document_cache.get(hash_query(execution_context.query))
+            if entry is not None:
+                execution_context.graphql_document = entry[1]
+        yield
+
+    def on_validate(self) -> Iterator[None]:
+        execution_context = self.execution_context
+        query = execution_context.query
+        document = execution_context.graphql_document
+        cached = self.document_cache.get(hash_query(query)) if query else None
+        if cached is not None and cached[1] is document:
+            # The cached document already passed validation; setting errors
+            # to an empty list makes Strawberry skip running the rules again.
+            execution_context.errors = []
+        yield
+        if cached is None and query and document and not execution_context.errors:
+            self.document_cache.add(query, document)
+
+
+class QueryCostLimiter(SchemaExtension):
+    """Reject operations whose estimated cost is over a budget.
+
+    The cost is estimated from the document before anything executes. Each
+    object field costs one for every time it's expected to resolve: list
+    fields multiply everything under them by `default_list_size`, and
+    connections by their `first` or `last` argument instead when one is
+    given. Aliases and fragments count every time they're used.
+
+    The estimate is reported in the result's extensions as `cost`, whether
+    or not the operation was rejected. Like CachedDocuments, pass it to the
+    schema with functools.partial.
+    """
+
+    def __init__(
+        self,
+        *,
+        execution_context: ExecutionContext,
+        max_cost: int,
+        default_list_size: int = 10,
+    ):
+        self.execution_context = execution_context
+        self.max_cost = max_cost
+        self.default_list_size = default_list_size
+        self.cost: Optional[int] = None
+
+    def on_execute(self) -> Iterator[None]:
+        execution_context = self.execution_context
+        document = execution_context.graphql_document
+        assert document is not None
+        operation = get_operation_ast(document, execution_context.operation_name)
+        assert operation is not None
+        schema = execution_context.schema._schema
+        root_type = schema.get_root_type(operation.operation)
+        assert root_type is not None
+        fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if hasattr(definition, "type_condition")
+        }
+        self.cost = self.estimate_cost(root_type, operation.selection_set, 1, fragments)
+        if self.cost > self.max_cost:
+            # Setting a result makes Strawberry skip executing the operation.
+            error = GraphQLError(
+                f"Query cost {self.cost} exceeds the maximum of {self.max_cost}",
+                extensions={"code": "QUERY_TOO_COSTLY"},
+            )
+            execution_context.result = GraphQLExecutionResult(data=None, errors=[error])
+            execution_context.errors = [error]
+        yield
+
+    def estimate_cost(
+        self,
+        parent_type: Any,
+        selection_set: Optional[SelectionSetNode],
+        multiplier: int,
+        fragments: Dict[str, Any],
+    ) -> int:
+        if selection_set is None:
+            return 0
+        schema = self.execution_context.schema._schema
+        cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field = getattr(parent_type, "fields", {}).get(selection.name.value)
+                if field is None:
+                    continue
+                field_type = get_named_type(field.type)
+                if not is_composite_type(field_type):
+                    continue
+                count = multiplier
+                if field_type.name.endswith("Connection"):
+                    count *= self.page_size(selection)
+                elif is_list_type(get_nullable_type(field.type)) and not (
+                    parent_type.name.endswith("Connection")
+                ):
+                    # A connection's edges were already counted by its size.
+                    count *= self.default_list_size
+                cost += count + self.estimate_cost(
+                    field_type, selection.selection_set, count, fragments
+                )
+                continue
+            if isinstance(selection, FragmentSpreadNode):
+                selection = fragments.get(selection.name.value)
+                if selection is None:
+                    continue
+            type_condition = selection.type_condition  # type: ignore
+            fragment_type = (
+                schema.get_type(type_condition.name.value)
+                if type_condition
+                else parent_type
+            )
+            cost += self.estimate_cost(
+                fragment_type,
+                selection.selection_set,  # type: ignore
+                multiplier,
+                fragments,
+            )
+        return cost
+
+    def page_size(self, field_node: FieldNode) -> int:
+        variables = self.execution_context.variables or {}
+        for argument in field_node.arguments:
+            if argument.name.value not in ("first", "last"):
+                continue
+            # Negative sizes are rejected when resolved, but mustn't subtract
+            # the cost of the rest of the query before then.
+            value_node = argument.value
+            if isinstance(value_node, IntValueNode):
+                return max(0, int(value_node.value))
+            if isinstance(value_node, VariableNode):
+                value = variables.get(value_node.name.value)
+                if isinstance(value, int):
+                    return max(0, value)
+        return self.default_list_size
+
+    def get_results(self) -> Dict[str, Any]:
+        if self.cost is None:
+            return {}
+        return {"cost": {"requestedQueryCost": self.cost, "maxCost": self.max_cost}}
+
+
+class LockedCollectedErrors(CollectedErrors):
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def add(self, error: GraphQLError, path: Optional[Path]):
+        with self._lock:
+            super().add(error, path)
+
+
+class ConcurrentRootFields(GraphQLExecutionContext):
+    """Resolve the root fields of a query at the same time, on a thread pool.
+
+    The first root field is resolved on the request's thread and session as
+    usual. Every other one gets a context from the request context's fork(),
+    with a read-only session and snapshot of its own, and is resolved on the
+    `executor`, so a query for both the active user and community takes as
+    long as the slower of the two. Contexts without a session_factory and
+    mutations, whose root fields run in order, are executed normally.
+
+    Each fork's snapshot is the transaction its session begins, so how
+    consistent it is depends on the database. PostgreSQL needs the sessions
+    to use REPEATABLE READ, as create_app's do, or every statement sees the
+    latest commits. pysqlite doesn't begin a transaction before reads, so
+    on SQLite the engine needs use_sqlite_transactions to emit the BEGIN;
+    the snapshot is then taken by the first read, and in the default
+    rollback journal mode it makes writers wait until the fork is closed.
+    SQLite sessions aren't read-only either.
+
+    Create the class to pass to the schema as execution_context_class with
+    ConcurrentRootFields.using(executor).
+    """
+
+    executor: Optional[Executor] = None
+
+    @classmethod
+    def using(cls, executor: Executor) -> Type["ConcurrentRootFields"]:
+        return type(cls.__name__, (cls,), {"executor": executor})
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Shared between the threads resolving root fields.
+        self.collected_errors = LockedCollectedErrors()
+
+    def execute_operation(
+        self, operation: OperationDefinitionNode, root_value: Any
+    ) -> Any:
+        root_type = self.schema.query_type
+        if (
+            self.executor is None
+            or operation.operation != OperationType.QUERY
+            or root_type is None
+            or getattr(self.context_value, "session_factory", None) is None
+        ):
+            return super().execute_operation(operation, root_value)
+        root_fields = collect_fields(
+            self.schema,
+            self.fragments,
+            self.variable_values,
+            root_type,
+            operation.selection_set,
+        )
+        if len(root_fields) < 2:
+            return super().execute_operation(operation, root_value)
+
+        (first_name, first_nodes), *others = root_fields.items()
+        futures: Dict[str, Future] = {
+            response_name: self.executor.submit(
+                self.execute_branch, root_type, root_value, field_nodes, response_name
+            )
+            for response_name, field_nodes in others
+        }
+        results: Dict[str, Any] = {}
+        try:
+            results[first_name] = self.execute_field(
+                root_type,
+                root_value,
+                first_nodes,
+                Path(None, first_name, root_type.name),
+            )
+        finally:
+            # Wait for every branch, so none is still using its session.
+            branch_results = {name: future.result() for name, future in futures.items()}
+        results.update(branch_results)
+        return {k: v for k, v in results.items() if v is not Undefined}
+
+    def execute_branch(
+        self,
+        root_type: GraphQLObjectType,
+        root_value: Any,
+        field_nodes: List[FieldNode],
+        response_name: str,
+    ) -> Any:
+        branch = copy.copy(self)
+        branch._subfields_cache = {}
+        branch.context_value = self.context_value.fork()
+        try:
+            return branch.execute_field(
+                root_type,
+                root_value,
+                field_nodes,
+                Path(None, response_name, root_type.name),
+            )
+        finally:
+            branch.context_value.db_session.close()
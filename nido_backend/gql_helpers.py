@@ -16,42 +16,74 @@
 
 import base64
 import datetime
+import json
+import operator
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
 from itertools import groupby
-from typing import Any, List, Tuple, Type
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
 
 import strawberry
-from sqlalchemy import Row, Select
+from graphql import (
+    ArgumentNode,
+    FieldNode,
+    FragmentSpreadNode,
+    SelectionSetNode,
+    get_named_type,
+    print_ast,
+)
+from sqlalchemy import ColumnElement, Row, Select
 from sqlalchemy import and_ as sql_and
+from sqlalchemy import case
 from sqlalchemy import func as sql_func
-from sqlalchemy import inspect
+from sqlalchemy import inspect, literal
 from sqlalchemy import not_ as sql_not
 from sqlalchemy import or_ as sql_or
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import (
     ColumnProperty,
     InstrumentedAttribute,
     MapperProperty,
     Relationship,
+    Session,
     aliased,
     attributes,
     load_only,
+    with_polymorphic,
 )
 from strawberry.types import Info
-from strawberry.types.nodes import InlineFragment, SelectedField
+from strawberry.types.nodes import convert_arguments
 
-from .db_models import DBNode
+from .authorization import authorized_filter
+from .db_models import Base, DBBillingCharge, DBNode
 
 
-def encode_gql_id(table_name: str, table_id: int) -> str:
+def encode_gql_id_prefix(table_name: str) -> str:
+    # The table name is padded to a multiple of 3 bytes, so it encodes to
+    # whole BASE64 characters that don't depend on the id after it.
     table_name_b = (table_name + "\0" * (3 - len(table_name) % 3)).encode()
+    return base64.urlsafe_b64encode(table_name_b).decode()
+
+
+GQL_ID_PREFIXES = {name: encode_gql_id_prefix(name) for name in Base.metadata.tables}
+GQL_ID_TABLE_NAMES = {prefix: name for name, prefix in GQL_ID_PREFIXES.items()}
+
+
+def encode_gql_id(table_name: str, table_id: int) -> str:
+    prefix = GQL_ID_PREFIXES.get(table_name) or encode_gql_id_prefix(table_name)
     # SQLite and Postgres both use 8 bytes for their biggest integer storage.
     # Encode the table_id to 9 bytes for BASE64 alignment and future-proofing.
     table_id_b = table_id.to_bytes(9, byteorder="big")
-    return base64.urlsafe_b64encode(table_name_b + table_id_b).decode()
+    return prefix + base64.urlsafe_b64encode(table_id_b).decode()
 
 
 def decode_gql_id(gql_id: str) -> Tuple[str, int]:
-    table_name = base64.urlsafe_b64decode(gql_id[:-12]).decode().strip("\0")
+    prefix = gql_id[:-12]
+    table_name = GQL_ID_TABLE_NAMES.get(prefix)
+    if table_name is None:
+        table_name = base64.urlsafe_b64decode(prefix).decode().strip("\0")
     table_id_bytes = base64.urlsafe_b64decode(gql_id[-12:])
     return (table_name, int.from_bytes(table_id_bytes, byteorder="big"))
 
@@ -61,6 +93,48 @@ def gql_id_to_table_id_unchecked(gql_id: str) -> int:
     return int.from_bytes(table_id_bytes, byteorder="big")
 
 
+def encode_cursor(sort_value: Any, table_id: int) -> str:
+    cursor = json.dumps(
+        [sort_value, table_id],
+        default=lambda v: v.isoformat(),
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_attr: Optional[Any]) -> Tuple[Any, int]:
+    try:
+        (sort_value, table_id) = json.loads(base64.urlsafe_b64decode(cursor))
+        if sort_attr is not None and sort_value is not None:
+            python_type = sort_attr.type.python_type
+            if python_type in (datetime.date, datetime.datetime):
+                sort_value = python_type.fromisoformat(sort_value)
+        return (sort_value, int(table_id))
+    except (TypeError, ValueError) as err:
+        raise ValueError(f"Invalid cursor: {cursor}") from err
+
+
+def get_field_arguments(info: Info) -> Dict[str, Any]:
+    # Converting just the arguments is much cheaper than info.selected_fields,
+    # which converts the field's whole selection tree on every call.
+    raw_info = info._raw_info
+    return convert_arguments(raw_info, raw_info.field_nodes[0].arguments)
+
+
+def arguments_key(arguments: Dict[str, Any]) -> str:
+    return json.dumps(arguments, sort_keys=True, default=str)
+
+
+def connection_page_key(
+    parent: Any, relationship_attr: InstrumentedAttribute, arguments: Dict[str, Any]
+) -> Tuple[Any, str, str]:
+    return (
+        inspect(parent).identity_key,
+        relationship_attr.key,
+        arguments_key(arguments),
+    )
+
+
 def convert_gqlname_to_pyname(
     info: Info, gql_class_name: str, gql_field_name: str
 ) -> str:
@@ -76,44 +150,316 @@ def convert_gqlname_to_pyname(
     )
 
 
-def recursive_eager_load(
-    info: Info, stmt: Select, DBModelClass: Type[DBNode], gql_field: SelectedField
-):
+def resolve_type_condition(info: Info, DBModelClass: Any, type_condition: str):
+    """Find the entity whose attributes a fragment's fields should be read from.
+
+    Returns DBModelClass itself when the fragment applies to its GraphQL type
+    or one of that type's interfaces, the subclass entity when DBModelClass
+    was selected `with_polymorphic` and the fragment names one of its
+    subtypes, and None when the fragment can't apply to these rows.
+    """
     inspection = inspect(DBModelClass)
-    assert inspection is not None
     gql_class_name = inspection.class_.__name__[2:]
-    db_relationship_loads = []
-    db_column_loads = [
-        getattr(DBModelClass, col.key)
-        for col in inspection.mapper.columns
-        if len(col.foreign_keys) > 0
-    ]
-    db_column_loads.append(DBModelClass.id)
-
-    for subfield in gql_field.selections:
-        if not isinstance(subfield, SelectedField):
-            # TODO: Handle the case of Fragments and InlineFragments
+    if type_condition == gql_class_name:
+        return DBModelClass
+    gql_type = info.schema._schema.type_map.get(gql_class_name)
+    if type_condition in [i.name for i in getattr(gql_type, "interfaces", [])]:
+        return DBModelClass
+    if inspection.is_aliased_class and inspection.with_polymorphic_mappers:
+        for mapper in inspection.with_polymorphic_mappers:
+            if mapper.class_.__name__[2:] == type_condition:
+                return getattr(DBModelClass, mapper.class_.__name__)
+    return None
+
+
+def iter_field_nodes(
+    info: Info, DBModelClass: Any, selection_set: Optional[SelectionSetNode]
+) -> Iterator[Tuple[Any, FieldNode]]:
+    """Flatten fragments, yielding each field with the entity it belongs to."""
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            if not selection.name.value.startswith("__"):
+                yield (DBModelClass, selection)
             continue
-        pyname = convert_gqlname_to_pyname(info, gql_class_name, subfield.name)
-        db_model_attr = getattr(DBModelClass, pyname, None)
-        if db_model_attr is None or not hasattr(db_model_attr, "property"):
+        if isinstance(selection, FragmentSpreadNode):
+            selection = info._raw_info.fragments[selection.name.value]
+        type_condition = selection.type_condition  # type: ignore
+        if type_condition is None:
+            FragmentDBClass = DBModelClass
+        else:
+            FragmentDBClass = resolve_type_condition(
+                info, DBModelClass, type_condition.name.value
+            )
+        if FragmentDBClass is not None:
+            yield from iter_field_nodes(
+                info, FragmentDBClass, selection.selection_set  # type: ignore
+            )
+
+
+def iter_connection_node_selections(
+    field_node: FieldNode,
+) -> Iterator[Optional[SelectionSetNode]]:
+    for edges_node in field_node.selection_set.selections:  # type: ignore
+        if isinstance(edges_node, FieldNode) and edges_node.name.value == "edges":
+            for node_node in edges_node.selection_set.selections:  # type: ignore
+                if isinstance(node_node, FieldNode) and node_node.name.value == "node":
+                    yield node_node.selection_set
+
+
+def iter_selected_field_nodes(
+    info: Info, selection_set: Optional[SelectionSetNode]
+) -> Iterator[FieldNode]:
+    """Flatten the fragments of a selection set on a non-node type."""
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
             continue
-        elif isinstance(db_model_attr.property, ColumnProperty):
-            db_column_loads.append(db_model_attr)
-        elif isinstance(db_model_attr.property, Relationship):
-            db_relationship_loads.append((db_model_attr, subfield))
+        if isinstance(selection, FragmentSpreadNode):
+            selection = info._raw_info.fragments[selection.name.value]
+        yield from iter_selected_field_nodes(
+            info, selection.selection_set  # type: ignore
+        )
+
+
+def selects_connection_nodes(info: Info, field_nodes: List[FieldNode]) -> bool:
+    """Whether a connection field selects anything that needs its rows.
+
+    A connection that only selects totalCount is answered by counting.
+    """
+    return any(
+        selected.name.value not in ("totalCount", "__typename")
+        for field_node in field_nodes
+        for selected in iter_selected_field_nodes(info, field_node.selection_set)
+    )
+
+
+def selects_total_count(info: Info, field_nodes: List[FieldNode]) -> bool:
+    return any(
+        selected.name.value == "totalCount"
+        for field_node in field_nodes
+        for selected in iter_selected_field_nodes(info, field_node.selection_set)
+    )
+
+
+@dataclass
+class RelationshipPlan:
+    relationship_attr: InstrumentedAttribute
+    argument_nodes: Tuple[ArgumentNode, ...]
+    authorize: Optional[str]
+    node_plan: "EagerLoadPlan"
+    count: bool = False
+    load_nodes: bool = True
+
+
+@dataclass
+class EagerLoadPlan:
+    """What recursive_eager_load loads for one selection set.
+
+    Columns are kept as `(polymorphic subclass name, attribute key)` rather
+    than attributes, since the entity they're read from can be a fresh alias
+    on every request. Relationship arguments are kept as AST nodes and
+    converted with each request's variables. `authorize` is the action a
+    field's `authorize` metadata names, which rows must be authorized for.
+    Connections that select totalCount are counted, and their rows are
+    skipped when nothing else is selected.
+    """
+
+    column_keys: List[Tuple[Optional[str], str]]
+    relationships: List[RelationshipPlan]
+
+
+def compile_eager_load_plan(
+    info: Info, DBModelClass: Any, selection_sets: List[Optional[SelectionSetNode]]
+) -> EagerLoadPlan:
+    inspection = inspect(DBModelClass)
+    assert inspection is not None
+    type_map = info.schema._schema.type_map
+    column_keys: List[Tuple[Optional[str], str]] = [
+        (None, col.key) for col in inspection.mapper.columns if col.foreign_keys
+    ]
+    column_keys.append((None, "id"))
+    relationship_nodes: Dict[Tuple[Any, Tuple[str, ...]], List[FieldNode]] = {}
+    connection_keys = set()
+    authorize_actions: Dict[Tuple[Any, Tuple[str, ...]], Optional[str]] = {}
+
+    for selection_set in selection_sets:
+        for entity, field_node in iter_field_nodes(info, DBModelClass, selection_set):
+            entity_class = inspect(entity).class_
+            gql_field = type_map[entity_class.__name__[2:]].fields.get(  # type: ignore
+                field_node.name.value
+            )
+            if gql_field is None:
+                continue
+            strawberry_field = gql_field.extensions["strawberry-definition"]
+            pyname = strawberry_field.name
+            db_model_attr = getattr(entity, pyname, None)
+            if db_model_attr is None or not hasattr(db_model_attr, "property"):
+                continue
+            elif isinstance(db_model_attr.property, ColumnProperty):
+                entity_name = None if entity is DBModelClass else entity_class.__name__
+                column_keys.append((entity_name, pyname))
+            elif isinstance(db_model_attr.property, Relationship):
+                # Aliases of a field with the same arguments share one load.
+                load_key = (
+                    db_model_attr,
+                    tuple(print_ast(arg) for arg in field_node.arguments),
+                )
+                relationship_nodes.setdefault(load_key, []).append(field_node)
+                authorize_actions[load_key] = strawberry_field.metadata.get("authorize")
+                if get_named_type(gql_field.type).name.endswith("Connection"):
+                    connection_keys.add(load_key)
+
+    relationships = []
+    for load_key, field_nodes in relationship_nodes.items():
+        relationship_attr = load_key[0]
+        _, ChildDBClass, _ = build_relationship_stmt(
+            inspection.class_, relationship_attr
+        )
+        count = False
+        load_nodes = True
+        if load_key in connection_keys:
+            child_selection_sets = [
+                node_selection
+                for field_node in field_nodes
+                for node_selection in iter_connection_node_selections(field_node)
+            ]
+            count = selects_total_count(info, field_nodes)
+            load_nodes = selects_connection_nodes(info, field_nodes)
+        else:
+            child_selection_sets = [f.selection_set for f in field_nodes]
+        relationships.append(
+            RelationshipPlan(
+                relationship_attr,
+                field_nodes[0].arguments,
+                authorize_actions[load_key],
+                compile_eager_load_plan(info, ChildDBClass, child_selection_sets),
+                count,
+                load_nodes,
+            )
+        )
+    return EagerLoadPlan(column_keys, relationships)
+
+
+class EagerLoadPlanCache:
+    """Compiled EagerLoadPlans keyed by the query's field nodes.
+
+    Documents served from the DocumentCache are the same objects on every
+    request, so their plans are only compiled once. Entries hold a reference
+    to the nodes to keep their ids from being reused.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._plans: OrderedDict[Tuple[Any, ...], Tuple[Any, EagerLoadPlan]]
+        self._plans = OrderedDict()
+
+    def get(
+        self, info: Info, DBModelClass: Any, payload_field: Optional[str] = None
+    ) -> EagerLoadPlan:
+        """Return the plan for the field being resolved.
+
+        With a payload_field, the plan is for the objects in that field of
+        the resolved field's payload instead, such as a mutation's results.
+        """
+        field_nodes = info._raw_info.field_nodes
+        key = (
+            DBModelClass,
+            payload_field,
+            *[id(field_node) for field_node in field_nodes],
+        )
+        with self._lock:
+            entry = self._plans.get(key)
+            if entry is not None:
+                self._plans.move_to_end(key)
+                return entry[1]
+        selection_sets = [field_node.selection_set for field_node in field_nodes]
+        if payload_field is not None:
+            selection_sets = [
+                payload_node.selection_set
+                for selection_set in selection_sets
+                for payload_node in iter_selected_field_nodes(info, selection_set)
+                if payload_node.name.value == payload_field
+            ]
+        plan = compile_eager_load_plan(info, DBModelClass, selection_sets)
+        with self._lock:
+            self._plans[key] = (field_nodes, plan)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+
+eager_load_plans = EagerLoadPlanCache()
+
+
+def recursive_eager_load(
+    info: Info,
+    stmt: Select,
+    DBModelClass: Type[DBNode],
+    plan: Optional[EagerLoadPlan] = None,
+    column_loads: Iterable[Any] = (),
+):
+    """Load the rows of `stmt` with everything the current field selects.
+
+    Without a plan, the one for the field being resolved is looked up in
+    eager_load_plans, compiling it on first use.
+    """
+    if plan is None:
+        plan = eager_load_plans.get(info, DBModelClass)
+    db_column_loads = [
+        getattr(
+            DBModelClass if entity_name is None else getattr(DBModelClass, entity_name),
+            key,
+        )
+        for (entity_name, key) in plan.column_keys
+    ]
+    db_column_loads.extend(column_loads)
 
     stmt = stmt.options(load_only(*db_column_loads))
     rows = info.context.db_session.execute(stmt).all()
 
-    for relationship_attr, gql_subfield in db_relationship_loads:
+    ParentDBClass = inspect(DBModelClass).class_
+    for relationship_plan in plan.relationships:
+        arguments = convert_arguments(info._raw_info, relationship_plan.argument_nodes)
         load_relationship(
-            info, inspection.class_, relationship_attr, gql_subfield, rows
+            info,
+            ParentDBClass,
+            relationship_plan.relationship_attr,
+            arguments,
+            relationship_plan.authorize,
+            relationship_plan.node_plan,
+            rows,
+            relationship_plan.count,
+            relationship_plan.load_nodes,
         )
 
     return rows
 
 
+def eager_load_payload(
+    info: Info, payload_field: str, objects: List[Any], batch_size: int = 500
+):
+    """Reload a mutation's results with everything its payload selects.
+
+    Committing expires the objects, so otherwise each field selected on
+    them would load it again, one object and relationship at a time.
+    `payload_field` is the GraphQL name of the payload field holding them.
+    """
+    if not objects:
+        return
+    DBModelClass = type(objects[0])
+    plan = eager_load_plans.get(info, DBModelClass, payload_field)
+    # Reading the id of an expired object would refresh it on its own.
+    ids = [inspect(obj).identity[0] for obj in objects]
+    for i in range(0, len(ids), batch_size):
+        stmt = select(DBModelClass).where(DBModelClass.id.in_(ids[i : i + batch_size]))
+        recursive_eager_load(info, stmt, DBModelClass, plan)
+
+
 def get_best_parent_id_col(relationship: MapperProperty, ParentDBClass: Type[DBNode]):
     for column in relationship.remote_side:
         if ParentDBClass.id in [fk.column for fk in column.foreign_keys]:
@@ -121,51 +467,115 @@ def get_best_parent_id_col(relationship: MapperProperty, ParentDBClass: Type[DBN
     return ParentDBClass.id
 
 
+def coerce_filter_value(db_model_attr: Any, value: Any) -> Any:
+    # Literal arguments and variables come through convert_arguments as
+    # their JSON values, so numbers can be strings and dates always are.
+    python_type = db_model_attr.type.python_type
+    if value is None or isinstance(value, python_type):
+        return value
+    if python_type is int:
+        return int(value)
+    if python_type in (datetime.date, datetime.datetime):
+        return python_type.fromisoformat(value)
+    return value
+
+
+def prefix_clause(db_model_attr: Any, prefix: str) -> ColumnElement:
+    """Match values starting with prefix as a range an index can seek.
+
+    `LIKE 'prefix%'` only uses an index under specific collations, while
+    `>= 'prefix' AND < 'prefiy'` works with any ordinary index. Like the
+    range, the match is case-sensitive.
+
+    The range only matches exactly the values starting with prefix when the
+    column sorts by code point, as SQLite's default BINARY collation and
+    PostgreSQL's "C" collation do. Under a linguistic collation, which can
+    ignore punctuation or case while sorting, the range can both include and
+    miss values.
+    """
+    if not prefix:
+        return db_model_attr.is_not(None)
+    last = ord(prefix[-1])
+    if last == 0x10FFFF:
+        return db_model_attr.startswith(prefix, autoescape=True)
+    upper = prefix[:-1] + chr(last + 1)
+    return sql_and(db_model_attr >= prefix, db_model_attr < upper)
+
+
+def parse_filter_operators(db_model_attr: Any, operators: dict) -> List[ColumnElement]:
+    """Compile a typed filter input, like StringFilter, on one column."""
+    clauses = []
+    for op, value in operators.items():
+        if op == "isNull":
+            is_null = db_model_attr.is_(None)
+            clauses.append(is_null if value else sql_not(is_null))
+        elif op == "in":
+            values = [coerce_filter_value(db_model_attr, v) for v in value]
+            clauses.append(db_model_attr.in_(values))
+        elif op == "between":
+            if len(value) != 2:
+                raise ValueError("between takes exactly two values")
+            low, high = [coerce_filter_value(db_model_attr, v) for v in value]
+            clauses.append(db_model_attr.between(low, high))
+        elif op == "ieq":
+            # Served by the expression indexes on lower(column) of group
+            # names and residence streets and unit numbers. Other columns are
+            # scanned within the community.
+            clauses.append(sql_func.lower(db_model_attr) == sql_func.lower(value))
+        elif op == "startsWith":
+            clauses.append(prefix_clause(db_model_attr, value))
+        elif op == "contains":
+            clauses.append(db_model_attr.icontains(value, autoescape=True))
+        elif op in COMPARISON_OPERATORS:
+            value = coerce_filter_value(db_model_attr, value)
+            clauses.append(COMPARISON_OPERATORS[op](db_model_attr, value))
+        else:
+            raise ValueError(f"Unknown filter operator {op}")
+    return clauses
+
+
+COMPARISON_OPERATORS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "gt": operator.gt,
+    "gte": operator.ge,
+}
+
+
 def parse_filter(info: Info, DBModelClass: Type[DBNode], filter_arg: dict):
     clauses = []
     single_or = None
     for key, val in filter_arg.items():
-        if key == "not_":
+        if key == "not":
             clause = sql_not(parse_filter(info, DBModelClass, val))
             clauses.append(clause)
-        elif key == "or_":
+        elif key == "or":
             if type(val) is list:
                 clause = sql_or(*[parse_filter(info, DBModelClass, sv) for sv in val])
                 clauses.append(clause)
             else:
                 single_or = parse_filter(info, DBModelClass, val)
         else:
-            pyname = convert_gqlname_to_pyname(info, DBModelClass.__name__[2:], key)
+            gql_class_name = inspect(DBModelClass).class_.__name__[2:]
+            if key in info.schema._schema.type_map[gql_class_name].fields:
+                pyname = convert_gqlname_to_pyname(info, gql_class_name, key)
+            else:
+                # Filters that aren't fields of the type, like Right's
+                # permits, are named after the model attribute.
+                pyname = key
             db_model_attr = getattr(DBModelClass, pyname, None)
             if db_model_attr is None:
                 continue
+            if callable(db_model_attr):
+                # Hybrid methods like DBRight.permits build their own clause.
+                clauses.append(db_model_attr(val))
+                continue
             if val is None:
                 clauses.append(db_model_attr == None)
                 continue
-            col_return_type = db_model_attr.type.python_type
-            if col_return_type is str:
-                clauses.append(db_model_attr.ilike(f"%{val}%"))
-            else:
-                val_args = val.split()
-                assert len(val_args) == 2
-                if col_return_type is int:
-                    val_args[1] = int(val_args[1])
-                elif col_return_type is datetime.datetime:
-                    val_args[1] = datetime.datetime.fromisoformat(val_args[1])
-                elif col_return_type is datetime.date:
-                    val_args[1] = datetime.date.fromisoformat(val_args[1])
-                if val_args[0] == "==":
-                    clauses.append(db_model_attr == val_args[1])
-                elif val_args[0] == "!=":
-                    clauses.append(db_model_attr != val_args[1])
-                elif val_args[0] == ">=":
-                    clauses.append(db_model_attr >= val_args[1])
-                elif val_args[0] == "<=":
-                    clauses.append(db_model_attr <= val_args[1])
-                elif val_args[0] == ">":
-                    clauses.append(db_model_attr > val_args[1])
-                elif val_args[0] == "<":
-                    clauses.append(db_model_attr < val_args[1])
+            clauses.extend(parse_filter_operators(db_model_attr, val))
     if single_or is not None and len(clauses) < 2:
         return sql_or(single_or, *clauses)
     elif single_or is not None:
@@ -174,17 +584,21 @@ def parse_filter(info: Info, DBModelClass: Type[DBNode], filter_arg: dict):
         return sql_and(*clauses)
 
 
-def load_relationship(
-    info: Info,
-    ParentDBClass: Type[DBNode],
-    relationship_attr: InstrumentedAttribute,
-    gql_subfield: SelectedField,
-    parent_rows: List[Row],
-):
-    ChildDBClass = relationship_attr.mapper.class_
-    parent_ids = [row[0].id for row in parent_rows]
+def build_relationship_stmt(
+    ParentDBClass: Type[DBNode], relationship_attr: InstrumentedAttribute
+) -> Tuple[Select, Any, Any]:
+    """Select the children of a relationship labelled with their parent's id.
 
+    Returns the statement along with the (possibly aliased) child class and the
+    column holding the parent id, which callers filter and order on.
+    """
+    ChildDBClass = relationship_attr.mapper.class_
     parent_id_col = get_best_parent_id_col(relationship_attr.property, ParentDBClass)
+    if relationship_attr.mapper.polymorphic_on is not None:
+        # Load every subclass's columns in the same statement, so fields
+        # selected through fragments on a subtype can be loaded up front.
+        ChildDBClass = with_polymorphic(ChildDBClass, "*")
+        relationship_attr = relationship_attr.of_type(ChildDBClass)
     child_stmt = select(ChildDBClass, parent_id_col.label("parent_id"))
 
     if relationship_attr.property.secondary is not None:
@@ -195,55 +609,404 @@ def load_relationship(
         child_stmt = child_stmt.join(ChildDBClass, relationship_attr)
     elif parent_id_col == ParentDBClass.id:
         child_stmt = child_stmt.join(relationship_attr)
+    return child_stmt, ChildDBClass, parent_id_col
 
-    load_number = gql_subfield.arguments.get("first")
-
-    if filter_arg := gql_subfield.arguments.get("filter"):
-        filter_clauses = parse_filter(info, ChildDBClass, filter_arg)
-        child_stmt = child_stmt.where(filter_clauses)
-
-    for maybe_edges_field in gql_subfield.selections:
-        if (
-            isinstance(maybe_edges_field, SelectedField)
-            and maybe_edges_field.name == "edges"
-        ):
-            for maybe_node_field in maybe_edges_field.selections:
-                if (
-                    isinstance(maybe_node_field, SelectedField)
-                    and maybe_node_field.name == "node"
-                ):
-                    gql_subfield = maybe_node_field
-
-    child_stmt = child_stmt.where(parent_id_col.in_(parent_ids))
-
-    if load_number:
-        cte = child_stmt.add_columns(
-            sql_func.row_number()
-            .over(partition_by=parent_id_col, order_by=ChildDBClass.id)
-            .label("rn")
-        ).cte()
-        ChildDBClass = aliased(ChildDBClass, cte)  # type: ignore
-        parent_id_col = cte.c.parent_id
-        child_stmt = select(ChildDBClass, cte.c.parent_id).where(
-            cte.c.rn <= int(load_number)
-        )
 
-    child_stmt = child_stmt.order_by(parent_id_col, ChildDBClass.id)
+def set_relationship_values(
+    relationship_attr: InstrumentedAttribute,
+    parents: Dict[int, Any],
+    child_rows: Iterable[Row],
+):
+    """Attach rows grouped by parent id to the already loaded parent objects.
 
-    child_rows = recursive_eager_load(info, child_stmt, ChildDBClass, gql_subfield)
+    `child_rows` must be ordered by the parent id in their second column.
+    Parents without any children get an empty collection or None.
+    """
+    many_to_one = relationship_attr.property.direction.name == "MANYTOONE"
+    remaining_ids = set(parents.keys())
     for k, g in groupby(child_rows, lambda row: row[1]):
-        p = info.context.db_session.get(ParentDBClass, k)
-        parent_ids.remove(k)
+        remaining_ids.discard(k)
         gl = [row[0] for row in g]
-        if relationship_attr.property.direction.name == "MANYTOONE":
+        if many_to_one:
             assert len(gl) == 1
             gl = gl[0]
-        attributes.set_committed_value(p, relationship_attr.key, gl)
+        attributes.set_committed_value(parents[k], relationship_attr.key, gl)
 
     # Handle the remaining parents that don't have any children
-    for k in parent_ids:
-        p = info.context.db_session.get(ParentDBClass, k)
-        if relationship_attr.property.direction.name == "MANYTOONE":
-            attributes.set_committed_value(p, relationship_attr.key, None)
+    for k in remaining_ids:
+        if many_to_one:
+            attributes.set_committed_value(parents[k], relationship_attr.key, None)
         else:
-            attributes.set_committed_value(p, relationship_attr.key, [])
+            attributes.set_committed_value(parents[k], relationship_attr.key, [])
+
+
+PAGINATION_ARGS = ("first", "after", "last", "before", "orderBy")
+
+
+def get_sort_pyname(
+    info: Info, DBModelClass: Any, order_by_arg: Optional[dict]
+) -> Optional[str]:
+    if not order_by_arg:
+        return None
+    gql_class_name = inspect(DBModelClass).class_.__name__[2:]
+    gql_type = info.schema._schema.type_map[gql_class_name]
+    field_name = order_by_arg["field"]
+    if field_name not in gql_type.fields:  # type: ignore
+        raise ValueError(f"Cannot order {gql_class_name} by {field_name}")
+    pyname = convert_gqlname_to_pyname(info, gql_class_name, field_name)
+    db_model_attr = getattr(DBModelClass, pyname, None)
+    if db_model_attr is None or not isinstance(
+        getattr(db_model_attr, "property", None), ColumnProperty
+    ):
+        raise ValueError(f"Cannot order {gql_class_name} by {field_name}")
+    if getattr(db_model_attr.property.columns[0], "nullable", False):
+        # NULLs never compare greater or less than a cursor, so rows with
+        # them would silently drop out of every page after the first.
+        raise ValueError(f"Cannot order {gql_class_name} by nullable {field_name}")
+    return pyname
+
+
+def page_sizes(arguments: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    # Literal arguments come through convert_arguments as strings.
+    (first, last) = (arguments.get("first"), arguments.get("last"))
+    (first, last) = (
+        int(first) if first is not None else None,
+        int(last) if last is not None else None,
+    )
+    # A negative LIMIT is no limit at all in SQLite.
+    if (first is not None and first < 0) or (last is not None and last < 0):
+        raise ValueError("first and last cannot be negative")
+    return first, last
+
+
+def keyset_predicate(sort_col, id_col, cursor: Tuple[Any, int], greater: bool):
+    (sort_value, table_id) = cursor
+    if sort_col is None:
+        return id_col > table_id if greater else id_col < table_id
+    keys = tuple_(sort_col, id_col)
+    values = tuple_(literal(sort_value, sort_col.type), literal(table_id))
+    return keys > values if greater else keys < values
+
+
+def paginate_select(
+    info: Info,
+    stmt: Select,
+    DBModelClass: Any,
+    arguments: Dict[str, Any],
+    partition_by: Optional[Any] = None,
+):
+    """Compile a connection's pagination arguments into keyset SQL.
+
+    `after`/`before` cursors become `(sort_key, id) > (...)` predicates and
+    `first`/`last` a LIMIT of one more row than requested, so page_nodes can
+    tell whether there's another page. When `partition_by` is given the
+    limit applies per parent through row_number() instead, and the returned
+    statement is ordered by parent first.
+
+    Returns the statement along with the class and parent column to read
+    results from, since partitioning moves them into a CTE.
+    """
+    order_by_arg = arguments.get("orderBy") or {}
+    sort_pyname = get_sort_pyname(info, DBModelClass, order_by_arg)
+    sort_col = getattr(DBModelClass, sort_pyname) if sort_pyname else None
+    descending = bool(order_by_arg.get("descending"))
+    first, last = page_sizes(arguments)
+    backward = last is not None and first is None
+
+    if after := arguments.get("after"):
+        cursor = decode_cursor(after, sort_col)
+        stmt = stmt.where(
+            keyset_predicate(sort_col, DBModelClass.id, cursor, not descending)
+        )
+    if before := arguments.get("before"):
+        cursor = decode_cursor(before, sort_col)
+        stmt = stmt.where(
+            keyset_predicate(sort_col, DBModelClass.id, cursor, descending)
+        )
+
+    keys = [DBModelClass.id] if sort_col is None else [sort_col, DBModelClass.id]
+    if descending != backward:
+        keys = [k.desc() for k in keys]
+    limit = last if backward else first
+    limit = limit + 1 if limit is not None else None
+
+    if partition_by is None:
+        stmt = stmt.order_by(*keys)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return stmt, DBModelClass, None
+    elif limit is None:
+        return stmt.order_by(partition_by, *keys), DBModelClass, partition_by
+
+    cte = stmt.add_columns(
+        sql_func.row_number().over(partition_by=partition_by, order_by=keys).label("rn")
+    ).cte()
+    DBModelClass = aliased(DBModelClass, cte)
+    stmt = (
+        select(DBModelClass, cte.c.parent_id)
+        .where(cte.c.rn <= limit)
+        .order_by(cte.c.parent_id, cte.c.rn)
+    )
+    return stmt, DBModelClass, cte.c.parent_id
+
+
+def page_nodes(
+    nodes: List[Any], arguments: Dict[str, Any]
+) -> Tuple[List[Any], bool, bool]:
+    """Trim the extra row paginate_select fetched and work out pageInfo.
+
+    Returns the page in display order with hasPreviousPage and hasNextPage.
+    """
+    first, last = page_sizes(arguments)
+    if last is not None and first is None:
+        has_previous_page = len(nodes) > last
+        page = nodes[:last]
+        page.reverse()
+        return page, has_previous_page, arguments.get("before") is not None
+
+    has_previous_page = arguments.get("after") is not None
+    has_next_page = first is not None and len(nodes) > first
+    page = nodes[:first] if first is not None else list(nodes)
+    if last is not None and len(page) > last:
+        page = page[-last:]
+        has_previous_page = True
+    return page, has_previous_page, has_next_page
+
+
+def authorization_clause(
+    info: Info, action: Optional[str], DBModelClass: Any
+) -> Optional[ColumnElement]:
+    """The rows of `DBModelClass` the active user may perform `action` on.
+
+    Returns None when there's no action to authorize or every row is allowed.
+    """
+    if action is None:
+        return None
+    return authorized_filter(
+        info.context.principal, action, inspect(DBModelClass).class_, DBModelClass
+    )
+
+
+def build_filtered_relationship_stmt(
+    info: Info,
+    ParentDBClass: Type[DBNode],
+    relationship_attr: InstrumentedAttribute,
+    arguments: Dict[str, Any],
+    authorize: Optional[str] = None,
+) -> Tuple[Select, Any, Any]:
+    """build_relationship_stmt with a connection's filter and authorization."""
+    child_stmt, ChildDBClass, parent_id_col = build_relationship_stmt(
+        ParentDBClass, relationship_attr
+    )
+    clause = authorization_clause(info, authorize, ChildDBClass)
+    if clause is not None:
+        # Filtering before paginating keeps pages full and cursors stable.
+        child_stmt = child_stmt.where(clause)
+    if filter_arg := arguments.get("filter"):
+        child_stmt = child_stmt.where(parse_filter(info, ChildDBClass, filter_arg))
+    return child_stmt, ChildDBClass, parent_id_col
+
+
+def build_count_stmt(
+    info: Info,
+    ParentDBClass: Type[DBNode],
+    relationship_attr: InstrumentedAttribute,
+    arguments: Dict[str, Any],
+    parent_ids: List[int],
+    authorize: Optional[str] = None,
+) -> Select:
+    """Count the children of a connection field per parent.
+
+    Like build_connection_stmt, but without pagination, since totalCount is
+    the size of the whole connection. Rows are `(parent_id, count)`, and
+    parents without children are left out.
+    """
+    child_stmt, _, parent_id_col = build_filtered_relationship_stmt(
+        info, ParentDBClass, relationship_attr, arguments, authorize
+    )
+    return (
+        child_stmt.with_only_columns(
+            parent_id_col, sql_func.count(), maintain_column_froms=True
+        )
+        .where(parent_id_col.in_(parent_ids))
+        .group_by(parent_id_col)
+    )
+
+
+def build_connection_stmt(
+    info: Info,
+    ParentDBClass: Type[DBNode],
+    relationship_attr: InstrumentedAttribute,
+    arguments: Dict[str, Any],
+    parent_ids: List[int],
+    authorize: Optional[str] = None,
+):
+    """Select the children of a connection field with its arguments in SQL.
+
+    The filter and pagination arguments are compiled into the statement, so
+    only the rows the field returns are loaded, and so is the authorization
+    filter for `authorize` when one is given. Rows are `(child, parent_id)`
+    ordered by parent.
+    """
+    child_stmt, ChildDBClass, parent_id_col = build_filtered_relationship_stmt(
+        info, ParentDBClass, relationship_attr, arguments, authorize
+    )
+    if len(parent_ids) == 1:
+        child_stmt = child_stmt.where(parent_id_col == parent_ids[0])
+        return paginate_select(info, child_stmt, ChildDBClass, arguments)
+    child_stmt = child_stmt.where(parent_id_col.in_(parent_ids))
+    return paginate_select(
+        info, child_stmt, ChildDBClass, arguments, partition_by=parent_id_col
+    )
+
+
+def load_relationship(
+    info: Info,
+    ParentDBClass: Type[DBNode],
+    relationship_attr: InstrumentedAttribute,
+    arguments: Dict[str, Any],
+    authorize: Optional[str],
+    node_plan: EagerLoadPlan,
+    parent_rows: List[Row],
+    count: bool = False,
+    load_nodes: bool = True,
+):
+    parents = {row[0].id: row[0] for row in parent_rows}
+    parent_ids = list(parents.keys())
+
+    try:
+        if count:
+            count_stmt = build_count_stmt(
+                info, ParentDBClass, relationship_attr, arguments, parent_ids, authorize
+            )
+        if load_nodes:
+            child_stmt, ChildDBClass, _ = build_connection_stmt(
+                info, ParentDBClass, relationship_attr, arguments, parent_ids, authorize
+            )
+            sort_pyname = get_sort_pyname(info, ChildDBClass, arguments.get("orderBy"))
+    except ValueError:
+        # Invalid arguments, like a malformed cursor, leave the relationship
+        # unloaded. The connection's resolver then raises the error at its
+        # own path instead of it failing the field that loads the parents.
+        return
+
+    if count:
+        counts = dict(info.context.db_session.execute(count_stmt).all())
+        for k, parent in parents.items():
+            page_key = connection_page_key(parent, relationship_attr, arguments)
+            info.context.connection_counts[page_key] = counts.get(k, 0)
+    if not load_nodes:
+        return
+
+    column_loads = []
+    if sort_pyname:
+        column_loads.append(getattr(ChildDBClass, sort_pyname))
+
+    child_rows = recursive_eager_load(
+        info, child_stmt, ChildDBClass, node_plan, column_loads
+    )
+    if not arguments and authorization_clause(info, authorize, ChildDBClass) is None:
+        set_relationship_values(relationship_attr, parents, child_rows)
+        return
+
+    # A relationship loaded with arguments or an authorization filter holds
+    # only part of the collection, so it's kept aside for the resolver instead.
+    pages: Dict[int, List[Any]] = {k: [] for k in parent_ids}
+    for row in child_rows:
+        pages[row[1]].append(row[0])
+    for k, nodes in pages.items():
+        page_key = connection_page_key(parents[k], relationship_attr, arguments)
+        info.context.connection_pages[page_key] = nodes
+
+
+def build_balance_stmt(today: datetime.date, *group_by: Any) -> Select:
+    """Sum the remaining balances of billing charges in one grouped statement.
+
+    Rows are `(*group_by, total_due, overdue, next_due_date, overdue_charges)`
+    where overdue counts charges with a balance left past their due date and
+    next_due_date is the earliest due date still to come on an unpaid charge.
+    """
+    remaining = DBBillingCharge.remaining_balance
+    is_overdue = sql_and(remaining > 0, DBBillingCharge.due_date < today)
+    return (
+        select(
+            *group_by,
+            sql_func.coalesce(sql_func.sum(remaining), 0).label("total_due"),
+            sql_func.coalesce(
+                sql_func.sum(case((is_overdue, remaining), else_=0)), 0
+            ).label("overdue"),
+            sql_func.min(
+                case(
+                    (
+                        sql_and(remaining > 0, DBBillingCharge.due_date >= today),
+                        DBBillingCharge.due_date,
+                    )
+                )
+            ).label("next_due_date"),
+            sql_func.count(case((is_overdue, DBBillingCharge.id))).label(
+                "overdue_charges"
+            ),
+        )
+        .select_from(DBBillingCharge)
+        .group_by(*group_by)
+    )
+
+
+def get_by_ids(
+    db_session: Session, DBModelClass: Any, ids: List[int]
+) -> Dict[int, Any]:
+    """Load every object of a mutation's input with one `IN (...)` query."""
+    stmt = select(DBModelClass).where(DBModelClass.id.in_(ids))
+    return {obj.id: obj for obj in db_session.scalars(stmt)}
+
+
+class MutationItems:
+    """Commits the items of a mutation that takes a list of inputs.
+
+    Each item runs in a savepoint, so one that fails is rolled back and
+    reported on its own. By default every item is then committed as soon
+    as it's done. In batch mode the whole input shares one transaction
+    instead, and the items are committed together by commit().
+    """
+
+    def __init__(self, db_session: Session, batch: bool = False):
+        self.db_session = db_session
+        self.batch = batch
+
+    @contextmanager
+    def item(self) -> Iterator[None]:
+        """Commit, or in batch mode release, the changes made in the block.
+
+        Changes have to be made inside the block; anything changed before
+        it is flushed outside of the item's savepoint.
+        """
+        with self.db_session.begin_nested():
+            yield
+        if self.batch:
+            return
+        try:
+            self.db_session.commit()
+        except Exception:
+            self.db_session.rollback()
+            raise
+
+    def units(self, objects: List[Any]) -> List[List[Any]]:
+        """Split objects that are changed the same way into items.
+
+        A batch makes them one item, so the changes are flushed together
+        and sent as a single executemany statement.
+        """
+        if self.batch:
+            return [objects] if objects else []
+        return [[obj] for obj in objects]
+
+    def commit(self) -> bool:
+        """Commit a batch, returning whether it could be."""
+        if not self.batch:
+            return True
+        try:
+            self.db_session.commit()
+        except Exception:
+            self.db_session.rollback()
+            return False
+        return True
@@ -0,0 +1,613 @@
+#  Nido gql_json.py
+#  Copyright (C) John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Answer read-only queries with a single SQL statement that builds their JSON.
+
+Every object in the result becomes a `json_object(...)` and every list an
+aggregate with `json_group_array(...)` (json_build_object and json_agg on
+Postgres), so a whole page comes back as one JSON document without
+constructing any ORM objects.
+
+Rather than nesting a correlated subquery per level, which quickly runs into
+the depth limits of SQLite's parser, each relationship becomes two CTEs: its
+rows, limited to the children of the rows one level up, and their JSON
+aggregated by parent, which is joined onto the level above.
+
+Only documents whose every field maps directly onto the database can be
+compiled. Resolvers aren't run, so fields opt in through their metadata with
+
+* `"mapped": True`: the field returns the model's column or relationship of
+  the same name, unchanged,
+* `"sql"`: a function of the request context and the parent entity returning
+  a column expression for the field's value, or
+* `"relationship_stmt"`: a function returning the same statement, child class
+  and parent id column as build_relationship_stmt, for list and connection
+  fields that aren't a relationship.
+
+Anything else, including fields with arguments, pagination cursors and
+operations with variables, raises UnsupportedSelection, and JSONQueryCache
+remembers to leave that document to normal execution.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from graphql import (
+    DocumentNode,
+    FieldNode,
+    FragmentDefinitionNode,
+    GraphQLError,
+    GraphQLObjectType,
+    OperationType,
+    get_named_type,
+    get_nullable_type,
+    get_operation_ast,
+    is_list_type,
+    is_object_type,
+    specified_rules,
+)
+from graphql.execution.collect_fields import collect_fields, collect_sub_fields
+from sqlalchemy import ColumnElement, case
+from sqlalchemy import func as sql_func
+from sqlalchemy import inspect, literal_column, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import ColumnProperty, Relationship, aliased
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import JSON
+from strawberry import Schema
+from strawberry.schema.execute import parse_document, validate_document
+
+from .authorization import authorized_filter, has_authorized_filter
+from .db_models import DBCommunity, DBUser
+from .gql_extensions import DocumentCache, hash_query
+from .gql_helpers import build_relationship_stmt, encode_gql_id
+
+
+class UnsupportedSelection(Exception):
+    pass
+
+
+class json_object(FunctionElement):
+    """json_object(key, value, ...), building a JSON object from pairs."""
+
+    type = JSON()
+    inherit_cache = True
+
+
+class json_array_agg(FunctionElement):
+    """json_array_agg(value, order_by), aggregating values into a JSON array.
+
+    SQLite can't order within an aggregate, so there the rows must already
+    come from an ordered subquery.
+    """
+
+    type = JSON()
+    inherit_cache = True
+
+
+class json_value(FunctionElement):
+    """Mark a column or subquery's result as JSON, rather than a string."""
+
+    type = JSON()
+    inherit_cache = True
+
+
+class json_array(FunctionElement):
+    """json_value for an aggregated array, which is NULL for no rows."""
+
+    type = JSON()
+    inherit_cache = True
+
+
+class json_boolean(FunctionElement):
+    """A SQL boolean as JSON true or false, since SQLite stores 1 and 0."""
+
+    type = JSON()
+    inherit_cache = True
+
+
+@compiles(json_object)
+def compile_json_object(element, compiler, **kw):
+    return "json_object(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(json_object, "postgresql")
+def compile_json_object_postgresql(element, compiler, **kw):
+    return "json_build_object(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(json_array_agg)
+def compile_json_array_agg(element, compiler, **kw):
+    value, _ = element.clauses
+    return "json_group_array(%s)" % compiler.process(value, **kw)
+
+
+@compiles(json_array_agg, "postgresql")
+def compile_json_array_agg_postgresql(element, compiler, **kw):
+    value, order_by = element.clauses
+    return "json_agg(%s ORDER BY %s)" % (
+        compiler.process(value, **kw),
+        compiler.process(order_by, **kw),
+    )
+
+
+@compiles(json_value)
+def compile_json_value(element, compiler, **kw):
+    # SQLite forgets a value is JSON once it's returned from a subquery.
+    return "json(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(json_value, "postgresql")
+def compile_json_value_postgresql(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(json_array)
+def compile_json_array(element, compiler, **kw):
+    return "json(coalesce(%s, '[]'))" % compiler.process(element.clauses, **kw)
+
+
+@compiles(json_array, "postgresql")
+def compile_json_array_postgresql(element, compiler, **kw):
+    return "coalesce(%s, '[]'::json)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(json_boolean)
+def compile_json_boolean(element, compiler, **kw):
+    return "json(CASE %s WHEN 1 THEN 'true' WHEN 0 THEN 'false' END)" % (
+        compiler.process(element.clauses, **kw)
+    )
+
+
+@compiles(json_boolean, "postgresql")
+def compile_json_boolean_postgresql(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+# Scalars whose SQL value is already what GraphQL serializes them as.
+JSON_SCALARS = ("String", "Int", "Boolean", "Date")
+
+# The root fields that can be compiled, with the model and the id of the row
+# they return, which is None for users who aren't logged in.
+ROOT_FIELDS = {
+    "activeUser": (DBUser, lambda context: context.user_id),
+    "activeCommunity": (DBCommunity, lambda context: context.community_id),
+}
+
+
+def json_key(key: str) -> ColumnElement:
+    # Response keys are GraphQL names, which are safe to inline.
+    return literal_column(f"'{key}'")
+
+
+@dataclass
+class RowJSON:
+    """The JSON of each row of a CTE, and the FROM and WHERE to read it with."""
+
+    value: ColumnElement
+    from_clause: Any
+    where: Optional[ColumnElement]
+
+
+class JSONStatementBuilder:
+    """Build the statement for one execution of a document.
+
+    Ids are encoded in Python afterwards, so `id_shape` records where they
+    are in the result, as nested dicts of response keys ending in the name
+    of the table each id belongs to.
+    """
+
+    def __init__(self, schema: Schema, document: DocumentNode, context: Any):
+        self.gql_schema = schema._schema
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        self.document = document
+        self.context = context
+        self.id_shape: Dict[str, Any] = {}
+
+    def build(self):
+        operation = get_operation_ast(self.document)
+        if operation is None or operation.operation != OperationType.QUERY:
+            raise UnsupportedSelection("Only queries can be compiled")
+        if operation.variable_definitions:
+            raise UnsupportedSelection("Operations with variables can't be compiled")
+        query_type = self.gql_schema.query_type
+        assert query_type is not None
+        fields = collect_fields(
+            self.gql_schema, self.fragments, {}, query_type, operation.selection_set
+        )
+
+        values: List[ColumnElement] = []
+        for key, field_nodes in fields.items():
+            name = field_nodes[0].name.value
+            values.append(json_key(key))
+            if name == "__typename":
+                values.append(json_key(query_type.name))
+                continue
+            if name not in ROOT_FIELDS or field_nodes[0].arguments:
+                raise UnsupportedSelection(f"Can't compile the root field {name}")
+            DBModelClass, get_id = ROOT_FIELDS[name]
+            rows = (
+                select(DBModelClass)
+                .where(DBModelClass.id == get_id(self.context))
+                .cte()
+            )
+            gql_type = get_named_type(query_type.fields[name].type)
+            root = self.build_object(
+                gql_type,
+                field_nodes,
+                rows,
+                DBModelClass,
+                self.id_shape.setdefault(key, {}),
+            )
+            stmt = select(root.value).select_from(root.from_clause).limit(1)
+            if root.where is not None:
+                stmt = stmt.where(root.where)
+            values.append(json_value(stmt.scalar_subquery()))
+        return select(json_object(*values))
+
+    def build_object(
+        self,
+        gql_type: Any,
+        field_nodes: List[FieldNode],
+        rows: Any,
+        DBModelClass: Any,
+        id_shape: Dict[str, Any],
+    ) -> RowJSON:
+        """The JSON of the rows of `rows` as `gql_type`.
+
+        Rows of a polymorphic model get the fields of their own GraphQL type,
+        and rows without a GraphQL type under `gql_type` are left out, like
+        the resolvers leave them out.
+        """
+        mapper = inspect(DBModelClass).mapper
+        object_types = []
+        for submapper in mapper.self_and_descendants:
+            object_type = self.gql_schema.type_map.get(submapper.class_.__name__[2:])
+            if not is_object_type(object_type):
+                continue
+            if object_type is gql_type or self.gql_schema.is_sub_type(
+                gql_type, object_type
+            ):
+                object_types.append((submapper, object_type))
+
+        joins: List[Tuple[Any, ColumnElement]] = []
+        where = None
+        if mapper.polymorphic_on is None:
+            if len(object_types) != 1:
+                raise UnsupportedSelection(f"No object type for {gql_type.name}")
+            submapper, object_type = object_types[0]
+            entity = aliased(submapper.class_, rows)
+            value = self.build_fields(
+                object_type, field_nodes, entity, submapper.class_, joins, id_shape
+            )
+        else:
+            # Subclass aliases would each add their own discriminator
+            # criteria, so every type reads from an alias of the base class.
+            entity = aliased(mapper.class_, rows)
+            discriminator = rows.c[mapper.polymorphic_on.key]
+            whens = [
+                (
+                    discriminator == submapper.polymorphic_identity,
+                    self.build_fields(
+                        object_type,
+                        field_nodes,
+                        entity,
+                        submapper.class_,
+                        joins,
+                        id_shape,
+                    ),
+                )
+                for submapper, object_type in object_types
+            ]
+            value = case(*whens)
+            where = discriminator.in_(
+                [submapper.polymorphic_identity for submapper, _ in object_types]
+            )
+
+        from_clause = rows
+        for aggregate, onclause in joins:
+            from_clause = from_clause.outerjoin(aggregate, onclause)
+        return RowJSON(value, from_clause, where)
+
+    def build_fields(
+        self,
+        object_type: GraphQLObjectType,
+        field_nodes: List[FieldNode],
+        entity: Any,
+        DBModelClass: Any,
+        joins: List[Tuple[Any, ColumnElement]],
+        id_shape: Dict[str, Any],
+    ) -> ColumnElement:
+        fields = collect_sub_fields(
+            self.gql_schema, self.fragments, {}, object_type, field_nodes
+        )
+        values: List[ColumnElement] = []
+        for key, nodes in fields.items():
+            values.append(json_key(key))
+            values.append(
+                self.build_field(
+                    object_type, nodes, entity, DBModelClass, joins, id_shape, key
+                )
+            )
+        return json_object(*values)
+
+    def build_field(
+        self,
+        object_type: GraphQLObjectType,
+        field_nodes: List[FieldNode],
+        entity: Any,
+        DBModelClass: Any,
+        joins: List[Tuple[Any, ColumnElement]],
+        id_shape: Dict[str, Any],
+        key: str,
+    ) -> ColumnElement:
+        name = field_nodes[0].name.value
+        if name == "__typename":
+            return json_key(object_type.name)
+        if any(field_node.arguments for field_node in field_nodes):
+            raise UnsupportedSelection(f"Can't compile the arguments of {name}")
+        gql_field = object_type.fields[name]
+        strawberry_field = gql_field.extensions["strawberry-definition"]
+        if strawberry_field.permission_classes:
+            raise UnsupportedSelection(f"Can't compile the permissions of {name}")
+        metadata = strawberry_field.metadata
+        pyname = strawberry_field.python_name
+        named_type = get_named_type(gql_field.type)
+
+        if sql := metadata.get("sql"):
+            return self.build_scalar(named_type, sql(self.context, entity))
+        if relationship_stmt := metadata.get("relationship_stmt"):
+            child_stmt, ChildDBClass, parent_id_col = relationship_stmt()
+        elif not metadata.get("mapped"):
+            # Its resolver may do more than read the database, like
+            # Right.parentRight leaving out a right's own row.
+            raise UnsupportedSelection(f"{name} isn't mapped onto the database")
+        elif pyname == "id":
+            id_shape[key] = DBModelClass.__tablename__
+            return entity.id
+        else:
+            db_model_attr = getattr(DBModelClass, pyname, None)
+            db_property = getattr(db_model_attr, "property", None)
+            if isinstance(db_property, ColumnProperty):
+                column = getattr(entity, pyname, None)
+                if column is None:
+                    # A subclass's column, read from the base class's rows.
+                    rows = inspect(entity).selectable
+                    column = rows.corresponding_column(db_property.columns[0])
+                    if column is None:
+                        raise UnsupportedSelection(f"Can't compile {name}")
+                return self.build_scalar(named_type, column)
+            if not isinstance(db_property, Relationship):
+                raise UnsupportedSelection(f"{name} isn't in the database")
+            child_stmt, ChildDBClass, parent_id_col = build_relationship_stmt(
+                DBModelClass, db_model_attr
+            )
+
+        child_stmt = child_stmt.where(parent_id_col.in_(select(entity.id)))
+        ChildModelClass = inspect(ChildDBClass).class_
+        if authorize := metadata.get("authorize"):
+            if not has_authorized_filter(authorize, ChildModelClass):
+                raise UnsupportedSelection(f"No SQL filter for {authorize} on {name}")
+            clause = authorized_filter(
+                self.context.principal, authorize, ChildModelClass, ChildDBClass
+            )
+            if clause is not None:
+                child_stmt = child_stmt.where(clause)
+        child_rows = child_stmt.cte()
+        child_shape = id_shape.setdefault(key, {})
+
+        if named_type.name.endswith("Connection"):
+            return self.build_connection(
+                named_type,
+                field_nodes,
+                entity,
+                joins,
+                child_rows,
+                ChildModelClass,
+                child_shape,
+            )
+        child = self.build_object(
+            named_type, field_nodes, child_rows, ChildModelClass, child_shape
+        )
+        if is_list_type(get_nullable_type(gql_field.type)):
+            aggregate = self.build_aggregate(child_rows, child, child.value)
+            joins.append((aggregate, aggregate.c.parent_id == entity.id))
+            return json_array(aggregate.c.value)
+
+        stmt = select(child_rows.c.parent_id, child.value.label("value"))
+        stmt = stmt.select_from(child.from_clause)
+        if child.where is not None:
+            stmt = stmt.where(child.where)
+        single = stmt.cte()
+        joins.append((single, single.c.parent_id == entity.id))
+        return json_value(single.c.value)
+
+    def build_scalar(self, named_type: Any, expr: Any) -> ColumnElement:
+        if named_type.name not in JSON_SCALARS:
+            raise UnsupportedSelection(f"Can't compile {named_type.name} values")
+        if named_type.name == "Boolean":
+            return json_boolean(expr)
+        return expr
+
+    def build_aggregate(self, child_rows: Any, child: RowJSON, value: ColumnElement):
+        """Aggregate `value` for each row of `child` by parent, ordered by id."""
+        ordered = select(
+            child_rows.c.parent_id, child_rows.c.id, value.label("value")
+        ).select_from(child.from_clause)
+        if child.where is not None:
+            ordered = ordered.where(child.where)
+        ordered = ordered.order_by(child_rows.c.parent_id, child_rows.c.id).subquery()
+        return (
+            select(
+                ordered.c.parent_id,
+                json_array_agg(json_value(ordered.c.value), ordered.c.id).label(
+                    "value"
+                ),
+                sql_func.count().label("total"),
+            )
+            .group_by(ordered.c.parent_id)
+            .cte()
+        )
+
+    def build_connection(
+        self,
+        connection_type: GraphQLObjectType,
+        field_nodes: List[FieldNode],
+        entity: Any,
+        joins: List[Tuple[Any, ColumnElement]],
+        child_rows: Any,
+        ChildModelClass: Any,
+        id_shape: Dict[str, Any],
+    ) -> ColumnElement:
+        fields = collect_sub_fields(
+            self.gql_schema, self.fragments, {}, connection_type, field_nodes
+        )
+        edge_type = get_named_type(connection_type.fields["edges"].type)
+        node_type = get_named_type(edge_type.fields["node"].type)  # type: ignore
+        edges = [key for key, n in fields.items() if n[0].name.value == "edges"]
+        if len(edges) > 1:
+            raise UnsupportedSelection("Can't compile edges more than once")
+        edge_fields = collect_sub_fields(
+            self.gql_schema,
+            self.fragments,
+            {},
+            edge_type,  # type: ignore
+            fields[edges[0]] if edges else [],
+        )
+        node_nodes: List[FieldNode] = []
+        edge_values: List[ColumnElement] = []
+        edge_shape = id_shape.setdefault(edges[0], {}) if edges else {}
+        node_key = None
+        for edge_key, nodes in edge_fields.items():
+            edge_name = nodes[0].name.value
+            if edge_name == "node" and node_key is None:
+                node_key, node_nodes = edge_key, nodes
+            elif edge_name != "__typename":
+                raise UnsupportedSelection(f"Can't compile the edges' {edge_name}")
+
+        child = self.build_object(
+            node_type,
+            node_nodes,
+            child_rows,
+            ChildModelClass,
+            edge_shape.setdefault(node_key or "node", {}),
+        )
+        for edge_key, nodes in edge_fields.items():
+            edge_values.append(json_key(edge_key))
+            if edge_key == node_key:
+                edge_values.append(child.value)
+            else:
+                edge_values.append(json_key(edge_type.name))
+        aggregate = self.build_aggregate(child_rows, child, json_object(*edge_values))
+        joins.append((aggregate, aggregate.c.parent_id == entity.id))
+
+        values: List[ColumnElement] = []
+        for key, nodes in fields.items():
+            name = nodes[0].name.value
+            values.append(json_key(key))
+            if name == "__typename":
+                values.append(json_key(connection_type.name))
+            elif name == "totalCount":
+                values.append(sql_func.coalesce(aggregate.c.total, 0))
+            elif name == "edges":
+                values.append(json_array(aggregate.c.value))
+            else:
+                raise UnsupportedSelection(f"Can't compile the connection's {name}")
+        return json_object(*values)
+
+
+def encode_ids(value: Any, id_shape: Dict[str, Any]):
+    if isinstance(value, list):
+        for item in value:
+            encode_ids(item, id_shape)
+        return
+    if not isinstance(value, dict):
+        return
+    for key, shape in id_shape.items():
+        if value.get(key) is None:
+            continue
+        if isinstance(shape, str):
+            value[key] = encode_gql_id(shape, value[key])
+        else:
+            encode_ids(value[key], shape)
+
+
+class JSONQueryCache:
+    """Which documents compile to a single statement, keyed by query hash.
+
+    execute() returns the data of a query, or None when the query has to be
+    executed normally instead, because it can't be compiled or the user
+    isn't logged in. Documents are parsed through the DocumentCache when
+    one is given.
+    """
+
+    def __init__(
+        self,
+        schema: Schema,
+        document_cache: Optional[DocumentCache] = None,
+        maxsize: int = 256,
+    ):
+        self.schema = schema
+        self.document_cache = document_cache
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._documents: OrderedDict[str, Optional[DocumentNode]] = OrderedDict()
+
+    def get_document(self, query: str) -> Optional[DocumentNode]:
+        query_hash = hash_query(query)
+        with self._lock:
+            if query_hash in self._documents:
+                self._documents.move_to_end(query_hash)
+                return self._documents[query_hash]
+        entry = self.document_cache.get(query_hash) if self.document_cache else None
+        if entry is not None:
+            return entry[1]
+        try:
+            document = parse_document(query)
+        except GraphQLError:
+            return None
+        errors = validate_document(self.schema._schema, document, specified_rules)
+        return None if errors else document
+
+    def set_document(self, query: str, document: Optional[DocumentNode]):
+        with self._lock:
+            self._documents[hash_query(query)] = document
+            while len(self._documents) > self.maxsize:
+                self._documents.popitem(last=False)
+
+    def execute(self, query: str, context: Any) -> Optional[Dict[str, Any]]:
+        if context.user_id is None:
+            return None
+        document = self.get_document(query)
+        if document is None:
+            self.set_document(query, None)
+            return None
+        builder = JSONStatementBuilder(self.schema, document, context)
+        try:
+            stmt = builder.build()
+        except UnsupportedSelection:
+            self.set_document(query, None)
+            return None
+        self.set_document(query, document)
+        data = context.db_session.scalar(stmt)
+        encode_ids(data, builder.id_shape)
+        return data
@@ -20,10 +20,16 @@ from typing import List, Optional
 import strawberry
 from strawberry.types import Info
 
-from .authorization import AuthorizationError, oso
+from .authorization import AuthorizationError
 from .db_models import DBBillingCharge
 from .gql_errors import DatabaseError, Error, NotFound, Unauthorized
-from .gql_helpers import decode_gql_id, gql_id_to_table_id_unchecked
+from .gql_helpers import (
+    MutationItems,
+    decode_gql_id,
+    eager_load_payload,
+    get_by_ids,
+    gql_id_to_table_id_unchecked,
+)
 from .gql_permissions import IsAuthenticated
 from .gql_query import BillingCharge
 
@@ -70,13 +76,14 @@ class DeleteBillingChargePayload:
 class BillingChargeMutations:
     @strawberry.mutation(permission_classes=[IsAuthenticated])
     def new(
-        self, info: Info, input: List[NewBillingChargeInput]
+        self, info: Info, input: List[NewBillingChargeInput], batch: bool = False
     ) -> NewBillingChargePayload:
         new_charges: List[BillingCharge] = []
         errors: List[Error] = []
 
         au = info.context.active_user
         community_id = info.context.community_id
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             (charged_to_type, charged_to_id) = decode_gql_id(i.charged_to)
             new_charge = DBBillingCharge(
@@ -90,73 +97,100 @@ class BillingChargeMutations:
             elif charged_to_type == "residence":
                 new_charge.residence_id = charged_to_id
             try:
-                oso.authorize(au, "create", new_charge)
+                info.context.authorization.authorize(au, "create", new_charge)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
-            info.context.db_session.add(new_charge)
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    info.context.db_session.add(new_charge)
                 new_charges.append(BillingCharge(db=new_charge))
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            return NewBillingChargePayload(
+                new_charges=[], errors=[*errors, DatabaseError()]
+            )
+        eager_load_payload(info, "newCharges", [n.db for n in new_charges])
         return NewBillingChargePayload(new_charges=new_charges, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
     def edit(
-        self, info: Info, input: List[EditBillingChargeInput]
+        self, info: Info, input: List[EditBillingChargeInput], batch: bool = False
     ) -> EditBillingChargePayload:
         charges: List[BillingCharge] = []
         errors: List[Error] = []
 
         user = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
+        existing = get_by_ids(
+            info.context.db_session,
+            DBBillingCharge,
+            [gql_id_to_table_id_unchecked(i.charge) for i in input],
+        )
+        edits = []
         for i in input:
-            charge = info.context.db_session.get(
-                DBBillingCharge, gql_id_to_table_id_unchecked(i.charge)
-            )
+            charge = existing.get(gql_id_to_table_id_unchecked(i.charge))
+            if not charge:
+                errors.append(NotFound())
+                continue
             try:
-                oso.authorize(user, "edit", charge)
+                info.context.authorization.authorize(user, "edit", charge)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
-            if i.name is not strawberry.UNSET:
-                charge.name = i.name
-            if i.amount is not strawberry.UNSET:
-                charge.amount = i.amount
-            if i.due_date is not strawberry.UNSET:
-                charge.due_date = i.due_date
-            info.context.db_session.add(charge)
+            edits.append((charge, i))
+        for unit in items.units(edits):
             try:
-                info.context.db_session.commit()
-                charges.append(BillingCharge(db=charge))
+                with items.item():
+                    for charge, i in unit:
+                        if i.name is not strawberry.UNSET:
+                            charge.name = i.name
+                        if i.amount is not strawberry.UNSET:
+                            charge.amount = i.amount
+                        if i.due_date is not strawberry.UNSET:
+                            charge.due_date = i.due_date
+                charges.extend(BillingCharge(db=charge) for charge, _ in unit)
             except:
-                errors.append(DatabaseError())
-                info.context.db_session.rollback()
+                errors.extend(DatabaseError() for _ in unit)
+        if not items.commit():
+            return EditBillingChargePayload(
+                charges=[], errors=[*errors, DatabaseError()]
+            )
+        eager_load_payload(info, "charges", [n.db for n in charges])
         return EditBillingChargePayload(charges=charges, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
     def delete(
-        self, info: Info, input: List[DeleteBillingChargeInput]
+        self, info: Info, input: List[DeleteBillingChargeInput], batch: bool = False
     ) -> DeleteBillingChargePayload:
         errors: List[Error] = []
         user = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
+        existing = get_by_ids(
+            info.context.db_session,
+            DBBillingCharge,
+            [gql_id_to_table_id_unchecked(i.charge) for i in input],
+        )
+        deletions = []
         for i in input:
-            group = info.context.db_session.get(
-                DBBillingCharge, gql_id_to_table_id_unchecked(i.charge)
-            )
-            if not group:
+            charge = existing.get(gql_id_to_table_id_unchecked(i.charge))
+            if not charge:
                 errors.append(NotFound())
                 continue
             try:
-                oso.authorize(user, "delete", group)
+                info.context.authorization.authorize(user, "delete", charge)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
-            info.context.db_session.delete(group)
+            deletions.append(charge)
+        for unit in items.units(deletions):
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    for charge in unit:
+                        info.context.db_session.delete(charge)
             except:
-                errors.append(DatabaseError())
-                info.context.db_session.rollback()
+                errors.extend(DatabaseError() for _ in unit)
+        if not items.commit():
+            return DeleteBillingChargePayload(errors=[*errors, DatabaseError()])
         return DeleteBillingChargePayload(errors=errors)
@@ -22,7 +22,6 @@ from sqlalchemy import delete
 from sqlalchemy.exc import IntegrityError
 from strawberry.types import Info
 
-from .authorization import oso
 from .db_models import DBContactMethod, DBEmailContact, DBUser
 from .gql_errors import (
     DatabaseError,
@@ -31,7 +30,7 @@ from .gql_errors import (
     Unauthorized,
     parse_integrity_error,
 )
-from .gql_helpers import gql_id_to_table_id_unchecked
+from .gql_helpers import MutationItems, get_by_ids, gql_id_to_table_id_unchecked
 from .gql_permissions import IsAuthenticated
 from .gql_query import EmailContact
 
@@ -60,46 +59,64 @@ class DeleteCMPayload:
 @strawberry.type
 class ContactMethodMutations:
     @strawberry.mutation(permission_classes=[IsAuthenticated])
-    def new_email(self, info: Info, input: List[NewEmailCMInput]) -> NewEmailCMPayload:
+    def new_email(
+        self, info: Info, input: List[NewEmailCMInput], batch: bool = False
+    ) -> NewEmailCMPayload:
         email_contacts: List[EmailContact] = []
         errors: List[Error] = []
 
         au = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             new_contact = DBEmailContact(user_id=au.id, email=i.email)
-            info.context.db_session.add(new_contact)
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    info.context.db_session.add(new_contact)
                 email_contacts.append(EmailContact(db=new_contact))
             except IntegrityError as ie:
                 gql_err = parse_integrity_error(ie)
                 errors.append(gql_err)
-                info.context.db_session.rollback()
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            return NewEmailCMPayload(
+                email_contacts=[], errors=[*errors, DatabaseError()]
+            )
+        eager_load_payload(info, "emailContacts", [n.db for n in email_contacts])
         return NewEmailCMPayload(email_contacts=email_contacts, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
-    def delete(self, info: Info, input: List[DeleteCMInput]) -> DeleteCMPayload:
+    def delete(
+        self, info: Info, input: List[DeleteCMInput], batch: bool = False
+    ) -> DeleteCMPayload:
         errors: List[Error] = []
 
         au = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
+        existing = get_by_ids(
+            info.context.db_session,
+            DBContactMethod,
+            [gql_id_to_table_id_unchecked(i.id) for i in input],
+        )
+        deletions = []
         for i in input:
-            cm_id = gql_id_to_table_id_unchecked(i.id)
-            cm = info.context.db_session.get(DBContactMethod, cm_id)
+            cm = existing.get(gql_id_to_table_id_unchecked(i.id))
             if not cm:
                 errors.append(NotFound())
                 continue
             try:
-                oso.authorize(au, "delete", cm)
+                info.context.authorization.authorize(au, "delete", cm)
             except:
                 errors.append(NotFound())
                 continue
-            info.context.db_session.delete(cm)
+            deletions.append(cm)
+        for unit in items.units(deletions):
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    for cm in unit:
+                        info.context.db_session.delete(cm)
             except:
-                errors.append(DatabaseError())
-                info.context.db_session.rollback()
+                errors.extend(DatabaseError() for _ in unit)
+        if not items.commit():
+            return DeleteCMPayload(errors=[*errors, DatabaseError()])
         return DeleteCMPayload(errors=errors)
@@ -20,10 +20,10 @@ import strawberry
 from sqlalchemy import delete
 from strawberry.types import Info
 
-from .authorization import AuthorizationError, oso
-from .db_models import DBGroup, DBGroupMembership, DBUser
+from .authorization import AuthorizationError
+from .db_models import DBGroup, DBGroupMembership, DBUser, increment_permissions_version
 from .gql_errors import DatabaseError, Error, NotFound, Unauthorized
-from .gql_helpers import gql_id_to_table_id_unchecked
+from .gql_helpers import MutationItems, eager_load_payload, gql_id_to_table_id_unchecked
 from .gql_permissions import IsAuthenticated
 from .gql_query import Group
 
@@ -103,16 +103,19 @@ class DeleteGroupPayload:
 @strawberry.type
 class GroupMutations:
     @strawberry.mutation(permission_classes=[IsAuthenticated])
-    def new(self, info: Info, input: List[NewGroupInput]) -> NewGroupPayload:
+    def new(
+        self, info: Info, input: List[NewGroupInput], batch: bool = False
+    ) -> NewGroupPayload:
         new_groups: List[Group] = []
         errors: List[Error] = []
 
         au = info.context.active_user
         community_id = info.context.community_id
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             ng = DBGroup(name=i.name, community_id=community_id)
             try:
-                oso.authorize(au, "create", ng)
+                info.context.authorization.authorize(au, "create", ng)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
@@ -124,122 +127,145 @@ class GroupMutations:
                 ng.managing_group_id = managing_id
             else:
                 ng.managed_by = ng
-            info.context.db_session.add(ng)
-            if i.custom_members:
-                for mem_id in i.custom_members:
-                    entry = DBGroupMembership(
-                        member_id=gql_id_to_table_id_unchecked(mem_id),
-                        community_id=community_id,
-                    )
-                    entry.group = ng
-                    info.context.db_session.add(entry)
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    info.context.db_session.add(ng)
+                    if i.custom_members:
+                        for mem_id in i.custom_members:
+                            entry = DBGroupMembership(
+                                member_id=gql_id_to_table_id_unchecked(mem_id),
+                                community_id=community_id,
+                            )
+                            entry.group = ng
+                            info.context.db_session.add(entry)
+                info.context.permissions_changed()
                 new_groups.append(Group(db=ng))
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            info.context.permissions_changed()
+            return NewGroupPayload(groups=[], errors=[*errors, DatabaseError()])
+        eager_load_payload(info, "groups", [n.db for n in new_groups])
         return NewGroupPayload(groups=new_groups, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
-    def rename(self, info: Info, input: List[RenameGroupInput]) -> RenameGroupPayload:
+    def rename(
+        self, info: Info, input: List[RenameGroupInput], batch: bool = False
+    ) -> RenameGroupPayload:
         groups: List[Group] = []
         errors: List[Error] = []
 
         user = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             group = info.context.db_session.get(
                 DBGroup, gql_id_to_table_id_unchecked(i.group)
             )
             try:
-                oso.authorize(user, "update", group)
+                info.context.authorization.authorize(user, "update", group)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
-            group.name = i.name
-            info.context.db_session.add(group)
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    group.name = i.name
                 groups.append(Group(db=group))
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            return RenameGroupPayload(groups=[], errors=[*errors, DatabaseError()])
+        eager_load_payload(info, "groups", [n.db for n in groups])
         return RenameGroupPayload(groups=groups, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
     def change_managed_by(
-        self, info: Info, input: List[ChangeManagedByGroupInput]
+        self, info: Info, input: List[ChangeManagedByGroupInput], batch: bool = False
     ) -> ChangeManagedByGroupPayload:
         groups: List[Group] = []
         errors: List[Error] = []
 
         user = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             group = info.context.db_session.get(
                 DBGroup, gql_id_to_table_id_unchecked(i.group)
             )
             try:
-                oso.authorize(user, "update", group)
+                info.context.authorization.authorize(user, "update", group)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
-            group.managing_group_id = gql_id_to_table_id_unchecked(i.managing_group)
-            info.context.db_session.add(group)
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    group.managing_group_id = gql_id_to_table_id_unchecked(
+                        i.managing_group
+                    )
+                info.context.permissions_changed()
                 groups.append(Group(db=group))
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            info.context.permissions_changed()
+            return ChangeManagedByGroupPayload(
+                groups=[], errors=[*errors, DatabaseError()]
+            )
+        eager_load_payload(info, "groups", [n.db for n in groups])
         return ChangeManagedByGroupPayload(groups=groups, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
     def add_members(
-        self, info: Info, input: List[AddMembersGroupInput]
+        self, info: Info, input: List[AddMembersGroupInput], batch: bool = False
     ) -> AddMembersGroupPayload:
         groups: List[Group] = []
         errors: List[Error] = []
 
         user = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             group = info.context.db_session.get(
                 DBGroup, gql_id_to_table_id_unchecked(i.group)
             )
             try:
-                oso.authorize(user, "update", group)
+                info.context.authorization.authorize(user, "update", group)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
-            for m_id in i.members:
-                entry = DBGroupMembership(
-                    member_id=gql_id_to_table_id_unchecked(m_id),
-                )
-                entry.group = group
-                info.context.db_session.add(entry)
-            info.context.db_session.add(group)
             try:
-                info.context.db_session.commit()
+                # The memberships are flushed together, so they're inserted
+                # with one executemany statement.
+                with items.item():
+                    for m_id in i.members:
+                        entry = DBGroupMembership(
+                            member_id=gql_id_to_table_id_unchecked(m_id),
+                        )
+                        entry.group = group
+                        info.context.db_session.add(entry)
+                info.context.permissions_changed()
                 groups.append(Group(db=group))
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            info.context.permissions_changed()
+            return AddMembersGroupPayload(groups=[], errors=[*errors, DatabaseError()])
+        eager_load_payload(info, "groups", [n.db for n in groups])
         return AddMembersGroupPayload(groups=groups, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
     def remove_members(
-        self, info: Info, input: List[RemoveMembersGroupInput]
+        self, info: Info, input: List[RemoveMembersGroupInput], batch: bool = False
     ) -> RemoveMembersGroupPayload:
         groups: List[Group] = []
         errors: List[Error] = []
 
         user = info.context.active_user
         community_id = info.context.community_id
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             group = info.context.db_session.get(
                 DBGroup, gql_id_to_table_id_unchecked(i.group)
             )
             try:
-                oso.authorize(user, "update", group)
+                info.context.authorization.authorize(user, "update", group)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
@@ -250,19 +276,32 @@ class GroupMutations:
                     [gql_id_to_table_id_unchecked(m_id) for m_id in i.members]
                 ),
             )
-            info.context.db_session.execute(stmt)
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    info.context.db_session.execute(stmt)
+                    # The delete bypasses the flush that would do this.
+                    increment_permissions_version(
+                        info.context.db_session.connection(), [community_id]
+                    )
+                info.context.permissions_changed()
                 groups.append(Group(db=group))
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            info.context.permissions_changed()
+            return RemoveMembersGroupPayload(
+                groups=[], errors=[*errors, DatabaseError()]
+            )
+        eager_load_payload(info, "groups", [n.db for n in groups])
         return RemoveMembersGroupPayload(groups=groups, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
-    def delete(self, info: Info, input: List[DeleteGroupInput]) -> DeleteGroupPayload:
+    def delete(
+        self, info: Info, input: List[DeleteGroupInput], batch: bool = False
+    ) -> DeleteGroupPayload:
         errors: List[Error] = []
         user = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             group = info.context.db_session.get(
                 DBGroup, gql_id_to_table_id_unchecked(i.group)
@@ -271,14 +310,17 @@ class GroupMutations:
                 errors.append(NotFound())
                 continue
             try:
-                oso.authorize(user, "delete", group)
+                info.context.authorization.authorize(user, "delete", group)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
-            info.context.db_session.delete(group)
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    info.context.db_session.delete(group)
+                info.context.permissions_changed()
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            info.context.permissions_changed()
+            return DeleteGroupPayload(errors=[*errors, DatabaseError()])
         return DeleteGroupPayload(errors=errors)
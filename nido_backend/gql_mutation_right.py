@@ -14,15 +14,14 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from functools import reduce
 from typing import List, Optional
 
 import strawberry
 from sqlalchemy.exc import IntegrityError
 from strawberry.types import Info
 
-from .authorization import AuthorizationError, oso
-from .db_models import DBRight
+from .authorization import AuthorizationError
+from .db_models import DBRight, as_permissions
 from .enums import PermissionsFlag
 from .gql_errors import (
     DatabaseError,
@@ -31,7 +30,7 @@ from .gql_errors import (
     Unauthorized,
     parse_integrity_error,
 )
-from .gql_helpers import gql_id_to_table_id_unchecked
+from .gql_helpers import MutationItems, eager_load_payload, gql_id_to_table_id_unchecked
 from .gql_permissions import IsAuthenticated
 from .gql_query import Right
 
@@ -63,43 +62,52 @@ class RevokeRightPayload:
 class RightMutations:
     @strawberry.mutation(permission_classes=[IsAuthenticated])
     def delegate(
-        self, info: Info, input: List[DelegateRightInput]
+        self, info: Info, input: List[DelegateRightInput], batch: bool = False
     ) -> DelegateRightPayload:
         new_rights: List[Right] = []
         errors: List[Error] = []
 
         au = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             parent_id = gql_id_to_table_id_unchecked(i.parent_id)
             parent_right = info.context.db_session.get(DBRight, parent_id)
             new_right = DBRight(name=i.name, community_id=info.context.community_id)
-            new_right.parent_right = parent_right
-            new_right.permissions = reduce(
-                lambda a, b: a | b, i.permissions, PermissionsFlag(0)
-            )
-            info.context.db_session.add(new_right)
-            info.context.db_session.flush()
+            new_right.permissions = as_permissions(i.permissions)
             try:
-                oso.authorize(au, "delegate", new_right)
+                with items.item():
+                    # The right is flushed first so the policy can check its
+                    # delegation chain; refusing it rolls the item back.
+                    new_right.parent_right = parent_right
+                    info.context.db_session.add(new_right)
+                    info.context.db_session.flush()
+                    info.context.authorization.authorize(au, "delegate", new_right)
+                info.context.permissions_changed()
+                new_rights.append(Right(db=new_right))
             except AuthorizationError as err:
                 errors.append(Unauthorized())
-                continue
-            try:
-                info.context.db_session.commit()
-                new_rights.append(Right(db=new_right))
+                # The next right can be flushed with the same id.
+                info.context.authorization.clear()
             except IntegrityError as ie:
                 gql_err = parse_integrity_error(ie)
                 errors.append(gql_err)
-                info.context.db_session.rollback()
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            info.context.permissions_changed()
+            return DelegateRightPayload(
+                new_rights=[], errors=[*errors, DatabaseError()]
+            )
+        eager_load_payload(info, "newRights", [n.db for n in new_rights])
         return DelegateRightPayload(new_rights=new_rights, errors=errors)
 
     @strawberry.mutation(permission_classes=[IsAuthenticated])
-    def revoke(self, info: Info, input: List[RevokeRightInput]) -> RevokeRightPayload:
+    def revoke(
+        self, info: Info, input: List[RevokeRightInput], batch: bool = False
+    ) -> RevokeRightPayload:
         errors: List[Error] = []
         user = info.context.active_user
+        items = MutationItems(info.context.db_session, batch)
         for i in input:
             right = info.context.db_session.get(
                 DBRight, gql_id_to_table_id_unchecked(i.right)
@@ -108,14 +116,17 @@ class RightMutations:
                 errors.append(NotFound())
                 continue
             try:
-                oso.authorize(user, "revoke", right)
+                info.context.authorization.authorize(user, "revoke", right)
             except AuthorizationError as err:
                 errors.append(Unauthorized())
                 continue
-            info.context.db_session.delete(right)
             try:
-                info.context.db_session.commit()
+                with items.item():
+                    info.context.db_session.delete(right)
+                info.context.permissions_changed()
             except:
                 errors.append(DatabaseError())
-                info.context.db_session.rollback()
+        if not items.commit():
+            info.context.permissions_changed()
+            return RevokeRightPayload(errors=[*errors, DatabaseError()])
         return RevokeRightPayload(errors=errors)
@@ -15,16 +15,31 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import datetime
-from dataclasses import dataclass, field
-from typing import Generic, List, Optional, Type, TypeVar
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 import strawberry
+from sqlalchemy import ColumnElement, Row, Select
+from sqlalchemy import and_ as sql_and
+from sqlalchemy import case
 from sqlalchemy import func as sql_func
-from sqlalchemy import select
+from sqlalchemy import inspect, literal, select
+from sqlalchemy.orm import InstrumentedAttribute
 from strawberry.types import Info
-from strawberry.types.nodes import SelectedField
 
-from .authorization import oso
+from .authorization import QUERY_FILTERS
 from .db_models import (
     Base,
     DBAssociate,
@@ -35,31 +50,52 @@ from .db_models import (
     DBEmailContact,
     DBGroup,
     DBGroupMembership,
-    DBNode,
     DBResidence,
     DBResidenceOccupancy,
     DBRight,
+    DBRightClosure,
     DBUser,
 )
 from .enums import ApplicationStatus, PermissionsFlag
 from .gql_helpers import (
+    PAGINATION_ARGS,
+    authorization_clause,
+    build_balance_stmt,
+    build_connection_stmt,
+    build_count_stmt,
+    connection_page_key,
+    decode_gql_id,
+    encode_cursor,
     encode_gql_id,
+    get_field_arguments,
+    get_sort_pyname,
     gql_id_to_table_id_unchecked,
+    page_nodes,
+    paginate_select,
     recursive_eager_load,
+    selects_connection_nodes,
 )
 from .gql_permissions import IsAuthenticated
 
-DB = TypeVar("DB", bound=DBNode)
-
 
 @strawberry.interface
-class Node(Generic[DB]):
-    db: strawberry.Private[DB]
-    dbtype: strawberry.Private[Type[Base]] = field(init=False, repr=False)
-
-    @strawberry.field
+class Node:
+    # Connections make a wrapper per edge, so they're slotted. Implementations
+    # declare empty __slots__ to keep instances dict-free, except User, whose
+    # reference_community_id default would clash with a slot.
+    __slots__ = ("db", "_gql_id")
+    # Implementations narrow db to their model class. Node isn't generic
+    # over it so that fields like Query.node can return the interface.
+    db: strawberry.Private[Any]
+    dbtype: ClassVar[Type[Base]]
+
+    @strawberry.field(metadata={"mapped": True})
     def id(self) -> strawberry.ID:
-        return encode_gql_id(self.dbtype.__tablename__, self.db.id)
+        try:
+            return self._gql_id
+        except AttributeError:
+            self._gql_id = encode_gql_id(self.dbtype.__tablename__, self.db.id)
+            return self._gql_id
 
 
 N = TypeVar("N", bound=Node)
@@ -67,244 +103,613 @@ N = TypeVar("N", bound=Node)
 
 @strawberry.type
 class Edge(Generic[N]):
+    __slots__ = ("node", "sort_value")
     node: N
+    sort_value: strawberry.Private[Any]
 
     @strawberry.field
     def cursor(self) -> str:
-        return self.node.id
+        return encode_cursor(self.sort_value, self.node.db.id)
+
+
+@strawberry.type
+class PageInfo:
+    has_next_page: bool
+    has_previous_page: bool
+    start_cursor: Optional[str] = None
+    end_cursor: Optional[str] = None
 
 
 @strawberry.type
 class Connection(Generic[N]):
+    __slots__ = ("edges", "page_info", "count")
     edges: List[Edge[N]]
+    page_info: PageInfo
+    # Only called when totalCount is selected.
+    count: strawberry.Private[Callable[[], int]]
+
+    @strawberry.field
+    def total_count(self) -> int:
+        return self.count()
+
+
+@strawberry.input
+class OrderBy:
+    field: str
+    descending: bool = False
+
+
+def node_for(info: Info, NodeClass: Callable[..., N], db: Any) -> N:
+    """The wrapper of an ORM object, shared within the request if the
+    context has reuse_nodes set, so it is only built and its id encoded once.
+    """
+    if not info.context.reuse_nodes:
+        return NodeClass(db=db)
+    # The session's identity map has one object per row, and the cached
+    # wrapper keeps it alive, so its id() identifies the row.
+    key = (NodeClass, id(db))
+    node = info.context.nodes.get(key)
+    if node is None:
+        node = info.context.nodes[key] = NodeClass(db=db)
+    return node
+
+
+def build_connection(
+    info: Info,
+    NodeClass: Callable[..., N],
+    DBModelClass: Any,
+    nodes: List[Any],
+    arguments: Dict[str, Any],
+    count: Callable[[], int],
+) -> Connection[N]:
+    sort_pyname = get_sort_pyname(info, DBModelClass, arguments.get("orderBy"))
+    page, has_previous_page, has_next_page = page_nodes(nodes, arguments)
+    edges = [
+        Edge(
+            node=node_for(info, NodeClass, n),
+            sort_value=getattr(n, sort_pyname) if sort_pyname else None,
+        )
+        for n in page
+    ]
+    return Connection(
+        edges=edges,
+        page_info=PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=has_previous_page,
+            start_cursor=edges[0].cursor() if edges else None,
+            end_cursor=edges[-1].cursor() if edges else None,
+        ),
+        count=count,
+    )
+
+
+def relationship_nodes(
+    info: Info,
+    parent: Any,
+    relationship_attr: InstrumentedAttribute,
+    arguments: Dict[str, Any],
+) -> List[Any]:
+    """The children of `parent` that the field being resolved returns.
+
+    Fields with an `authorize` action in their metadata only return the rows
+    the active user is authorized for, filtered in SQL along with any
+    arguments. Otherwise the whole relationship is loaded.
+    """
+    authorize = info._field.metadata.get("authorize")
+    DBModelClass = relationship_attr.mapper.class_
+    if not arguments and authorization_clause(info, authorize, DBModelClass) is None:
+        return info.context.loader.load(parent, relationship_attr)
+    page_key = connection_page_key(parent, relationship_attr, arguments)
+    nodes = info.context.connection_pages.get(page_key)
+    if nodes is None:
+        stmt, _, _ = build_connection_stmt(
+            info,
+            relationship_attr.class_,
+            relationship_attr,
+            arguments,
+            [parent.id],
+            authorize,
+        )
+        nodes = [row[0] for row in info.context.db_session.execute(stmt)]
+    return nodes
+
+
+def relationship_count(
+    info: Info,
+    parent: Any,
+    relationship_attr: InstrumentedAttribute,
+    arguments: Dict[str, Any],
+) -> int:
+    """The totalCount of a relationship connection, ignoring pagination."""
+    page_key = connection_page_key(parent, relationship_attr, arguments)
+    count = info.context.connection_counts.get(page_key)
+    if count is not None:
+        return count
+    authorize = info._field.metadata.get("authorize")
+    DBModelClass = relationship_attr.mapper.class_
+    if not arguments and authorization_clause(info, authorize, DBModelClass) is None:
+        if relationship_attr.key not in inspect(parent).unloaded:
+            return len(getattr(parent, relationship_attr.key))
+    stmt = build_count_stmt(
+        info,
+        relationship_attr.class_,
+        relationship_attr,
+        arguments,
+        [parent.id],
+        authorize,
+    )
+    row = info.context.db_session.execute(stmt).first()
+    return row[1] if row else 0
+
+
+def relationship_connection(
+    info: Info,
+    parent: Any,
+    relationship_attr: InstrumentedAttribute,
+    NodeClass: Callable[..., N],
+) -> Connection[N]:
+    arguments = get_field_arguments(info)
+    nodes: List[Any] = []
+    if selects_connection_nodes(info, info._raw_info.field_nodes):
+        nodes = relationship_nodes(info, parent, relationship_attr, arguments)
+    DBModelClass = relationship_attr.mapper.class_
+    return build_connection(
+        info,
+        NodeClass,
+        DBModelClass,
+        nodes,
+        arguments,
+        lambda: relationship_count(info, parent, relationship_attr, arguments),
+    )
+
+
+def select_connection(
+    info: Info, stmt: Select, DBModelClass: Any, NodeClass: Callable[..., N]
+) -> Connection[N]:
+    arguments = get_field_arguments(info)
+    count_stmt = select(sql_func.count()).select_from(stmt.subquery())
+    nodes: List[Any] = []
+    if selects_connection_nodes(info, info._raw_info.field_nodes):
+        if any(arg in arguments for arg in PAGINATION_ARGS):
+            stmt, _, _ = paginate_select(info, stmt, DBModelClass, arguments)
+        nodes = info.context.db_session.execute(stmt).scalars().all()
+    return build_connection(
+        info,
+        NodeClass,
+        DBModelClass,
+        nodes,
+        arguments,
+        lambda: info.context.db_session.scalar(count_stmt),
+    )
+
+
+@strawberry.input
+class StringFilter:
+    eq: Optional[str] = strawberry.UNSET
+    ne: Optional[str] = strawberry.UNSET
+    # Equal ignoring case.
+    ieq: Optional[str] = strawberry.UNSET
+    in_: Optional[List[str]] = strawberry.field(name="in", default=strawberry.UNSET)
+    # Case-sensitive, so it can be answered by an index range. See
+    # prefix_clause for the collation that needs.
+    starts_with: Optional[str] = strawberry.UNSET
+    # Ignores case, and can't use an index.
+    contains: Optional[str] = strawberry.UNSET
+    is_null: Optional[bool] = strawberry.UNSET
+
+
+@strawberry.input
+class IntFilter:
+    eq: Optional[int] = strawberry.UNSET
+    ne: Optional[int] = strawberry.UNSET
+    in_: Optional[List[int]] = strawberry.field(name="in", default=strawberry.UNSET)
+    lt: Optional[int] = strawberry.UNSET
+    lte: Optional[int] = strawberry.UNSET
+    gt: Optional[int] = strawberry.UNSET
+    gte: Optional[int] = strawberry.UNSET
+    between: Optional[List[int]] = strawberry.UNSET
+    is_null: Optional[bool] = strawberry.UNSET
+
+
+@strawberry.input
+class DateFilter:
+    eq: Optional[datetime.date] = strawberry.UNSET
+    ne: Optional[datetime.date] = strawberry.UNSET
+    in_: Optional[List[datetime.date]] = strawberry.field(
+        name="in", default=strawberry.UNSET
+    )
+    lt: Optional[datetime.date] = strawberry.UNSET
+    lte: Optional[datetime.date] = strawberry.UNSET
+    gt: Optional[datetime.date] = strawberry.UNSET
+    gte: Optional[datetime.date] = strawberry.UNSET
+    between: Optional[List[datetime.date]] = strawberry.UNSET
+    is_null: Optional[bool] = strawberry.UNSET
+
+
+@strawberry.input
+class DateTimeFilter:
+    lt: Optional[datetime.datetime] = strawberry.UNSET
+    lte: Optional[datetime.datetime] = strawberry.UNSET
+    gt: Optional[datetime.datetime] = strawberry.UNSET
+    gte: Optional[datetime.datetime] = strawberry.UNSET
+    between: Optional[List[datetime.datetime]] = strawberry.UNSET
+    is_null: Optional[bool] = strawberry.UNSET
 
 
 @strawberry.input
 class ResidenceFilter:
-    not_: Optional["ResidenceFilter"] = strawberry.UNSET
-    or_: Optional[List["ResidenceFilter"]] = strawberry.UNSET
-    unit_no: Optional[str] = strawberry.UNSET
-    street: Optional[str] = strawberry.UNSET
-    locality: Optional[str] = strawberry.UNSET
-    postcode: Optional[str] = strawberry.UNSET
-    region: Optional[str] = strawberry.UNSET
+    not_: Optional["ResidenceFilter"] = strawberry.field(
+        name="not", default=strawberry.UNSET
+    )
+    or_: Optional[List["ResidenceFilter"]] = strawberry.field(
+        name="or", default=strawberry.UNSET
+    )
+    unit_no: Optional[StringFilter] = strawberry.UNSET
+    street: Optional[StringFilter] = strawberry.UNSET
+    locality: Optional[StringFilter] = strawberry.UNSET
+    postcode: Optional[StringFilter] = strawberry.UNSET
+    region: Optional[StringFilter] = strawberry.UNSET
 
 
 @strawberry.input
 class BillingChargeFilter:
-    not_: Optional["BillingChargeFilter"] = strawberry.UNSET
-    or_: Optional[List["BillingChargeFilter"]] = strawberry.UNSET
-    name: Optional[str] = strawberry.UNSET
-    amount: Optional[str] = strawberry.UNSET
-    remainingBalance: Optional[str] = strawberry.UNSET
-    chargeDate: Optional[str] = strawberry.UNSET
-    dueDate: Optional[str] = strawberry.UNSET
+    not_: Optional["BillingChargeFilter"] = strawberry.field(
+        name="not", default=strawberry.UNSET
+    )
+    or_: Optional[List["BillingChargeFilter"]] = strawberry.field(
+        name="or", default=strawberry.UNSET
+    )
+    name: Optional[StringFilter] = strawberry.UNSET
+    amount: Optional[IntFilter] = strawberry.UNSET
+    remainingBalance: Optional[IntFilter] = strawberry.UNSET
+    chargeDate: Optional[DateTimeFilter] = strawberry.UNSET
+    dueDate: Optional[DateFilter] = strawberry.UNSET
 
 
 @strawberry.input
 class GroupFilter:
-    not_: Optional["GroupFilter"] = strawberry.UNSET
-    or_: Optional[List["GroupFilter"]] = strawberry.UNSET
-    name: Optional[str] = strawberry.UNSET
+    not_: Optional["GroupFilter"] = strawberry.field(
+        name="not", default=strawberry.UNSET
+    )
+    or_: Optional[List["GroupFilter"]] = strawberry.field(
+        name="or", default=strawberry.UNSET
+    )
+    name: Optional[StringFilter] = strawberry.UNSET
+
+
+@strawberry.input
+class RightFilter:
+    not_: Optional["RightFilter"] = strawberry.field(
+        name="not", default=strawberry.UNSET
+    )
+    or_: Optional[List["RightFilter"]] = strawberry.field(
+        name="or", default=strawberry.UNSET
+    )
+    name: Optional[StringFilter] = strawberry.UNSET
+    permits: Optional[List[PermissionsFlag]] = strawberry.UNSET
+
+
+@strawberry.type
+class Balance:
+    total_due: int
+    overdue: int
+    next_due_date: Optional[datetime.date] = None
+
+    @classmethod
+    def from_row(cls, row: Optional[Row]) -> "Balance":
+        if row is None:
+            return cls(total_due=0, overdue=0)
+        return cls(
+            total_due=row.total_due,
+            overdue=row.overdue,
+            next_due_date=row.next_due_date,
+        )
+
+
+@strawberry.type
+class ArrearsSummary:
+    total_due: int
+    overdue: int
+    overdue_charges: int
+    residences_in_arrears: int
 
 
 @strawberry.type
-class Community(Node[DBCommunity]):
+class Community(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBCommunity]
     dbtype = DBCommunity
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def name(self) -> str:
         return self.db.name
 
     @strawberry.field
+    def arrears_summary(self, info: Info) -> ArrearsSummary:
+        balances = (
+            build_balance_stmt(datetime.date.today(), DBBillingCharge.residence_id)
+            .where(DBBillingCharge.community_id == self.db.id)
+            .subquery()
+        )
+        stmt = select(
+            sql_func.coalesce(sql_func.sum(balances.c.total_due), 0),
+            sql_func.coalesce(sql_func.sum(balances.c.overdue), 0),
+            sql_func.coalesce(sql_func.sum(balances.c.overdue_charges), 0),
+            sql_func.count(case((balances.c.overdue > 0, balances.c.residence_id))),
+        )
+        row = info.context.db_session.execute(stmt).one()
+        return ArrearsSummary(
+            total_due=row[0],
+            overdue=row[1],
+            overdue_charges=row[2],
+            residences_in_arrears=row[3],
+        )
+
+    @strawberry.field(metadata={"mapped": True})
     def residences(
         self,
+        info: Info,
         first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
         filter: Optional[ResidenceFilter] = strawberry.UNSET,
     ) -> Optional[Connection["Residence"]]:
-        return Connection(
-            edges=[Edge(node=Residence(db=r)) for r in self.db.residences]
-        )
+        return relationship_connection(info, self.db, DBCommunity.residences, Residence)
 
-    @strawberry.field
-    def occupancies(self) -> Optional[Connection["ResidenceOccupancy"]]:
-        return Connection(
-            edges=[Edge(node=ResidenceOccupancy(db=a)) for a in self.db.occupancies]
+    @strawberry.field(metadata={"mapped": True})
+    def occupancies(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["ResidenceOccupancy"]]:
+        return relationship_connection(
+            info, self.db, DBCommunity.occupancies, ResidenceOccupancy
         )
 
-    @strawberry.field
+    @strawberry.field(metadata={"authorize": "query", "mapped": True})
     def billing_charges(
         self,
         info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
         filter: Optional[BillingChargeFilter] = strawberry.UNSET,
     ) -> Optional[Connection["BillingCharge"]]:
-        au = info.context.active_user
-        return Connection(
-            edges=[
-                Edge(node=BillingCharge(db=bc))
-                for bc in self.db.billing_charges
-                if oso.is_allowed(au, "query", bc)
-            ]
+        return relationship_connection(
+            info, self.db, DBCommunity.billing_charges, BillingCharge
         )
 
-    @strawberry.field
-    def billing_payments(self) -> Optional[Connection["BillingPayment"]]:
-        return Connection(
-            edges=[Edge(node=BillingPayment(db=bp)) for bp in self.db.billing_payments]
+    @strawberry.field(metadata={"mapped": True})
+    def billing_payments(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["BillingPayment"]]:
+        return relationship_connection(
+            info, self.db, DBCommunity.billing_payments, BillingPayment
         )
 
-    @strawberry.field
+    @strawberry.field(metadata={"authorize": "query", "mapped": True})
     def groups(
         self,
         info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
         filter: Optional[GroupFilter] = strawberry.UNSET,
     ) -> Optional[Connection["Group"]]:
-        au = info.context.active_user
-        return Connection(
-            edges=[
-                Edge(node=Group(db=g))
-                for g in self.db.groups
-                if oso.is_allowed(au, "query", g)
-            ]
-        )
+        return relationship_connection(info, self.db, DBCommunity.groups, Group)
 
-    @strawberry.field
-    def rights(self) -> Optional[Connection["Right"]]:
-        return Connection(edges=[Edge(node=Right(db=r)) for r in self.db.rights])
-
-    @strawberry.field
-    def associates(self) -> Optional[Connection["Associate"]]:
-        return Connection(
-            edges=[Edge(node=Associate(db=a)) for a in self.db.associates]
-        )
+    @strawberry.field(metadata={"mapped": True})
+    def rights(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+        filter: Optional[RightFilter] = strawberry.UNSET,
+    ) -> Optional[Connection["Right"]]:
+        return relationship_connection(info, self.db, DBCommunity.rights, Right)
+
+    @strawberry.field(metadata={"mapped": True})
+    def associates(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["Associate"]]:
+        return relationship_connection(info, self.db, DBCommunity.associates, Associate)
 
 
 @strawberry.type
-class Associate(Node[DBAssociate]):
+class Associate(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBAssociate]
     dbtype = DBAssociate
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def personal_name(self) -> str:
         return self.db.personal_name
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def family_name(self) -> str:
         return self.db.family_name
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def full_name(self) -> str:
         return self.db.full_name
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def collation_name(self) -> str:
         return self.db.collation_name
 
-    @strawberry.field
+    # Mapped, as email is the only kind of contact method in the database.
+    @strawberry.field(metadata={"authorize": "query", "mapped": True})
     def contact_methods(self, info: Info) -> List["ContactMethod"]:
-        au = info.context.active_user
-        if au:
-            return [
-                EmailContact(db=cm)
-                for cm in self.db.contact_methods
-                if isinstance(cm, DBEmailContact) and oso.is_allowed(au, "query", cm)
-            ]
-        else:
-            return []
+        return [
+            EmailContact(db=cm)
+            for cm in relationship_nodes(info, self.db, DBAssociate.contact_methods, {})
+            if isinstance(cm, DBEmailContact)
+        ]
 
-    @strawberry.field
-    def residences(self) -> Optional[Connection["Residence"]]:
-        return Connection(
-            edges=[Edge(node=Residence(db=r)) for r in self.db.residences]
-        )
+    @strawberry.field(metadata={"mapped": True})
+    def residences(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["Residence"]]:
+        return relationship_connection(info, self.db, DBAssociate.residences, Residence)
 
-    @strawberry.field
-    def occupancies(self) -> Optional[Connection["ResidenceOccupancy"]]:
-        return Connection(
-            edges=[Edge(node=ResidenceOccupancy(db=a)) for a in self.db.occupancies]
+    @strawberry.field(metadata={"mapped": True})
+    def occupancies(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["ResidenceOccupancy"]]:
+        return relationship_connection(
+            info, self.db, DBAssociate.occupancies, ResidenceOccupancy
         )
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def groups(self, info: Info) -> Optional[List["Group"]]:
-        return [Group(db=g) for g in self.db.groups]
+        return [
+            node_for(info, Group, g)
+            for g in info.context.loader.load(self.db, DBAssociate.groups)
+        ]
 
 
 @strawberry.type
-class Residence(Node[DBResidence]):
+class Residence(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBResidence]
     dbtype = DBResidence
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def unit_no(self) -> Optional[str]:
         return self.db.unit_no
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def street(self) -> str:
         return self.db.street
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def locality(self) -> str:
         return self.db.locality
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def postcode(self) -> str:
         return self.db.postcode
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def region(self) -> str:
         return self.db.region
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def community(self) -> Optional[Community]:
         return Community(db=self.db.community)
 
-    @strawberry.field
-    def occupancies(self) -> Optional[Connection["ResidenceOccupancy"]]:
-        return Connection(
-            edges=[Edge(node=ResidenceOccupancy(db=a)) for a in self.db.occupancies]
+    @strawberry.field(metadata={"mapped": True})
+    def occupancies(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["ResidenceOccupancy"]]:
+        return relationship_connection(
+            info, self.db, DBResidence.occupancies, ResidenceOccupancy
         )
 
-    @strawberry.field
-    def occupants(self) -> Optional[Connection["Associate"]]:
-        return Connection(edges=[Edge(node=Associate(db=a)) for a in self.db.occupants])
-
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
+    def occupants(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["Associate"]]:
+        return relationship_connection(info, self.db, DBResidence.occupants, Associate)
+
+    @strawberry.field(metadata={"authorize": "query", "mapped": True})
     def billing_charges(
         self,
         info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
         filter: Optional[BillingChargeFilter] = strawberry.UNSET,
     ) -> Optional[Connection["BillingCharge"]]:
-        au = info.context.active_user
-        return Connection(
-            edges=[
-                Edge(node=BillingCharge(db=bc))
-                for bc in self.db.billing_charges
-                if oso.is_allowed(au, "query", bc)
-            ]
+        return relationship_connection(
+            info, self.db, DBResidence.billing_charges, BillingCharge
         )
 
+    @strawberry.field
+    def balance(self, info: Info) -> Balance:
+        return Balance.from_row(info.context.balances.load(self.db))
+
     @strawberry.field
     def issues(self, info: Info) -> Optional[List["Issue"]]:
         return info.context.dev_issue_list
 
 
 @strawberry.type
-class ResidenceOccupancy(Node[DBResidenceOccupancy]):
+class ResidenceOccupancy(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBResidenceOccupancy]
     dbtype = DBResidenceOccupancy
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def date_begun(self) -> Optional[datetime.date]:
         return self.db.date_begun
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def date_ended(self) -> Optional[datetime.date]:
         return self.db.date_ended
 
-    @strawberry.field
-    def occupant(self) -> Optional[Associate]:
-        return Associate(db=self.db.occupant)
+    @strawberry.field(metadata={"mapped": True})
+    def occupant(self, info: Info) -> Optional[Associate]:
+        return Associate(
+            db=info.context.loader.load(self.db, DBResidenceOccupancy.occupant)
+        )
 
-    @strawberry.field
-    def residence(self) -> Optional[Residence]:
-        return Residence(db=self.db.residence)
+    @strawberry.field(metadata={"mapped": True})
+    def residence(self, info: Info) -> Optional[Residence]:
+        return Residence(
+            db=info.context.loader.load(self.db, DBResidenceOccupancy.residence)
+        )
 
 
 # TODO This is just a development mockup to try out different Issue designs.
@@ -316,54 +721,90 @@ class Issue:
     status_msg: Optional[str] = None
 
 
+def user_residences_stmt() -> Tuple[Select, Any, Any]:
+    """Select residences labelled with the id of each user associated with them.
+
+    Like build_relationship_stmt, for the User.residences connection.
+    """
+    stmt = (
+        select(DBResidence, DBAssociate.user_id.label("parent_id"))
+        .select_from(DBAssociate)
+        .join(DBAssociate.residences)
+    )
+    return stmt, DBResidence, DBAssociate.user_id
+
+
+def user_is_admin_sql(context: Any, user: Any) -> ColumnElement:
+    """User.is_admin in SQL, for queries compiled by gql_json."""
+    stmt = (
+        select(DBRight.id)
+        .select_from(DBGroupMembership)
+        .join(DBGroup, DBGroupMembership.group_id == DBGroup.id)
+        .join(DBRight, DBGroup.right_id == DBRight.id)
+        .join(DBAssociate, DBGroupMembership.member_id == DBAssociate.id)
+        .where(DBAssociate.user_id == user.id)
+    )
+    is_admin = context.principal is not None and context.principal.is_admin
+    return case((user.id == context.user_id, literal(is_admin)), else_=stmt.exists())
+
+
 @strawberry.type
-class User(Node[DBUser]):
+class User(Node):
+    db: strawberry.Private[DBUser]
     dbtype = DBUser
     reference_community_id: strawberry.Private[Optional[int]] = None
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def personal_name(self) -> str:
         return self.db.personal_name
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def family_name(self) -> str:
         return self.db.family_name
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def full_name(self) -> str:
         return self.db.full_name
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def collation_name(self) -> str:
         return self.db.collation_name
 
-    @strawberry.field
+    # Mapped, as email is the only kind of contact method in the database.
+    @strawberry.field(metadata={"authorize": "query", "mapped": True})
     def contact_methods(self, info: Info) -> List["ContactMethod"]:
-        au = info.context.active_user
-        if au:
-            return [
-                EmailContact(db=cm)
-                for cm in self.db.contact_methods
-                if isinstance(cm, DBEmailContact) and oso.is_allowed(au, "query", cm)
-            ]
-        else:
-            return []
+        return [
+            EmailContact(db=cm)
+            for cm in relationship_nodes(info, self.db, DBUser.contact_methods, {})
+            if isinstance(cm, DBEmailContact)
+        ]
 
-    @strawberry.field
-    def residences(self, info: Info) -> Optional[Connection["Residence"]]:
-        stmt = (
-            select(DBResidence)
-            .select_from(DBAssociate)
-            .join(DBAssociate.residences)
-            .where(DBAssociate.user_id == self.db.id)
-        )
+    @strawberry.field(metadata={"relationship_stmt": user_residences_stmt})
+    def residences(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["Residence"]]:
+        stmt, _, user_id_col = user_residences_stmt()
+        stmt = stmt.where(user_id_col == self.db.id)
         if self.reference_community_id:
             stmt = stmt.where(DBAssociate.community_id == self.reference_community_id)
-        result = info.context.db_session.execute(stmt).scalars()
-        return Connection(edges=[Edge(node=Residence(db=r)) for r in result])
+        return select_connection(info, stmt, DBResidence, Residence)
 
     @strawberry.field
-    def occupancies(self, info: Info) -> Optional[Connection["ResidenceOccupancy"]]:
+    def occupancies(
+        self,
+        info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
+    ) -> Optional[Connection["ResidenceOccupancy"]]:
         stmt = (
             select(DBResidenceOccupancy)
             .select_from(DBAssociate)
@@ -372,8 +813,7 @@ class User(Node[DBUser]):
         )
         if self.reference_community_id:
             stmt = stmt.where(DBAssociate.community_id == self.reference_community_id)
-        result = info.context.db_session.execute(stmt).scalars()
-        return Connection(edges=[Edge(node=ResidenceOccupancy(db=r)) for r in result])
+        return select_connection(info, stmt, DBResidenceOccupancy, ResidenceOccupancy)
 
     @strawberry.field
     def groups(
@@ -392,7 +832,44 @@ class User(Node[DBUser]):
         return [Group(db=g) for g in result]
 
     @strawberry.field
+    def delegable_rights(self, info: Info) -> List["Right"]:
+        stmt = (
+            select(DBRight)
+            .join(DBRightClosure, DBRightClosure.descendant_id == DBRight.id)
+            .join(DBGroup, DBGroup.right_id == DBRight.id)
+            .join(DBGroupMembership, DBGroupMembership.group_id == DBGroup.id)
+            .join(DBAssociate, DBAssociate.id == DBGroupMembership.member_id)
+            .where(DBAssociate.user_id == self.db.id)
+            .where(DBRightClosure.depth == 0)
+            .where(DBRightClosure.permits(PermissionsFlag.CAN_DELEGATE))
+            .distinct()
+            .order_by(DBRight.id)
+        )
+        if self.reference_community_id:
+            stmt = stmt.where(DBRight.community_id == self.reference_community_id)
+        return [Right(db=r) for r in info.context.db_session.scalars(stmt)]
+
+    @strawberry.field
+    def balance(self, info: Info) -> Balance:
+        residence_ids = (
+            select(DBResidenceOccupancy.residence_id)
+            .join(DBAssociate, DBResidenceOccupancy.occupant_id == DBAssociate.id)
+            .where(DBAssociate.user_id == self.db.id)
+        )
+        if self.reference_community_id:
+            residence_ids = residence_ids.where(
+                DBAssociate.community_id == self.reference_community_id
+            )
+        stmt = build_balance_stmt(datetime.date.today()).where(
+            DBBillingCharge.residence_id.in_(residence_ids)
+        )
+        return Balance.from_row(info.context.db_session.execute(stmt).one())
+
+    @strawberry.field(metadata={"sql": user_is_admin_sql})
     def is_admin(self, info: Info) -> bool:
+        if self.db.id == info.context.user_id:
+            principal = info.context.principal
+            return principal is not None and principal.is_admin
         stmt = (
             select(DBGroupMembership.community_id, sql_func.count(DBRight.id))
             .select_from(DBGroupMembership)
@@ -413,44 +890,60 @@ class User(Node[DBUser]):
 
 
 @strawberry.type
-class Group(Node[DBGroup]):
+class Group(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBGroup]
     dbtype = DBGroup
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def name(self) -> str:
         return self.db.name
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def community(self) -> Optional[Community]:
         return Community(db=self.db.community)
 
-    @strawberry.field
-    def managed_by(self) -> Optional["Group"]:
-        return Group(db=self.db.managed_by)
+    @strawberry.field(metadata={"mapped": True})
+    def managed_by(self, info: Info) -> Optional["Group"]:
+        return Group(db=info.context.loader.load(self.db, DBGroup.managed_by))
 
-    @strawberry.field
-    def manages(self) -> Optional[List["Group"]]:
-        return [Group(db=g) for g in self.db.manages]
+    @strawberry.field(metadata={"mapped": True})
+    def manages(self, info: Info) -> Optional[List["Group"]]:
+        return [
+            node_for(info, Group, g)
+            for g in info.context.loader.load(self.db, DBGroup.manages)
+        ]
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def right(self) -> Optional["Right"]:
         return Right(db=self.db.right) if self.db.right else None
 
-    @strawberry.field
-    def custom_members(self) -> Optional[List[Associate]]:
-        return [Associate(db=a) for a in self.db.custom_members]
+    @strawberry.field(metadata={"mapped": True})
+    def custom_members(self, info: Info) -> Optional[List[Associate]]:
+        return [
+            node_for(info, Associate, a)
+            for a in info.context.loader.load(self.db, DBGroup.custom_members)
+        ]
 
     @strawberry.field
     def is_allowed(self, info: Info, action: str) -> bool:
         au = info.context.active_user
-        return oso.is_allowed(au, action, self.db)
+        return info.context.authorization.is_allowed(au, action, self.db)
 
 
 @strawberry.type
-class Right(Node[DBRight]):
+class RevocationImpact:
+    rights: List["Right"]
+    groups: List[Group]
+
+
+@strawberry.type
+class Right(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBRight]
     dbtype = DBRight
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def name(self) -> str:
         return self.db.name
 
@@ -458,126 +951,240 @@ class Right(Node[DBRight]):
     def permissions(self) -> List[PermissionsFlag]:
         return [m for m in self.db.permissions]
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def community(self) -> Optional[Community]:
         return Community(db=self.db.community)
 
     @strawberry.field
-    def parent_right(self) -> Optional["Right"]:
-        if self.db.parent_right != self.db:
-            return Right(db=self.db.parent_right)
+    def parent_right(self, info: Info) -> Optional["Right"]:
+        parent_right = info.context.loader.load(self.db, DBRight.parent_right)
+        if parent_right != self.db:
+            return Right(db=parent_right)
         else:
             return None
 
     @strawberry.field
-    def child_rights(self) -> Optional[List["Right"]]:
-        return [Right(db=r) for r in self.db.child_rights if r != self.db]
+    def child_rights(self, info: Info) -> Optional[List["Right"]]:
+        return [
+            Right(db=r)
+            for r in info.context.loader.load(self.db, DBRight.child_rights)
+            if r != self.db
+        ]
 
-    @strawberry.field
+    @strawberry.field(metadata={"authorize": "query", "mapped": True})
     def groups(self, info: Info) -> Optional[List[Group]]:
-        au = info.context.active_user
-        return [Group(db=g) for g in self.db.groups if oso.is_allowed(au, "query", g)]
+        return [
+            node_for(info, Group, g)
+            for g in relationship_nodes(info, self.db, DBRight.groups, {})
+        ]
+
+    @strawberry.field
+    def revocation_impact(self, info: Info) -> RevocationImpact:
+        # Revoking a right deletes every right delegated from it, and their
+        # groups lose their right.
+        group_join = DBGroup.right_id == DBRight.id
+        group_clause = authorization_clause(info, "query", DBGroup)
+        if group_clause is not None:
+            group_join = sql_and(group_join, group_clause)
+        stmt = (
+            select(DBRight, DBGroup)
+            .join(DBRightClosure, DBRightClosure.descendant_id == DBRight.id)
+            .outerjoin(DBGroup, group_join)
+            .where(DBRightClosure.ancestor_id == self.db.id)
+            .order_by(DBRightClosure.depth, DBRight.id, DBGroup.id)
+        )
+        rights: Dict[int, Right] = {}
+        groups: List[Group] = []
+        for right, group in info.context.db_session.execute(stmt):
+            rights.setdefault(right.id, Right(db=right))
+            if group is not None:
+                groups.append(Group(db=group))
+        return RevocationImpact(rights=list(rights.values()), groups=groups)
 
     @strawberry.field
     def is_allowed(self, info: Info, action: str) -> bool:
         au = info.context.active_user
-        return oso.is_allowed(au, action, self.db)
+        return info.context.authorization.is_allowed(au, action, self.db)
 
 
 @strawberry.interface
-class ContactMethod(Node[DBContactMethod]):
+class ContactMethod(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBContactMethod]
     dbtype = DBContactMethod
 
-    @strawberry.field
-    def user(self) -> Optional[User]:
-        return User(db=self.db.user) if self.db.user else None
+    @strawberry.field(metadata={"mapped": True})
+    def user(self, info: Info) -> Optional[User]:
+        user = info.context.loader.load(self.db, DBContactMethod.user)
+        return User(db=user) if user else None
 
 
 @strawberry.type
 class EmailContact(ContactMethod):
+    __slots__ = ()
     db: strawberry.Private[DBEmailContact]
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def email(self) -> str:
         return self.db.email
 
 
 @strawberry.type
-class BillingPayment(Node[DBBillingPayment]):
+class BillingPayment(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBBillingPayment]
     dbtype = DBBillingPayment
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def amount(self) -> int:
         return self.db.amount
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def remaining_balance(self) -> int:
         return self.db.remaining_balance
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def payment_date(self) -> datetime.datetime:
         return self.db.payment_date
 
-    @strawberry.field
+    @strawberry.field(metadata={"authorize": "query", "mapped": True})
     def charges(
         self,
         info: Info,
+        first: Optional[int] = strawberry.UNSET,
+        after: Optional[str] = strawberry.UNSET,
+        last: Optional[int] = strawberry.UNSET,
+        before: Optional[str] = strawberry.UNSET,
+        order_by: Optional[OrderBy] = strawberry.UNSET,
         filter: Optional[BillingChargeFilter] = strawberry.UNSET,
     ) -> Optional[Connection["BillingCharge"]]:
-        au = info.context.active_user
-        return Connection(
-            edges=[
-                Edge(node=BillingCharge(db=bc))
-                for bc in self.db.charges
-                if oso.is_allowed(au, "query", bc)
-            ]
+        return relationship_connection(
+            info, self.db, DBBillingPayment.charges, BillingCharge
         )
 
 
 @strawberry.type
-class BillingCharge(Node[DBBillingCharge]):
+class BillingCharge(Node):
+    __slots__ = ()
+    db: strawberry.Private[DBBillingCharge]
     dbtype = DBBillingCharge
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def name(self) -> str:
         return self.db.name
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def amount(self) -> int:
         return self.db.amount
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def remaining_balance(self) -> int:
         return self.db.remaining_balance
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def charge_date(self) -> datetime.datetime:
         return self.db.charge_date
 
-    @strawberry.field
+    @strawberry.field(metadata={"mapped": True})
     def due_date(self) -> datetime.date:
         return self.db.due_date
 
-    @strawberry.field
-    def payments(self) -> Optional[List[BillingPayment]]:
-        return [BillingPayment(db=p) for p in self.db.payments]
+    @strawberry.field(metadata={"mapped": True})
+    def payments(self, info: Info) -> Optional[List[BillingPayment]]:
+        return [
+            BillingPayment(db=p)
+            for p in info.context.loader.load(self.db, DBBillingCharge.payments)
+        ]
+
+
+NODE_TYPES: Dict[Any, Any] = {
+    NodeClass.dbtype: NodeClass
+    for NodeClass in (
+        Community,
+        Associate,
+        Residence,
+        ResidenceOccupancy,
+        User,
+        Group,
+        Right,
+        BillingPayment,
+        BillingCharge,
+    )
+}
+NODE_TYPES[DBEmailContact] = EmailContact
+NODE_TABLES: Dict[str, Any] = {
+    DBModelClass.__tablename__: DBModelClass
+    for DBModelClass in (*NODE_TYPES, DBContactMethod)
+}
+
+
+def community_scope(DBModelClass: Any, community_id: Optional[int]):
+    if DBModelClass is DBCommunity:
+        return DBCommunity.id == community_id
+    if hasattr(DBModelClass, "community_id"):
+        return DBModelClass.community_id == community_id
+    # Users and their contact methods are visible through the community's
+    # associates.
+    user_ids = select(DBAssociate.user_id).where(
+        DBAssociate.community_id == community_id
+    )
+    if DBModelClass is DBUser:
+        return DBUser.id.in_(user_ids)
+    return DBModelClass.user_id.in_(user_ids)
+
+
+def load_nodes(info: Info, gql_ids: List[strawberry.ID]) -> List[Optional[Node]]:
+    """Fetch the objects with the given global IDs, in order.
+
+    IDs are grouped by table and each table is loaded with one query,
+    limited to the active community and to rows the active user may query.
+    IDs that are malformed, unknown or out of reach resolve to None.
+    """
+    keys: List[Optional[Tuple[str, int]]] = []
+    ids_by_table: Dict[str, Set[int]] = {}
+    for gql_id in gql_ids:
+        try:
+            table_name, table_id = decode_gql_id(gql_id)
+        except ValueError:
+            keys.append(None)
+            continue
+        keys.append((table_name, table_id))
+        if table_name in NODE_TABLES:
+            ids_by_table.setdefault(table_name, set()).add(table_id)
+
+    nodes: Dict[Tuple[str, int], Node] = {}
+    for table_name, table_ids in ids_by_table.items():
+        DBModelClass = NODE_TABLES[table_name]
+        stmt = select(DBModelClass).where(
+            DBModelClass.id.in_(table_ids),
+            community_scope(DBModelClass, info.context.community_id),
+        )
+        if DBModelClass in QUERY_FILTERS:
+            clause = authorization_clause(info, "query", DBModelClass)
+            if clause is not None:
+                stmt = stmt.where(clause)
+        for row in recursive_eager_load(info, stmt, DBModelClass):
+            nodes[(table_name, row[0].id)] = NODE_TYPES[type(row[0])](db=row[0])
+    return [nodes.get(key) if key else None for key in keys]
 
 
 @strawberry.type
 class Query:
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    def node(self, info: Info, id: strawberry.ID) -> Optional[Node]:
+        return load_nodes(info, [id])[0]
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    def nodes(self, info: Info, ids: List[strawberry.ID]) -> List[Optional[Node]]:
+        return load_nodes(info, ids)
+
     @strawberry.field(permission_classes=[IsAuthenticated])
     def active_user(
         self, info: Info, reference_community: Optional[strawberry.ID] = None
     ) -> Optional[User]:
         user_id = info.context.user_id
-        au_field = None
-        for field in info.selected_fields:
-            if isinstance(field, SelectedField) and field.name == "activeUser":
-                au_field = field
-                break
-        assert au_field is not None
         stmt = select(DBUser).where(DBUser.id == user_id)
-        rows = recursive_eager_load(info, stmt, DBUser, au_field)
+        rows = recursive_eager_load(info, stmt, DBUser)
         c_id = (
             gql_id_to_table_id_unchecked(reference_community)
             if reference_community
@@ -591,14 +1198,8 @@ class Query:
     @strawberry.field(permission_classes=[IsAuthenticated])
     def active_community(self, info: Info) -> Optional[Community]:
         community_id = info.context.community_id
-        ac_field = None
-        for field in info.selected_fields:
-            if isinstance(field, SelectedField) and field.name == "activeCommunity":
-                ac_field = field
-                break
-        assert ac_field is not None
         stmt = select(DBCommunity).where(DBCommunity.id == community_id)
-        rows = recursive_eager_load(info, stmt, DBCommunity, ac_field)
+        rows = recursive_eager_load(info, stmt, DBCommunity)
         if len(rows) == 1:
             return Community(db=rows[0][0])
         else:
@@ -14,17 +14,20 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from dataclasses import dataclass
-from typing import List, Optional, Type
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
 
 from sqlalchemy.orm import Session
 from strawberry import Schema
 from strawberry.extensions import SchemaExtension
 
+from .authorization import DecisionCache
 from .db_models import DBCommunity, DBUser
+from .gql_dataloader import BalanceLoader, RelationshipLoader
 from .gql_errors import AlreadyTaken, DatabaseError, NotFound, Unauthorized
 from .gql_mutation import Mutation
 from .gql_query import EmailContact, Issue, Query
+from .principal import Principal, principals
 
 
 @dataclass
@@ -36,14 +39,79 @@ class SchemaContext:
     db_session: Session
     user_id: Optional[int] = None
     community_id: Optional[int] = None
+    # Makes the read-only sessions of forked contexts, see fork().
+    session_factory: Optional[Callable[[], Session]] = None
+    # Share one wrapper per ORM object within the request, see node_for().
+    reuse_nodes: bool = False
+    loader: RelationshipLoader = field(init=False, repr=False)
+    balances: BalanceLoader = field(init=False, repr=False)
+    authorization: DecisionCache = field(init=False, repr=False)
+    # Connection pages prefetched by recursive_eager_load, keyed by parent
+    # identity, relationship name and the field's arguments.
+    connection_pages: Dict[Tuple[Any, str, str], List[Any]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # Their totalCounts, keyed the same way.
+    connection_counts: Dict[Tuple[Any, str, str], int] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # The shared wrappers, keyed by Node class and the id() of the ORM object.
+    nodes: Dict[Tuple[type, int], Any] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _active_user: Optional[DBUser] = field(default=None, init=False, repr=False)
+    _principal: Optional[Principal] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.loader = RelationshipLoader(self.db_session)
+        self.balances = BalanceLoader(self.db_session)
+        self.authorization = DecisionCache()
 
     @property
     def active_user(self):
         if self.user_id:
-            return self.db_session.get(DBUser, self.user_id)
+            # Keep a reference so the user isn't dropped from the session's
+            # weak identity map and reloaded for every authorization check.
+            if self._active_user is None:
+                self._active_user = self.db_session.get(DBUser, self.user_id)
+            return self._active_user
+        else:
+            return None
+
+    @property
+    def principal(self) -> Optional[Principal]:
+        if self.user_id:
+            if self._principal is None:
+                self._principal = principals.get(
+                    self.db_session, self.user_id, self.community_id
+                )
+            return self._principal
         else:
             return None
 
+    def fork(self) -> "SchemaContext":
+        """A context for resolving part of a query on another thread.
+
+        It gets a new session from session_factory, which the caller closes,
+        and shares the principal if it has already been loaded.
+        """
+        assert self.session_factory is not None
+        context = SchemaContext(
+            self.dev_issue_list,
+            self.session_factory(),
+            self.user_id,
+            self.community_id,
+            self.session_factory,
+            self.reuse_nodes,
+        )
+        context._principal = self._principal
+        return context
+
+    def permissions_changed(self):
+        """Forget authorization state after a change to groups or rights."""
+        self.authorization.clear()
+        self._principal = None
+
     @property
     def active_community(self):
         if self.community_id:
@@ -0,0 +1,136 @@
+#  Nido principal.py
+#  Copyright (C) John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .db_models import (
+    DBAssociate,
+    DBCommunity,
+    DBGroup,
+    DBGroupClosure,
+    DBGroupMembership,
+)
+
+
+@dataclass(frozen=True)
+class Principal:
+    """A snapshot of what a user is authorized as within a community.
+
+    Without a community_id the snapshot covers all of the user's
+    communities and has no permissions_version.
+    """
+
+    user_id: int
+    community_id: Optional[int]
+    permissions_version: Optional[int]
+    associate_ids: FrozenSet[int]
+    group_ids: FrozenSet[int]
+    managed_group_ids: FrozenSet[int]
+    right_ids: FrozenSet[int]
+
+    @property
+    def is_admin(self) -> bool:
+        return len(self.right_ids) > 0
+
+
+def load_principal(
+    db_session: Session,
+    user_id: int,
+    community_id: Optional[int] = None,
+    permissions_version: Optional[int] = None,
+) -> Principal:
+    associate_stmt = select(DBAssociate.id).where(DBAssociate.user_id == user_id)
+    if community_id is not None:
+        associate_stmt = associate_stmt.where(DBAssociate.community_id == community_id)
+    associate_ids = frozenset(db_session.scalars(associate_stmt))
+
+    group_rows = db_session.execute(
+        select(DBGroup.id, DBGroup.right_id)
+        .join(DBGroupMembership, DBGroupMembership.group_id == DBGroup.id)
+        .where(DBGroupMembership.member_id.in_(associate_ids))
+    ).all()
+    group_ids = frozenset(row.id for row in group_rows)
+    right_ids = frozenset(row.right_id for row in group_rows if row.right_id)
+
+    managed_group_ids = frozenset(
+        db_session.scalars(
+            select(DBGroupClosure.descendant_id).where(
+                DBGroupClosure.ancestor_id.in_(group_ids)
+            )
+        )
+    )
+    return Principal(
+        user_id=user_id,
+        community_id=community_id,
+        permissions_version=permissions_version,
+        associate_ids=associate_ids,
+        group_ids=group_ids,
+        managed_group_ids=managed_group_ids,
+        right_ids=right_ids,
+    )
+
+
+class PrincipalCache:
+    """Principals shared between requests, keyed by user and community.
+
+    A cached principal is reused for as long as its community's
+    permissions_version hasn't changed, so checking it costs a primary key
+    lookup instead of reloading the user's groups and rights.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._principals: OrderedDict[Tuple[int, int], Principal] = OrderedDict()
+
+    def get(
+        self, db_session: Session, user_id: int, community_id: Optional[int]
+    ) -> Principal:
+        if community_id is None:
+            return load_principal(db_session, user_id)
+
+        version = db_session.scalar(
+            select(DBCommunity.permissions_version).where(
+                DBCommunity.id == community_id
+            )
+        )
+        key = (user_id, community_id)
+        with self._lock:
+            principal = self._principals.get(key)
+            if principal is not None and principal.permissions_version == version:
+                self._principals.move_to_end(key)
+                return principal
+
+        principal = load_principal(db_session, user_id, community_id, version)
+        with self._lock:
+            self._principals[key] = principal
+            self._principals.move_to_end(key)
+            while len(self._principals) > self.maxsize:
+                self._principals.popitem(last=False)
+        return principal
+
+    def clear(self):
+        with self._lock:
+            self._principals.clear()
+
+
+principals = PrincipalCache()
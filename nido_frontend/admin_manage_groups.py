@@ -149,7 +149,7 @@ def edit_group(group_name: str):
     gql_query = """
 query EditGroup($name: String!) {
   activeCommunity {
-    groups(filter: {name: $name}) {
+    groups(filter: {name: {eq: $name}}) {
       edges {
         node {
           id
@@ -90,21 +90,14 @@ def new_right():
     gql_query = """
 query NewRight {
   activeUser {
-    groups {
-      right {
-        id
-        name
-        permissions
-      }
+    delegableRights {
+      id
+      name
     }
   }
 }"""
     gql_result = g.gql_client.execute_query(gql_query)
-    rights = [
-        group.right
-        for group in gql_result.data.active_user.groups
-        if group.right and "CAN_DELEGATE" in group.right["permissions"]
-    ]
+    rights = gql_result.data.active_user.delegable_rights
     main_menu_links = get_admin_menu()
     return render_template(
         "new-right.html",
@@ -15,7 +15,6 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from decimal import Decimal
-from functools import reduce
 
 from flask import Blueprint, g, render_template
 
@@ -37,32 +36,13 @@ def index():
 query Billing {
   activeUser {
     isAdmin
-    residences {
-      edges {
-        node {
-          billingCharges {
-            edges {
-              node {
-                remainingBalance
-              }
-            }
-          }
-        }
-      }
+    balance {
+      totalDue
     }
   }
 }"""
     gql_result = g.gql_client.execute_query(gql_query)
-    residences = [edge.node for edge in gql_result.data.active_user.residences.edges]
-    total_due = reduce(
-        lambda x, y: x + y,
-        [
-            edge.node.remaining_balance
-            for residence in residences
-            for edge in residence.billing_charges.edges
-        ],
-        0,
-    )
+    total_due = gql_result.data.active_user.balance.total_due
     main_menu_links = get_main_menu(gql_result.data.active_user.is_admin)
     return render_template(
         "billing.html",
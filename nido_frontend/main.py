@@ -15,17 +15,54 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import dataclasses
+import functools
+import inspect
+import json
 import os
+import re
 import secrets
-from typing import Any
-
-from flask import Flask, Request, Response, current_app, g, render_template, session
+from concurrent.futures import ThreadPoolExecutor
+from types import CodeType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+import click
+from flask import (
+    Flask,
+    Request,
+    Response,
+    current_app,
+    g,
+    render_template,
+    request,
+    session,
+)
+from graphql import GraphQLError
 from pyhanko.sign import signers, timestamps
-from sqlalchemy import Engine, create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from strawberry import Schema
+from sqlalchemy import Engine, create_engine, select
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from strawberry import UNSET, Schema
 from strawberry.flask.views import GraphQLView
-
+from strawberry.http import GraphQLRequestData
+from strawberry.http.exceptions import HTTPException
+from strawberry.types import ExecutionResult
+
+from nido_backend.db_models import (
+    DBCommunity,
+    check_remaining_balances,
+    create_missing_indexes,
+    migrate_boolean_permissions,
+    update_group_closure,
+    update_right_closure,
+    use_sqlite_transactions,
+)
+from nido_backend.gql_extensions import (
+    CachedDocuments,
+    ConcurrentRootFields,
+    DocumentCache,
+    QueryCostLimiter,
+    hash_query,
+)
+from nido_backend.gql_json import JSONQueryCache
 from nido_backend.gql_query import Issue
 from nido_backend.gql_schema import SchemaContext, create_schema
 
@@ -41,6 +78,11 @@ from .report_issues import bp as issues_bp
 from .resident_directory import bp as rd_bp
 from .signatures import bp as signing_bp
 
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
 dev_issue_list = [
     Issue(
         is_open=True,
@@ -59,45 +101,294 @@ dev_issue_list = [
 ]
 
 
+class PersistedQueryNotFound(Exception):
+    pass
+
+
+def persisted_query_not_found() -> ExecutionResult:
+    error = GraphQLError(
+        "PersistedQueryNotFound",
+        extensions={"code": "PERSISTED_QUERY_NOT_FOUND"},
+    )
+    return ExecutionResult(data=None, errors=[error])
+
+
 class GraphQLWithDB(GraphQLView):
+    """The GraphQL HTTP API.
+
+    A POST whose body is a JSON array runs each operation in turn with the
+    request's context, so they share its session, loaders and principal, and
+    responds with an array of their results. A GET has to run a persisted
+    query, and its response can be cached by a proxy when get_max_age is set.
+    """
+
+    def __init__(
+        self,
+        *args,
+        document_cache: Optional[DocumentCache] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+        reuse_nodes: bool = False,
+        max_batch_size: int = 20,
+        get_max_age: int = 0,
+        **kw,
+    ):
+        self.document_cache = document_cache
+        self.session_factory = session_factory
+        self.reuse_nodes = reuse_nodes
+        self.max_batch_size = max_batch_size
+        self.get_max_age = get_max_age
+        super().__init__(*args, **kw)
+
     def get_context(self, request: Request, response: Response) -> Any:
         user_id = session.get("user_id")
         community_id = session.get("community_id")
         db_session = g.db_session
 
-        return SchemaContext(dev_issue_list, db_session, user_id, community_id)
+        return SchemaContext(
+            dev_issue_list,
+            db_session,
+            user_id,
+            community_id,
+            self.session_factory,
+            self.reuse_nodes,
+        )
 
+    def should_render_graphiql(self, request) -> bool:
+        return (
+            "extensions" not in request.query_params
+            and super().should_render_graphiql(request)
+        )
 
-class GraphQLDataDict(dict):
-    def __getattr__(self, attr):
-        words = [
-            word.title() if i > 0 else word for i, word in enumerate(attr.split("_"))
-        ]
-        camel_case_attr = "".join(words)
-        result = self.get(camel_case_attr)
-        if isinstance(result, dict):
-            return GraphQLDataDict(result)
-        elif isinstance(result, list):
-            return [GraphQLDataDict(i) for i in result]
-        else:
-            return result
+    def encode_json(self, response_data: Any) -> Union[str, bytes]:
+        if orjson is not None:
+            return orjson.dumps(response_data)
+        return json.dumps(response_data, separators=(",", ":"))
+
+    def parse_json(self, data: Union[str, bytes]) -> Any:
+        try:
+            return json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise HTTPException(400, "Unable to parse request body as JSON") from e
+
+    def create_response(self, response_data: Any, sub_response: Response) -> Response:
+        response = super().create_response(response_data, sub_response)
+        # Errors aren't cached, so a missing persisted query gets registered.
+        if request.method == "GET" and self.get_max_age:
+            if not response_data.get("errors"):
+                # Results are per user, so only our own proxy may cache them,
+                # which X-Accel-Expires tells nginx and nginx doesn't forward.
+                response.cache_control.private = True
+                response.cache_control.max_age = self.get_max_age
+                response.headers["X-Accel-Expires"] = str(self.get_max_age)
+        return response
+
+    def parse_http_body(self, request) -> GraphQLRequestData:
+        if request.method == "GET":
+            data = self.parse_query_params(request.query_params)
+            if isinstance(data.get("extensions"), str):
+                data["extensions"] = self.parse_json(data["extensions"])
+            if self.persisted_query_hash(data) is None:
+                raise HTTPException(400, "GET requests must use a persisted query")
+            return self.get_request_data(data)
+        # Browsers can't send a cross-site JSON POST without a CORS preflight,
+        # which keeps forms on other sites from running mutations as the user.
+        if "application/json" not in (request.content_type or ""):
+            raise HTTPException(400, "POST requests must be application/json")
+        return self.get_request_data(self.parse_json(request.body))
+
+    def persisted_query_hash(self, data: Dict[str, Any]) -> Optional[str]:
+        extensions = data.get("extensions")
+        if not isinstance(extensions, dict):
+            return None
+        persisted_query = extensions.get("persistedQuery")
+        if not isinstance(persisted_query, dict):
+            return None
+        return persisted_query.get("sha256Hash")
+
+    def get_request_data(self, data: Dict[str, Any]) -> GraphQLRequestData:
+        if not isinstance(data, dict):
+            raise HTTPException(400, "Operations must be JSON objects")
+        if not (
+            isinstance(data.get("query"), (str, type(None)))
+            and isinstance(data.get("variables"), (dict, type(None)))
+            and isinstance(data.get("operationName"), (str, type(None)))
+        ):
+            raise HTTPException(400, "Malformed GraphQL operation")
+        request_data = GraphQLRequestData(
+            query=data.get("query"),
+            variables=data.get("variables"),
+            operation_name=data.get("operationName"),
+        )
+        query_hash = self.persisted_query_hash(data)
+        if self.document_cache is None or query_hash is None:
+            return request_data
+
+        # Automatic persisted queries: the client sends only the query's
+        # SHA-256 hash, and sends the full text once if it wasn't known.
+        if request_data.query is None:
+            request_data.query = self.document_cache.get_query(query_hash)
+            if request_data.query is None:
+                raise PersistedQueryNotFound()
+        elif hash_query(request_data.query) != query_hash:
+            raise HTTPException(400, "provided sha does not match query")
+        return request_data
+
+    def execute_operation(self, request, context, root_value) -> ExecutionResult:
+        try:
+            return super().execute_operation(request, context, root_value)
+        except PersistedQueryNotFound:
+            return persisted_query_not_found()
+
+    def run(self, request: Request, context=UNSET, root_value=UNSET) -> Response:
+        if request.method == "POST" and request.is_json:
+            # Only a batch's body starts with an array, so a single operation
+            # is parsed once, by parse_http_body.
+            if request.get_data().lstrip()[:1] == b"[":
+                return self.run_batch(request)
+        return super().run(request, context, root_value)
+
+    def run_batch(self, request: Request) -> Response:
+        operations = self.parse_json(request.get_data())
+        if len(operations) > self.max_batch_size:
+            raise HTTPException(
+                400, f"At most {self.max_batch_size} operations can be batched"
+            )
+
+        # Check every operation before running any, so a malformed one can't
+        # fail the request after earlier mutations have committed.
+        batch: List[Optional[GraphQLRequestData]] = []
+        for operation in operations:
+            try:
+                request_data = self.get_request_data(operation)
+            except PersistedQueryNotFound:
+                batch.append(None)
+                continue
+            if request_data.query is None:
+                raise HTTPException(400, "No GraphQL query found in the request")
+            batch.append(request_data)
+
+        sub_response = self.get_sub_response(request)
+        context = self.get_context(request, response=sub_response)
+        root_value = self.get_root_value(request)
+        results = []
+        for request_data in batch:
+            if request_data is None:
+                result = persisted_query_not_found()
+            else:
+                result = self.schema.execute_sync(
+                    request_data.query,
+                    root_value=root_value,
+                    variable_values=request_data.variables,
+                    context_value=context,
+                    operation_name=request_data.operation_name,
+                )
+            results.append(self.process_result(request, result))
+        sub_response.set_data(self.encode_json(results))
+        return sub_response
+
+
+class GraphQLData:
+    """An object of GraphQL result data, with its fields as snake_case attributes.
+
+    Results are converted once by to_graphql_data into a slotted subclass
+    per set of fields, so reading a field in a template is a plain attribute
+    lookup. Fields can also be read by their GraphQL name as items. Reading
+    a field that wasn't selected raises AttributeError or KeyError, which
+    templates see as undefined.
+    """
+
+    __slots__ = ()
+    _attrs: Dict[str, str] = {}
+
+    def __getitem__(self, key):
+        return getattr(self, self._attrs[key])
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={getattr(self, a)!r}" for k, a in self._attrs.items())
+        return f"GraphQLData({fields})"
+
+
+GRAPHQL_DATA_CLASSES: Dict[Tuple[str, ...], Type[GraphQLData]] = {}
+CAMEL_CASE_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def graphql_data_class(keys: Tuple[str, ...]) -> Type[GraphQLData]:
+    cls = GRAPHQL_DATA_CLASSES.get(keys)
+    if cls is None:
+        attrs = {key: CAMEL_CASE_RE.sub("_", key).lower() for key in keys}
+        cls = type(
+            "GraphQLData",
+            (GraphQLData,),
+            {"__slots__": tuple(attrs.values()), "_attrs": attrs},
+        )
+        GRAPHQL_DATA_CLASSES[keys] = cls
+    return cls
+
+
+def to_graphql_data(value: Any) -> Any:
+    if isinstance(value, dict):
+        cls = graphql_data_class(tuple(value))
+        obj = object.__new__(cls)
+        for attr, field_value in zip(cls.__slots__, value.values()):
+            object.__setattr__(obj, attr, to_graphql_data(field_value))
+        return obj
+    if isinstance(value, list):
+        return [to_graphql_data(item) for item in value]
+    return value
 
 
 @dataclasses.dataclass
 class IntegratedGraphQLClient:
     gql_schema: Schema
+    document_cache: Optional[DocumentCache] = None
+    # Answer the queries that compile to a single SQL statement with it.
+    json_queries: Optional[JSONQueryCache] = None
+    # Read-only sessions for resolving root fields concurrently.
+    session_factory: Optional[Callable[[], Session]] = None
+    reuse_nodes: bool = False
 
     def execute_query(self, query, variable_values=None):
         user_id = session.get("user_id")
         community_id = session.get("community_id")
         db_session = g.db_session
 
-        context = SchemaContext(dev_issue_list, db_session, user_id, community_id)
+        context = SchemaContext(
+            dev_issue_list,
+            db_session,
+            user_id,
+            community_id,
+            self.session_factory,
+            self.reuse_nodes,
+        )
+        if self.json_queries is not None and not variable_values:
+            data = self.json_queries.execute(query, context)
+            if data is not None:
+                return ExecutionResult(data=to_graphql_data(data), errors=None)
         result = self.gql_schema.execute_sync(query, variable_values, context)
-        result.data = GraphQLDataDict(result.data)
+        result.data = to_graphql_data(result.data)
         return result
 
 
+GQL_DOCUMENT_RE = re.compile(r"^\s*(query|mutation)\b[^{]*{", re.ASCII)
+
+
+def find_gql_documents(app: Flask) -> Iterator[str]:
+    """Yield the GraphQL documents written as string literals in the views,
+    including the functions defined inside them."""
+    for view_func in app.view_functions.values():
+        code = getattr(inspect.unwrap(view_func), "__code__", None)
+        if code is not None:
+            yield from find_code_gql_documents(code)
+
+
+def find_code_gql_documents(code: CodeType) -> Iterator[str]:
+    for const in code.co_consts:
+        if isinstance(const, str) and GQL_DOCUMENT_RE.match(const):
+            yield const
+        elif isinstance(const, CodeType):
+            yield from find_code_gql_documents(const)
+
+
 def create_app(testing_config=None):
     app = Flask(
         "nido_frontend",
@@ -147,6 +438,10 @@ def create_app(testing_config=None):
         ),
         echo=app.config.get("LOG_SQL", app.debug),
     )
+    # Mutations run each item in a savepoint. On SQLite this sets the
+    # driver's isolation_level to None and emits BEGIN explicitly, so that
+    # SAVEPOINTs nest inside the transaction rather than replacing it.
+    use_sqlite_transactions(db_engine)
     # XXX: Is a scoped session really necessary?
     # See https://docs.sqlalchemy.org/en/20/orm/contextual.html
     app.Session = scoped_session(sessionmaker(bind=db_engine))
@@ -159,8 +454,86 @@ def create_app(testing_config=None):
     def end_db_session(_response):
         current_app.Session.remove()
 
-    gql_schema = create_schema()
-    gql_client = IntegratedGraphQLClient(gql_schema)
+    @app.cli.command("check-balances")
+    @click.option("--fix", is_flag=True, help="Correct balances that disagree.")
+    def check_balances(fix):
+        """Compare stored billing balances against the ledger."""
+        db_session = app.Session()
+        mismatches = check_remaining_balances(db_session, fix)
+        for table, row_id, stored, ledger in mismatches:
+            click.echo(f"{table} {row_id}: stored {stored}, ledger {ledger}")
+        if fix:
+            db_session.commit()
+        click.echo(f"{len(mismatches)} mismatched balances{' fixed' if fix else ''}")
+        app.Session.remove()
+
+    @app.cli.command("create-indexes")
+    def create_indexes():
+        """Add indexes that are missing from an existing database."""
+        db_session = app.Session()
+        created = create_missing_indexes(db_session.connection())
+        db_session.commit()
+        for name in created:
+            click.echo(f"Created {name}")
+        click.echo(f"{len(created)} indexes created")
+        app.Session.remove()
+
+    @app.cli.command("migrate-right-permissions")
+    def migrate_right_permissions():
+        """Move rights from a boolean column per permission to a bitmask."""
+        db_session = app.Session()
+        migrated = migrate_boolean_permissions(db_session.connection())
+        db_session.commit()
+        click.echo("Migrated" if migrated else "Nothing to migrate")
+        app.Session.remove()
+
+    @app.cli.command("rebuild-closures")
+    def rebuild_closures():
+        """Recompute group management and right delegation, for every community."""
+        db_session = app.Session()
+        community_ids = db_session.scalars(select(DBCommunity.id)).all()
+        update_group_closure(db_session.connection(), community_ids)
+        update_right_closure(db_session.connection(), community_ids)
+        db_session.commit()
+        click.echo(f"Rebuilt closures for {len(community_ids)} communities")
+        app.Session.remove()
+
+    document_cache = DocumentCache(app.config.get("GRAPHQL_DOCUMENT_CACHE_SIZE", 256))
+    execution_context_class = None
+    read_only_sessions = None
+    if root_field_threads := app.config.get("GRAPHQL_ROOT_FIELD_THREADS", 0):
+        executor = ThreadPoolExecutor(root_field_threads, "nido-gql")
+        execution_context_class = ConcurrentRootFields.using(executor)
+        read_only_options = {"postgresql_readonly": True}
+        if db_engine.dialect.name == "postgresql":
+            # So each fork reads a single snapshot. On SQLite, that's the
+            # transaction use_sqlite_transactions begins.
+            read_only_options["isolation_level"] = "REPEATABLE READ"
+        read_only_sessions = sessionmaker(
+            bind=db_engine.execution_options(**read_only_options),
+            autoflush=False,
+        )
+    gql_schema = create_schema(
+        extensions=[
+            functools.partial(
+                QueryCostLimiter,
+                max_cost=app.config.get("GRAPHQL_MAX_QUERY_COST", 10000),
+                default_list_size=app.config.get("GRAPHQL_DEFAULT_LIST_SIZE", 10),
+            ),
+            functools.partial(CachedDocuments, document_cache=document_cache),
+        ],
+        execution_context_class=execution_context_class,
+    )
+    json_queries = None
+    if app.config.get("GRAPHQL_COMPILE_JSON_QUERIES", False):
+        json_queries = JSONQueryCache(gql_schema, document_cache)
+    gql_client = IntegratedGraphQLClient(
+        gql_schema,
+        document_cache,
+        json_queries,
+        read_only_sessions,
+        app.config.get("GRAPHQL_REUSE_NODES", False),
+    )
 
     @app.before_request
     def create_gql_client():
@@ -206,10 +579,24 @@ def create_app(testing_config=None):
     app.register_blueprint(signing_bp, url_prefix="/signatures")
     app.add_url_rule("/", endpoint="index", view_func=household_index)
 
-    if app.debug:
-        app.add_url_rule(
-            "/api/graphql",
-            view_func=GraphQLWithDB.as_view("graphql_view", schema=gql_schema),
-        )
+    # Parse and validate every query the views send ahead of time, so the
+    # first request after startup doesn't pay for it.
+    failures = document_cache.register_all(gql_schema, find_gql_documents(app))
+    for query, errors in failures.items():
+        app.logger.warning(f"Invalid GraphQL document in a view: {errors}\n{query}")
+
+    app.add_url_rule(
+        "/api/graphql",
+        view_func=GraphQLWithDB.as_view(
+            "graphql_view",
+            schema=gql_schema,
+            graphiql=app.debug,
+            document_cache=document_cache,
+            session_factory=read_only_sessions,
+            reuse_nodes=app.config.get("GRAPHQL_REUSE_NODES", False),
+            max_batch_size=app.config.get("GRAPHQL_MAX_BATCH_SIZE", 20),
+            get_max_age=app.config.get("GRAPHQL_GET_MAX_AGE", 0),
+        ),
+    )
 
     return app
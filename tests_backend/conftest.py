@@ -1,3 +1,5 @@
+import functools
+
 import pytest
 from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
@@ -5,8 +7,10 @@ from sqlalchemy.orm import Session, scoped_session, sessionmaker
 from strawberry import Schema
 
 from generate_mock_data import seed_db
-from nido_backend.db_models import Base
+from nido_backend.db_models import Base, use_sqlite_transactions
+from nido_backend.gql_extensions import CachedDocuments, DocumentCache, QueryCostLimiter
 from nido_backend.gql_schema import SchemaContext, create_schema
+from nido_backend.principal import principals
 
 
 class TestSchema(Schema):
@@ -30,7 +34,7 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
 
 @pytest.fixture(scope="session")
 def db_engine():
-    engine = create_engine("sqlite:///:memory:", echo=False)
+    engine = use_sqlite_transactions(create_engine("sqlite:///:memory:", echo=False))
     Base.metadata.create_all(bind=engine)
     with Session(engine) as db_session:
         seed_db(db_session)
@@ -53,6 +57,49 @@ def db_session(db_engine):
     connection.close()
 
 
+@pytest.fixture(scope="function")
+def sql_statements(db_session):
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    connection = db_session.get_bind()
+    event.listen(connection, "before_cursor_execute", record_statement)
+    yield statements
+    event.remove(connection, "before_cursor_execute", record_statement)
+
+
 @pytest.fixture(scope="function")
 def test_schema(db_session):
     return create_schema(TestSchema, db_session=db_session)
+
+
+@pytest.fixture(scope="function")
+def document_cache():
+    return DocumentCache(maxsize=1)
+
+
+@pytest.fixture(scope="function")
+def cached_test_schema(db_session, document_cache):
+    return create_schema(
+        TestSchema,
+        db_session=db_session,
+        extensions=[functools.partial(CachedDocuments, document_cache=document_cache)],
+    )
+
+
+@pytest.fixture(scope="function")
+def cost_limited_test_schema(db_session):
+    return create_schema(
+        TestSchema,
+        db_session=db_session,
+        extensions=[functools.partial(QueryCostLimiter, max_cost=500)],
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_principals():
+    # Rolled back tests can reuse a permissions_version with different data.
+    yield
+    principals.clear()
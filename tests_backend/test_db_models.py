@@ -1,17 +1,28 @@
+import datetime
+
 import pytest
-from sqlalchemy import func, select
+from sqlalchemy import create_engine, func, select, text, update
 from sqlalchemy.exc import IntegrityError
 
 from nido_backend.db_models import (
+    DBBillingCharge,
+    DBBillingPayment,
+    DBBillingTransaction,
     DBCommunity,
     DBDirFile,
     DBDirFolder,
     DBEmailContact,
     DBGroup,
+    DBGroupClosure,
     DBGroupMembership,
     DBOccupancyApplication,
     DBResidenceOccupancy,
     DBRight,
+    DBRightClosure,
+    check_remaining_balances,
+    migrate_boolean_permissions,
+    update_group_closure,
+    update_right_closure,
 )
 from nido_backend.enums import PermissionsFlag
 
@@ -67,9 +78,11 @@ def test_right_on_delete_null(db_session):
 
 def test_right_permissions_attr_on_object():
     new_right = DBRight(community_id=0, name="Unlimited Right")
+    assert not new_right.permits(PermissionsFlag.CAN_DELEGATE)
     for member in PermissionsFlag:
-        setattr(new_right, member.name.lower(), member)
+        new_right.permissions |= member
     assert new_right.permissions == ~PermissionsFlag(0)
+    assert new_right.permits(["CAN_DELEGATE", "CREATE_GROUPS"])
 
 
 def test_right_permissions_attr_on_class(db_session):
@@ -93,6 +106,41 @@ def test_right_permits_hybrid_method_on_class(db_session):
     assert right_count > 0
 
 
+def test_right_permits_filters_on_the_mask(db_session):
+    right = db_session.get(DBRight, 1)
+    right.permissions = PermissionsFlag.CREATE_GROUPS
+    db_session.commit()
+    stmt = select(DBRight.id).where(DBRight.permits(PermissionsFlag.CAN_DELEGATE))
+    assert right.id not in db_session.scalars(stmt).all()
+    stmt = select(DBRight.id).where(DBRight.permits(PermissionsFlag.CREATE_GROUPS))
+    assert right.id in db_session.scalars(stmt).all()
+
+
+def test_migrate_boolean_permissions():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                'CREATE TABLE "right" (id INTEGER PRIMARY KEY, name VARCHAR, '
+                "can_delegate BOOLEAN, create_groups BOOLEAN)"
+            )
+        )
+        connection.execute(
+            text(
+                'INSERT INTO "right" VALUES (1, "all", 1, 1), '
+                '(2, "groups", 0, 1), (3, "none", 0, 0)'
+            )
+        )
+        assert migrate_boolean_permissions(connection)
+        rows = connection.execute(text('SELECT * FROM "right" ORDER BY id')).all()
+        assert [tuple(row) for row in rows] == [
+            (1, "all", 3),
+            (2, "groups", 2),
+            (3, "none", 0),
+        ]
+        assert not migrate_boolean_permissions(connection)
+
+
 def test_directory_folder_name_cannot_contain_underscore(db_session):
     invalid = DBDirFolder(name="invalid_name", community_id=1)
     db_session.add(invalid)
@@ -109,3 +157,105 @@ def test_occupancy_application_foreign_key(db_session):
     db_session.add(application)
     with pytest.raises(IntegrityError):
         db_session.commit()
+
+
+def test_remaining_balances_follow_the_ledger(db_session):
+    charge = DBBillingCharge(
+        community_id=1,
+        name="Test Charge",
+        amount=5000,
+        due_date=datetime.date.today(),
+    )
+    charge.residence_id = 1
+    payment = DBBillingPayment(
+        community_id=1,
+        payer_id=1,
+        amount=3000,
+        payment_date=datetime.datetime.now(),
+    )
+    db_session.add_all([charge, payment])
+    db_session.commit()
+    assert (charge.remaining_balance, payment.remaining_balance) == (5000, 3000)
+
+    transaction = DBBillingTransaction(
+        charge=charge, payment=payment, transaction_amount=3000
+    )
+    db_session.add(transaction)
+    db_session.commit()
+    assert (charge.remaining_balance, payment.remaining_balance) == (2000, 0)
+
+    db_session.delete(transaction)
+    db_session.commit()
+    assert (charge.remaining_balance, payment.remaining_balance) == (5000, 3000)
+
+    charge.amount = 6000
+    db_session.commit()
+    assert charge.remaining_balance == 6000
+    assert check_remaining_balances(db_session) == []
+
+
+def test_check_remaining_balances_fixes_drift(db_session):
+    assert check_remaining_balances(db_session) == []
+    db_session.execute(
+        update(DBBillingCharge)
+        .where(DBBillingCharge.id == 1)
+        .values(remaining_balance=DBBillingCharge.remaining_balance + 1)
+    )
+    mismatches = check_remaining_balances(db_session, fix=True)
+    assert [m[:2] for m in mismatches] == [("billing_charge", 1)]
+    assert check_remaining_balances(db_session) == []
+
+
+def assert_closures_match_rebuild(db_session):
+    db_session.commit()
+    group_stmt = select(DBGroupClosure.__table__)
+    right_stmt = select(DBRightClosure.__table__)
+    refreshed = (
+        set(db_session.execute(group_stmt).all()),
+        set(db_session.execute(right_stmt).all()),
+    )
+    community_ids = db_session.scalars(select(DBCommunity.id)).all()
+    update_group_closure(db_session.connection(), community_ids)
+    update_right_closure(db_session.connection(), community_ids)
+    rebuilt = (
+        set(db_session.execute(group_stmt).all()),
+        set(db_session.execute(right_stmt).all()),
+    )
+    assert refreshed == rebuilt
+
+
+def test_closures_are_refreshed_incrementally(db_session):
+    audit = DBGroup(community_id=1, name="Audit")
+    audit.managing_group_id = 3
+    db_session.add(audit)
+    assert_closures_match_rebuild(db_session)
+
+    # The Board of Directors is managed through the group it manages.
+    db_session.get(DBGroup, 1).managing_group_id = audit.id
+    assert_closures_match_rebuild(db_session)
+    db_session.get(DBGroup, 3).managing_group_id = 3
+    assert_closures_match_rebuild(db_session)
+    db_session.get(DBGroup, 1).managing_group_id = 1
+    db_session.delete(audit)
+    assert_closures_match_rebuild(db_session)
+
+    treasury = DBRight(community_id=1, name="Treasury")
+    treasury.parent_right_id = 1
+    treasury.permissions = PermissionsFlag.CAN_DELEGATE
+    db_session.add(treasury)
+    assert_closures_match_rebuild(db_session)
+    bookkeeping = DBRight(community_id=1, name="Bookkeeping")
+    bookkeeping.parent_right_id = treasury.id
+    bookkeeping.permissions = ~PermissionsFlag(0)
+    db_session.add(bookkeeping)
+    assert_closures_match_rebuild(db_session)
+    db_session.get(DBRight, 1).permissions = PermissionsFlag.CAN_DELEGATE
+    assert_closures_match_rebuild(db_session)
+    treasury.parent_right_id = bookkeeping.id
+    assert_closures_match_rebuild(db_session)
+
+
+def test_renaming_a_right_leaves_its_closure_alone(db_session, sql_statements):
+    db_session.get(DBRight, 1).name = "Everything"
+    db_session.flush()
+    assert not any("right_closure" in statement for statement in sql_statements)
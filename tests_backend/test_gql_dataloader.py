@@ -0,0 +1,71 @@
+from sqlalchemy import select
+
+from nido_backend.db_models import DBAssociate, DBEmailContact
+from nido_backend.gql_dataloader import RelationshipLoader
+
+
+def test_relationship_loader_batches_siblings(db_session, sql_statements):
+    associates = db_session.scalars(select(DBAssociate)).all()
+    loader = RelationshipLoader(db_session)
+    sql_statements.clear()
+    emails = {
+        a.id: [cm.email for cm in loader.load(a, DBAssociate.contact_methods)]
+        for a in associates
+    }
+    assert len(sql_statements) == 1
+    expected = {
+        a.id: [
+            cm.email
+            for cm in db_session.scalars(
+                select(DBEmailContact)
+                .join(DBAssociate.contact_methods.property.secondary)
+                .where(
+                    DBAssociate.contact_methods.property.secondary.c.associate_id
+                    == a.id
+                )
+                .order_by(DBEmailContact.id)
+            )
+        ]
+        for a in associates
+    }
+    assert emails == expected
+
+
+def test_relationship_loader_skips_loaded(db_session, sql_statements):
+    associate = db_session.get(DBAssociate, 1)
+    loader = RelationshipLoader(db_session)
+    loader.load(associate, DBAssociate.groups)
+    sql_statements.clear()
+    loader.load(associate, DBAssociate.groups)
+    assert len(sql_statements) == 0
+
+
+test_lazy_occupants_query = """
+{
+  activeCommunity {
+    residences {
+      edges {
+        node {
+          ... on Residence {
+            occupants {
+              edges {
+                node {
+                  fullName
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}"""
+
+
+def test_gql_lazy_relationships_are_batched(test_schema, sql_statements):
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(test_lazy_occupants_query, context_value=context)
+    assert result.errors is None
+    residences = result.data["activeCommunity"]["residences"]["edges"]
+    assert len(residences) > 3
+    assert len(sql_statements) <= 3
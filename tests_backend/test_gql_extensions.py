@@ -0,0 +1,153 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import strawberry.schema.execute
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from generate_mock_data import seed_db
+from nido_backend.db_models import Base, DBCommunity, use_sqlite_transactions
+from nido_backend.gql_extensions import ConcurrentRootFields, hash_query
+from nido_backend.gql_schema import SchemaContext, create_schema
+
+test_query = "{activeUser{personalName}}"
+
+
+def test_document_cache_skips_parsing(cached_test_schema, document_cache, monkeypatch):
+    schema = cached_test_schema
+    assert document_cache.register(schema, test_query) == []
+
+    def fail_parse(*args, **kwargs):
+        raise AssertionError("document was parsed again")
+
+    monkeypatch.setattr(strawberry.schema.execute, "parse_document", fail_parse)
+    context = {"user_id": 1, "community_id": 1}
+    result = schema.execute_sync(test_query, context_value=context)
+    assert result.data["activeUser"]["personalName"] == "Dylan"
+
+
+def test_document_cache_adds_valid_queries_only(cached_test_schema, document_cache):
+    schema = cached_test_schema
+    context = {"user_id": 1, "community_id": 1}
+    schema.execute_sync("{activeUser{notAField}}", context_value=context)
+    assert document_cache.get(hash_query("{activeUser{notAField}}")) is None
+
+    schema.execute_sync(test_query, context_value=context)
+    assert document_cache.get_query(hash_query(test_query)) == test_query
+    schema.execute_sync("{activeUser{familyName}}", context_value=context)
+    assert document_cache.get(hash_query(test_query)) is None
+
+
+def test_query_cost_is_reported(cost_limited_test_schema):
+    query = """
+    {
+      activeCommunity {
+        residences(first: 2) { edges { node { street } } }
+        groups { edges { node { name } } }
+      }
+    }"""
+    context = {"user_id": 1, "community_id": 1}
+    result = cost_limited_test_schema.execute_sync(query, context_value=context)
+    assert result.errors is None
+    # Residences, their edges and nodes count 2 each, groups 10 each.
+    cost = result.extensions["cost"]["requestedQueryCost"]
+    assert cost == 1 + 3 * 2 + 3 * 10
+
+
+def test_query_cost_limit_rejects_deep_queries(cost_limited_test_schema):
+    query = """
+    {
+      activeCommunity {
+        residences {
+          edges { node { occupants { edges { node {
+            first: groups { customMembers { residences { edges { node { id } } } } }
+            second: groups { name }
+          } } } } }
+        }
+      }
+    }"""
+    context = {"user_id": 1, "community_id": 1}
+    result = cost_limited_test_schema.execute_sync(query, context_value=context)
+    assert result.data is None
+    assert result.errors[0].extensions["code"] == "QUERY_TOO_COSTLY"
+    assert result.extensions["cost"]["requestedQueryCost"] > 500
+
+
+def test_query_cost_ignores_negative_page_sizes(cost_limited_test_schema):
+    deep_selection = """
+          edges { node { occupants { edges { node {
+            groups { customMembers { residences { edges { node { id } } } } }
+          } } } } }"""
+    query = f"""
+    query Costly($size: Int) {{
+      activeCommunity {{
+        residences {{ {deep_selection} }}
+        literal: residences(first: -1000000) {{ {deep_selection} }}
+        variable: residences(last: $size) {{ {deep_selection} }}
+      }}
+    }}"""
+    context = {"user_id": 1, "community_id": 1}
+    result = cost_limited_test_schema.execute_sync(
+        query, {"size": -1000000}, context_value=context
+    )
+    assert result.data is None
+    assert result.errors[0].extensions["code"] == "QUERY_TOO_COSTLY"
+    assert result.extensions["cost"]["requestedQueryCost"] > 500
+
+
+def test_concurrent_root_fields(tmp_path):
+    # Every thread needs its own connection to the same database.
+    engine = create_engine(f"sqlite:///{tmp_path / 'nido.sqlite3'}")
+    use_sqlite_transactions(engine)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db_session:
+        seed_db(db_session)
+    threads = set()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record_thread(*args):
+        threads.add(threading.get_ident())
+
+    query = """
+    {
+      activeUser { personalName }
+      activeCommunity { name }
+      broken: activeUser(referenceCommunity: "abcde") { personalName }
+    }"""
+    with ThreadPoolExecutor(2) as executor:
+        schema = create_schema(
+            execution_context_class=ConcurrentRootFields.using(executor)
+        )
+        with Session(engine) as db_session:
+            context = SchemaContext([], db_session, 1, 1, sessionmaker(bind=engine))
+            result = schema.execute_sync(query, context_value=context)
+
+    assert result.data == {
+        "activeUser": {"personalName": "Dylan"},
+        "activeCommunity": {"name": "Nolan-Shields Condos"},
+        "broken": None,
+    }
+    assert [error.path for error in result.errors] == [["broken"]]
+    assert len(threads) > 1
+
+
+def test_forked_context_reads_one_snapshot(tmp_path):
+    db_path = tmp_path / "nido.sqlite3"
+    # Readers don't block writers in WAL mode.
+    sqlite3.connect(db_path).execute("PRAGMA journal_mode=WAL").close()
+    engine = create_engine(f"sqlite:///{db_path}")
+    use_sqlite_transactions(engine)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db_session:
+        seed_db(db_session)
+
+    name_stmt = select(DBCommunity.name).where(DBCommunity.id == 1)
+    with Session(engine) as db_session:
+        context = SchemaContext([], db_session, 1, 1, sessionmaker(bind=engine))
+        fork = context.fork()
+        name = fork.db_session.scalar(name_stmt)
+        db_session.get(DBCommunity, 1).name = "Renamed"
+        db_session.commit()
+        assert fork.db_session.scalar(name_stmt) == name
+        fork.db_session.close()
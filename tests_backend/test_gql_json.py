@@ -0,0 +1,116 @@
+from nido_backend.gql_json import JSONQueryCache
+from nido_backend.gql_schema import SchemaContext
+
+test_directory_query = """
+query ResidentDir {
+  activeUser {
+    id
+    isAdmin
+  }
+  activeCommunity {
+    name
+    residences {
+      totalCount
+      edges {
+        node {
+          id
+          unitNo
+          occupants {
+            edges {
+              node {
+                fullName
+                groups {
+                  name
+                }
+                emails: contactMethods {
+                  __typename
+                  ... on EmailContact {
+                    email
+                  }
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}"""
+
+test_household_query = """
+query MyHousehold {
+  activeUser {
+    isAdmin
+    residences {
+      edges {
+        node {
+          unitNo
+          occupants {
+            edges {
+              node {
+                fullName
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}"""
+
+
+def test_gql_json_query_matches_execution(test_schema, db_session, sql_statements):
+    json_queries = JSONQueryCache(test_schema)
+    context_args = {"user_id": 1, "community_id": 1}
+    for query in (test_directory_query, test_household_query):
+        context = SchemaContext([], db_session, **context_args)
+        context.principal
+        sql_statements.clear()
+        data = json_queries.execute(query, context)
+        assert len(sql_statements) == 1
+        result = test_schema.execute_sync(query, context_value=context_args)
+        assert result.errors is None
+        assert data == result.data
+
+
+def test_gql_json_query_unsupported(test_schema, db_session):
+    json_queries = JSONQueryCache(test_schema)
+    query = "{ activeCommunity { residences(first: 2) { totalCount } } }"
+    context = SchemaContext([], db_session, 1, 1)
+    assert json_queries.execute(query, context) is None
+    assert json_queries.get_document(query) is None
+
+    logged_out = SchemaContext([], db_session)
+    assert json_queries.execute(test_household_query, logged_out) is None
+
+
+def test_gql_json_query_leaves_resolvers_to_execution(
+    test_schema, db_session, sql_statements
+):
+    json_queries = JSONQueryCache(test_schema)
+    context_args = {"user_id": 1, "community_id": 1}
+    rights_query = """
+    {
+      activeCommunity {
+        rights {
+          edges { node { name groups { name } %s } }
+        }
+      }
+    }"""
+    # Right.parentRight and childRights leave out a right's own row, which
+    # the database relationship includes for the root right.
+    resolved_query = rights_query % "parentRight { name } childRights { name }"
+    context = SchemaContext([], db_session, **context_args)
+    assert json_queries.execute(resolved_query, context) is None
+    result = test_schema.execute_sync(resolved_query, context_value=context_args)
+    assert result.errors is None
+    root = result.data["activeCommunity"]["rights"]["edges"][0]["node"]
+    assert root["parentRight"] is None
+    assert root["name"] not in [r["name"] for r in root["childRights"]]
+
+    mapped_query = rights_query % ""
+    context = SchemaContext([], db_session, **context_args)
+    data = json_queries.execute(mapped_query, context)
+    assert data is not None
+    result = test_schema.execute_sync(mapped_query, context_value=context_args)
+    assert data == result.data
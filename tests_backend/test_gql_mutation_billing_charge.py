@@ -0,0 +1,77 @@
+from sqlalchemy import func, select
+
+from nido_backend.db_models import DBBillingCharge
+from nido_backend.gql_helpers import encode_gql_id
+
+test_edit_query = """
+mutation TestEdit($input: [EditBillingChargeInput!]!) {
+  billingCharges {
+    edit(input: $input, batch: true) {
+      charges {
+        name
+      }
+      errors {
+        message
+      }
+    }
+  }
+}"""
+
+test_delete_query = """
+mutation TestDelete($input: [DeleteBillingChargeInput!]!) {
+  billingCharges {
+    delete(input: $input, batch: true) {
+      errors {
+        message
+      }
+    }
+  }
+}"""
+
+
+def test_gql_mutation_batch_edit_charges(test_schema, db_session, sql_statements):
+    charge_ids = db_session.scalars(
+        select(DBBillingCharge.id).order_by(DBBillingCharge.id).limit(3)
+    ).all()
+    var_dir = {
+        "input": [
+            {"charge": encode_gql_id("billing_charge", charge_id), "name": "Fee"}
+            for charge_id in charge_ids
+        ]
+        + [{"charge": encode_gql_id("billing_charge", 999999), "name": "Fee"}]
+    }
+    context = {"user_id": 1, "community_id": 1}
+    sql_statements.clear()
+    result = test_schema.execute_sync(test_edit_query, var_dir, context)
+    assert result.errors is None
+    payload = result.data["billingCharges"]["edit"]
+    assert payload["charges"] == [{"name": "Fee"}] * 3
+    assert len(payload["errors"]) == 1
+    updates = [s for s in sql_statements if s.startswith("UPDATE billing_charge")]
+    assert len(updates) == 1
+    names = db_session.scalars(
+        select(DBBillingCharge.name).where(DBBillingCharge.id.in_(charge_ids))
+    )
+    assert set(names) == {"Fee"}
+
+
+def test_gql_mutation_batch_delete_charges(test_schema, db_session, sql_statements):
+    charge_ids = db_session.scalars(
+        select(DBBillingCharge.id).order_by(DBBillingCharge.id).limit(3)
+    ).all()
+    old_count = db_session.scalar(select(func.count()).select_from(DBBillingCharge))
+    var_dir = {
+        "input": [
+            {"charge": encode_gql_id("billing_charge", charge_id)}
+            for charge_id in charge_ids
+        ]
+    }
+    context = {"user_id": 1, "community_id": 1}
+    sql_statements.clear()
+    result = test_schema.execute_sync(test_delete_query, var_dir, context)
+    assert result.errors is None
+    assert result.data["billingCharges"]["delete"]["errors"] == []
+    deletes = [s for s in sql_statements if s.startswith("DELETE FROM billing_charge")]
+    assert len(deletes) == 1
+    new_count = db_session.scalar(select(func.count()).select_from(DBBillingCharge))
+    assert new_count == old_count - 3
@@ -1,6 +1,13 @@
 from sqlalchemy import func, select
 
-from nido_backend.db_models import DBGroup, DBGroupMembership
+from nido_backend.authorization import oso
+from nido_backend.db_models import (
+    DBCommunity,
+    DBGroup,
+    DBGroupClosure,
+    DBGroupMembership,
+    DBUser,
+)
 from nido_backend.gql_helpers import encode_gql_id
 
 test_new_query = """
@@ -68,6 +75,22 @@ def test_gql_mutation_add_members_group_success(test_schema, db_session):
     assert new_count == old_count + 1
 
 
+def test_gql_mutation_add_members_bumps_permissions_version(test_schema, db_session):
+    version_stmt = select(DBCommunity.permissions_version).where(DBCommunity.id == 1)
+    old_version = db_session.scalar(version_stmt)
+    var_dir = {
+        "input": {
+            "group": encode_gql_id("group", 2),
+            "members": encode_gql_id("user", 8),
+        }
+    }
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(test_add_members_query, var_dir, context)
+    assert result.errors is None
+    db_session.expire_all()
+    assert db_session.scalar(version_stmt) > old_version
+
+
 test_remove_members_query = """
 mutation MyMutation($input: [RemoveMembersGroupInput!] = {group: "", members: ""}) {
   groups {
@@ -111,3 +134,145 @@ def test_gql_mutation_delete_group_success(test_schema, db_session):
     test_schema.execute_sync(test_delete_query, var_dir, context)
     new_count = db_session.scalar(select(func.count()).select_from(DBGroup))
     assert new_count == old_count - 1
+
+
+def test_gql_mutation_group_closure_is_maintained(test_schema, db_session):
+    var_dir = {"input": {"name": "Audit", "managingGroup": encode_gql_id("group", 3)}}
+    context = {"user_id": 1, "community_id": 1}
+    test_schema.execute_sync(test_new_query, var_dir, context)
+    group = db_session.scalars(select(DBGroup).where(DBGroup.name == "Audit")).one()
+    closure_stmt = select(DBGroupClosure.ancestor_id, DBGroupClosure.depth).where(
+        DBGroupClosure.descendant_id == group.id
+    )
+    assert set(db_session.execute(closure_stmt).all()) == {(3, 1), (1, 2)}
+
+    # User 3 is only in the Board of Directors, which manages the Treasurer,
+    # which manages the new group.
+    user = db_session.get(DBUser, 3)
+    assert group.is_managed_by(user)
+    assert oso.is_allowed(user, "update", group)
+
+    var_dir = {"input": {"group": encode_gql_id("group", group.id)}}
+    test_schema.execute_sync(test_delete_query, var_dir, context)
+    assert db_session.execute(closure_stmt).all() == []
+
+
+test_batch_new_query = """
+mutation TestNew($input: [NewGroupInput!]!) {
+  groups {
+    new(input: $input, batch: true) {
+      groups {
+        name
+      }
+      errors {
+        message
+      }
+    }
+  }
+}"""
+
+
+def test_gql_mutation_batch_new_groups(test_schema, db_session, sql_statements):
+    var_dir = {
+        "input": [
+            {"name": "Garden"},
+            {"name": "Ghosts", "customMembers": [encode_gql_id("associate", 999)]},
+            {"name": "Pool", "customMembers": [encode_gql_id("associate", 2)]},
+        ]
+    }
+    context = {"user_id": 1, "community_id": 1}
+    sql_statements.clear()
+    result = test_schema.execute_sync(test_batch_new_query, var_dir, context)
+    assert result.errors is None
+    payload = result.data["groups"]["new"]
+    assert payload["groups"] == [{"name": "Garden"}, {"name": "Pool"}]
+    assert payload["errors"] == [{"message": "Unknown Database Error"}]
+    # Only the failed group's savepoint was rolled back.
+    assert len([s for s in sql_statements if s.startswith("SAVEPOINT")]) == 3
+    assert len([s for s in sql_statements if s.startswith("ROLLBACK TO")]) == 1
+    names = db_session.scalars(
+        select(DBGroup.name).where(DBGroup.name.in_(["Garden", "Ghosts", "Pool"]))
+    )
+    assert set(names) == {"Garden", "Pool"}
+
+
+def test_gql_mutation_failed_item_keeps_its_siblings(test_schema, db_session):
+    var_dir = {
+        "input": [
+            {"name": "Garden"},
+            {"name": "Ghosts", "customMembers": [encode_gql_id("associate", 999)]},
+            {"name": "Pool"},
+        ]
+    }
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(
+        test_batch_new_query.replace("batch: true", "batch: false"), var_dir, context
+    )
+    assert result.data["groups"]["new"]["groups"] == [
+        {"name": "Garden"},
+        {"name": "Pool"},
+    ]
+    names = db_session.scalars(
+        select(DBGroup.name).where(DBGroup.name.in_(["Garden", "Ghosts", "Pool"]))
+    )
+    assert set(names) == {"Garden", "Pool"}
+
+
+def test_gql_mutation_failed_batch_keeps_item_errors(
+    test_schema, db_session, monkeypatch
+):
+    def commit():
+        raise RuntimeError("commit failed")
+
+    monkeypatch.setattr(db_session, "commit", commit)
+    var_dir = {
+        "input": [
+            {"name": "Garden"},
+            {"name": "Ghosts", "customMembers": [encode_gql_id("associate", 999)]},
+        ]
+    }
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(test_batch_new_query, var_dir, context)
+    payload = result.data["groups"]["new"]
+    assert payload["groups"] == []
+    assert payload["errors"] == [{"message": "Unknown Database Error"}] * 2
+
+
+test_rename_payload_query = """
+mutation TestRename($input: [RenameGroupInput!]!) {
+  groups {
+    rename(input: $input) {
+      groups {
+        name
+        managedBy {
+          name
+        }
+        customMembers {
+          id
+        }
+      }
+    }
+  }
+}"""
+
+
+def test_gql_mutation_payload_is_eager_loaded(test_schema, db_session, sql_statements):
+    var_dir = {
+        "input": [
+            {"group": encode_gql_id("group", group_id), "name": f"Group {group_id}"}
+            for group_id in (1, 2, 3)
+        ]
+    }
+    context = {"user_id": 1, "community_id": 1}
+    sql_statements.clear()
+    result = test_schema.execute_sync(test_rename_payload_query, var_dir, context)
+    assert result.errors is None
+    groups = result.data["groups"]["rename"]["groups"]
+    assert [g["name"] for g in groups] == ["Group 1", "Group 2", "Group 3"]
+    assert [g["managedBy"]["name"] for g in groups] == ["Group 1"] * 3
+    assert [len(g["customMembers"]) for g in groups] == [6, 1, 1]
+    # The groups, their managing groups and their members, for all three.
+    last_release = max(
+        i for i, s in enumerate(sql_statements) if s.startswith("RELEASE")
+    )
+    assert len(sql_statements[last_release + 1 :]) == 3
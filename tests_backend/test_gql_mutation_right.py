@@ -0,0 +1,99 @@
+from sqlalchemy import select
+
+from nido_backend.db_models import DBGroup, DBRight, DBRightClosure
+from nido_backend.gql_helpers import encode_gql_id
+
+test_delegate_query = """
+mutation TestDelegate($input: [DelegateRightInput!]!) {
+  rights {
+    delegate(input: $input) {
+      newRights {
+        id
+      }
+      errors {
+        message
+      }
+    }
+  }
+}"""
+
+test_rights_query = """
+{
+  activeUser {
+    delegableRights {
+      name
+    }
+  }
+  activeCommunity {
+    rights {
+      edges {
+        node {
+          name
+          revocationImpact {
+            rights {
+              name
+            }
+            groups {
+              name
+            }
+          }
+        }
+      }
+    }
+  }
+}"""
+
+
+def delegate(test_schema, parent_id, name, permissions):
+    var_dir = {
+        "input": {
+            "parentId": encode_gql_id("right", parent_id),
+            "name": name,
+            "permissions": permissions,
+        }
+    }
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(test_delegate_query, var_dir, context)
+    assert result.errors is None
+    return result.data["rights"]["delegate"]
+
+
+def test_gql_mutation_delegate_right_closure(test_schema, db_session):
+    delegate(test_schema, 1, "Treasury", ["CAN_DELEGATE"])
+    treasury = db_session.scalars(select(DBRight).where(DBRight.name == "Treasury"))
+    treasury_id = treasury.one().id
+    db_session.get(DBGroup, 1).right_id = treasury_id
+    db_session.commit()
+    delegate(test_schema, treasury_id, "Bookkeeping", [])
+    bookkeeping_id = db_session.scalar(
+        select(DBRight.id).where(DBRight.name == "Bookkeeping")
+    )
+    db_session.get(DBGroup, 3).right_id = bookkeeping_id
+    db_session.commit()
+
+    closure_stmt = select(DBRightClosure.ancestor_id, DBRightClosure.depth).where(
+        DBRightClosure.descendant_id == bookkeeping_id
+    )
+    assert set(db_session.execute(closure_stmt).all()) == {
+        (bookkeeping_id, 0),
+        (treasury_id, 1),
+        (1, 2),
+    }
+
+    # Bookkeeping doesn't permit delegating, and user 1 doesn't hold it.
+    payload = delegate(test_schema, bookkeeping_id, "Audit", [])
+    assert payload["errors"][0]["message"]
+
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(test_rights_query, context_value=context)
+    assert result.errors is None
+    delegable = result.data["activeUser"]["delegableRights"]
+    assert [r["name"] for r in delegable] == ["Unlimited Right", "Treasury"]
+    impacts = {
+        edge["node"]["name"]: edge["node"]["revocationImpact"]
+        for edge in result.data["activeCommunity"]["rights"]["edges"]
+    }
+    assert impacts["Treasury"] == {
+        "rights": [{"name": "Treasury"}, {"name": "Bookkeeping"}],
+        "groups": [{"name": "Board of Directors"}, {"name": "Treasurer"}],
+    }
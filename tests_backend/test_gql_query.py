@@ -1,5 +1,512 @@
+import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import select, text
+
+import nido_backend.gql_helpers
+from nido_backend.db_models import (
+    DBAssociate,
+    DBBillingCharge,
+    DBEmailContact,
+    DBGroup,
+    DBResidence,
+)
+from nido_backend.gql_helpers import encode_gql_id, parse_filter_operators
+from nido_backend.gql_query import Group, build_connection, node_for
+from nido_backend.gql_schema import SchemaContext
+
+
 def test_gql_response(test_schema):
     query = "{activeUser{personalName}}"
     context = {"user_id": 1, "community_id": 1}
     result = test_schema.execute_sync(query, context_value=context)
     assert result.data["activeUser"]["personalName"] == "Dylan"
+
+
+test_resident_dir_query = """
+query ResidentDir {
+  activeCommunity {
+    residences {
+      edges {
+        node {
+          ...ResidenceFields
+          occupants {
+            edges {
+              node {
+                ... on Associate {
+                  fullName
+                  groups {
+                    name
+                  }
+                }
+                emails: contactMethods {
+                  ... on EmailContact {
+                    email
+                  }
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+
+fragment ResidenceFields on Residence {
+  street
+  unitNo
+}"""
+
+
+def test_gql_fragments_load_in_constant_statements(
+    test_schema, db_session, sql_statements
+):
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(test_resident_dir_query, context_value=context)
+    assert result.errors is None
+    statement_count = len(sql_statements)
+
+    for i in range(5):
+        residence = DBResidence(
+            community_id=1,
+            unit_no=f"Test {i}",
+            street="1 Test Street",
+            locality="Testville",
+            postcode="00000",
+            region="Test",
+        )
+        occupant = DBAssociate(community_id=1, personal_name="Test", family_name=f"{i}")
+        occupant.contact_methods.append(DBEmailContact(email=f"test{i}@example.com"))
+        residence.occupants.append(occupant)
+        db_session.add(residence)
+    db_session.commit()
+
+    sql_statements.clear()
+    result = test_schema.execute_sync(test_resident_dir_query, context_value=context)
+    assert result.errors is None
+    assert len(sql_statements) <= statement_count
+    residence = result.data["activeCommunity"]["residences"]["edges"][-1]["node"]
+    assert residence["unitNo"] == "Test 4"
+    occupant = residence["occupants"]["edges"][0]["node"]
+    assert occupant["emails"] == [{"email": "test4@example.com"}]
+
+
+test_charges_page_query = """
+query ChargesPage($first: Int, $after: String, $last: Int, $before: String) {
+  activeCommunity {
+    billingCharges(
+      first: $first
+      after: $after
+      last: $last
+      before: $before
+      orderBy: {field: "dueDate", descending: true}
+    ) {
+      edges {
+        cursor
+        node {
+          id
+          dueDate
+        }
+      }
+      pageInfo {
+        hasNextPage
+        hasPreviousPage
+        endCursor
+      }
+    }
+  }
+}"""
+
+
+def test_gql_connection_keyset_pagination(test_schema):
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(test_charges_page_query, context_value=context)
+    assert result.errors is None
+    all_edges = result.data["activeCommunity"]["billingCharges"]["edges"]
+    due_dates = [e["node"]["dueDate"] for e in all_edges]
+    assert due_dates == sorted(due_dates, reverse=True)
+
+    pages = []
+    variables = {"first": 7}
+    while True:
+        result = test_schema.execute_sync(
+            test_charges_page_query, variables, context_value=context
+        )
+        assert result.errors is None
+        connection = result.data["activeCommunity"]["billingCharges"]
+        pages.append(connection["edges"])
+        if not connection["pageInfo"]["hasNextPage"]:
+            break
+        variables["after"] = connection["pageInfo"]["endCursor"]
+    assert all(len(page) == 7 for page in pages[:-1])
+    assert [e["node"]["id"] for page in pages for e in page] == [
+        e["node"]["id"] for e in all_edges
+    ]
+
+    result = test_schema.execute_sync(
+        test_charges_page_query,
+        {"last": 3, "before": all_edges[10]["cursor"]},
+        context_value=context,
+    )
+    assert result.errors is None
+    connection = result.data["activeCommunity"]["billingCharges"]
+    assert connection["edges"] == all_edges[7:10]
+    assert connection["pageInfo"]["hasPreviousPage"]
+    assert connection["pageInfo"]["hasNextPage"]
+
+
+def test_gql_nested_connection_pagination(test_schema):
+    query = """
+    {
+      activeCommunity {
+        residences(first: 2) {
+          edges { node { occupants(first: 1) { edges { node { id } } } } }
+          pageInfo { hasNextPage }
+        }
+      }
+      activeUser {
+        residences {
+          edges { node { occupants(first: 1) {
+            edges { node { id } }
+            pageInfo { hasNextPage }
+          } } }
+        }
+      }
+    }"""
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(query, context_value=context)
+    assert result.errors is None
+    residences = result.data["activeCommunity"]["residences"]
+    assert len(residences["edges"]) == 2
+    assert residences["pageInfo"]["hasNextPage"]
+    for edge in residences["edges"]:
+        assert len(edge["node"]["occupants"]["edges"]) <= 1
+    for edge in result.data["activeUser"]["residences"]["edges"]:
+        assert len(edge["node"]["occupants"]["edges"]) == 1
+
+
+def test_gql_negative_page_size_is_rejected(test_schema, sql_statements):
+    context = {"user_id": 1, "community_id": 1}
+    for query in (
+        "{ activeCommunity { residences(first: -1) { edges { node { id } } } } }",
+        """{ activeCommunity { residences { edges { node {
+          occupants(last: -1) { edges { node { id } } }
+        } } } } }""",
+    ):
+        sql_statements.clear()
+        result = test_schema.execute_sync(query, context_value=context)
+        assert result.errors
+        assert "cannot be negative" in result.errors[0].message
+        assert not any("LIMIT -" in s for s in sql_statements)
+
+
+def test_gql_invalid_nested_arguments_fail_at_their_path(test_schema):
+    query = "{ activeCommunity { name billingCharges(%s) { edges { node { id } } } } }"
+    context = {"user_id": 1, "community_id": 1}
+    for arguments, message in [
+        ('after: "bad"', "Invalid cursor"),
+        ('filter: {dueDate: {between: ["2000-01-01"]}}', "exactly two values"),
+        ("last: -1", "cannot be negative"),
+    ]:
+        result = test_schema.execute_sync(query % arguments, context_value=context)
+        assert len(result.errors) == 1
+        assert message in result.errors[0].message
+        assert result.errors[0].path == ["activeCommunity", "billingCharges"]
+        assert result.data["activeCommunity"]["name"]
+
+
+def test_gql_lazy_connection_filter_runs_in_sql(test_schema, sql_statements):
+    query = """
+    {
+      activeUser {
+        groups {
+          community {
+            groups(filter: {name: {contains: "Treasurer"}}) { edges { node { name } } }
+          }
+        }
+      }
+    }"""
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(query, context_value=context)
+    assert result.errors is None
+    for group in result.data["activeUser"]["groups"]:
+        edges = group["community"]["groups"]["edges"]
+        assert edges == [{"node": {"name": "Treasurer"}}]
+    # The filter runs in the database rather than over the loaded collection.
+    assert any('FROM "group"' in s and "LIKE" in s for s in sql_statements)
+
+
+def test_gql_eager_load_plan_is_reused(cached_test_schema, document_cache, monkeypatch):
+    query = """
+    query Residences($first: Int) {
+      activeCommunity {
+        residences(first: $first) {
+          edges { node { street occupants { edges { node { fullName } } } } }
+          pageInfo { hasNextPage }
+        }
+      }
+    }"""
+    assert document_cache.register(cached_test_schema, query) == []
+    compile_plan = nido_backend.gql_helpers.compile_eager_load_plan
+    compiled = []
+
+    def counting_compile(*args, **kwargs):
+        compiled.append(args[1])
+        return compile_plan(*args, **kwargs)
+
+    monkeypatch.setattr(
+        nido_backend.gql_helpers, "compile_eager_load_plan", counting_compile
+    )
+    context = {"user_id": 1, "community_id": 1}
+    result = cached_test_schema.execute_sync(query, {"first": 1}, context)
+    assert result.errors is None
+    assert len(result.data["activeCommunity"]["residences"]["edges"]) == 1
+    compile_count = len(compiled)
+    assert compile_count > 0
+
+    result = cached_test_schema.execute_sync(query, {"first": 3}, context)
+    assert result.errors is None
+    assert len(result.data["activeCommunity"]["residences"]["edges"]) == 3
+    assert len(compiled) == compile_count
+
+
+def test_gql_balances_are_aggregated_in_sql(test_schema, sql_statements):
+    query = """
+    {
+      activeCommunity {
+        arrearsSummary { totalDue overdue residencesInArrears }
+        residences {
+          edges { node {
+            balance { totalDue overdue }
+            billingCharges { edges { node { remainingBalance dueDate } } }
+          } }
+        }
+      }
+    }"""
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(query, context_value=context)
+    assert result.errors is None
+    community = result.data["activeCommunity"]
+    balance_selects = [s for s in sql_statements if "total_due" in s]
+    assert len(balance_selects) == 2
+
+    today = datetime.date.today().isoformat()
+    total_due = overdue = in_arrears = 0
+    for edge in community["residences"]["edges"]:
+        charges = [e["node"] for e in edge["node"]["billingCharges"]["edges"]]
+        residence_overdue = sum(
+            c["remainingBalance"] for c in charges if c["dueDate"] < today
+        )
+        balance = edge["node"]["balance"]
+        assert balance["totalDue"] == sum(c["remainingBalance"] for c in charges)
+        assert balance["overdue"] == residence_overdue
+        total_due += balance["totalDue"]
+        overdue += residence_overdue
+        in_arrears += residence_overdue > 0
+    assert community["arrearsSummary"] == {
+        "totalDue": total_due,
+        "overdue": overdue,
+        "residencesInArrears": in_arrears,
+    }
+
+
+test_rights_filter_query = """
+query TestRightsFilter($filter: RightFilter) {
+  activeCommunity {
+    rights(filter: $filter) {
+      edges {
+        node {
+          name
+        }
+      }
+    }
+  }
+}"""
+
+
+def test_gql_rights_filter_by_permits(test_schema, sql_statements):
+    context = {"user_id": 1, "community_id": 1}
+    for filter_arg, expected in [
+        ({"permits": ["CAN_DELEGATE"]}, ["Unlimited Right"]),
+        ({"not": {"permits": ["CAN_DELEGATE", "CREATE_GROUPS"]}}, []),
+    ]:
+        sql_statements.clear()
+        result = test_schema.execute_sync(
+            test_rights_filter_query, {"filter": filter_arg}, context
+        )
+        assert result.errors is None
+        edges = result.data["activeCommunity"]["rights"]["edges"]
+        assert [e["node"]["name"] for e in edges] == expected
+        assert any('"right".permissions &' in s for s in sql_statements)
+
+
+test_nodes_query = """
+query TestNodes($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    id
+    ... on Group {
+      name
+    }
+    ... on User {
+      fullName
+    }
+  }
+}"""
+
+
+def test_gql_nodes_are_fetched_by_table(test_schema, sql_statements):
+    ids = [
+        encode_gql_id("group", 2),
+        encode_gql_id("user", 2),
+        "not an id",
+        encode_gql_id("group", 3),
+        encode_gql_id("signature_template", 1),
+    ]
+    context = {"user_id": 1, "community_id": 1}
+    test_schema.execute_sync("{activeUser{id}}", context_value=context)
+    sql_statements.clear()
+    result = test_schema.execute_sync(test_nodes_query, {"ids": ids}, context)
+    assert result.errors is None
+    nodes = result.data["nodes"]
+    assert [n and n["id"] for n in nodes] == [ids[0], ids[1], None, ids[3], None]
+    assert nodes[0]["name"] == "President"
+    assert nodes[3]["name"] == "Treasurer"
+    assert len([s for s in sql_statements if 'WHERE "group".id IN' in s]) == 1
+    assert len([s for s in sql_statements if "WHERE user.id IN" in s]) == 1
+
+    # Nodes are scoped to the active community.
+    context = {"user_id": 1, "community_id": 2}
+    result = test_schema.execute_sync(test_nodes_query, {"ids": ids}, context)
+    assert result.data["nodes"] == [None] * len(ids)
+
+
+def test_gql_total_count_is_counted_in_sql(test_schema, sql_statements):
+    query = """
+    {
+      activeCommunity {
+        residences(first: 2) {
+          totalCount
+          edges { node { occupants { totalCount } } }
+        }
+        billingCharges(filter: {name: {startsWith: "Jan"}}) { totalCount }
+        groups { totalCount }
+      }
+    }"""
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(query, context_value=context)
+    assert result.errors is None
+    community = result.data["activeCommunity"]
+    assert community["residences"]["totalCount"] == 5
+    occupants = [e["node"]["occupants"] for e in community["residences"]["edges"]]
+    assert occupants == [{"totalCount": 1}, {"totalCount": 2}]
+    assert community["billingCharges"] == {"totalCount": 5}
+    assert community["groups"] == {"totalCount": 3}
+    # Connections that only select totalCount never load their rows.
+    counts = [s for s in sql_statements if "count(*)" in s]
+    assert len(counts) == 4
+    assert not any(
+        "FROM billing_charge" in s or "FROM residence_occupancy" in s
+        for s in sql_statements
+        if s not in counts
+    )
+
+
+def test_gql_typed_filter_operators(test_schema):
+    query = """
+    {
+      activeCommunity {
+        groups(filter: {name: {ieq: "treasurer"}}) { edges { node { name } } }
+        residences(filter: {
+          street: {startsWith: "8260 Syc"}
+          unitNo: {in: ["Apt 1", "Apt 2"]}
+        }) {
+          totalCount
+        }
+        billingCharges(filter: {
+          dueDate: {between: ["2000-01-01", "2099-12-31"]}
+          or: [{amount: {lt: 0}}, {amount: {gte: 0}}]
+          name: {isNull: false}
+        }) {
+          totalCount
+        }
+      }
+    }"""
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(query, context_value=context)
+    assert result.errors is None
+    community = result.data["activeCommunity"]
+    assert community["groups"]["edges"] == [{"node": {"name": "Treasurer"}}]
+    assert community["residences"] == {"totalCount": 2}
+    assert community["billingCharges"] == {"totalCount": 60}
+
+
+def test_gql_filter_operators_use_indexes(db_session):
+    def query_plan(stmt):
+        sql = str(stmt.compile(compile_kwargs={"literal_binds": True}))
+        rows = db_session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+        return " ".join(row[-1] for row in rows)
+
+    group_stmt = select(DBGroup).where(
+        DBGroup.community_id == 1,
+        *parse_filter_operators(DBGroup.name, {"ieq": "treasurer"}),
+    )
+    assert "ix_group_name_lower" in query_plan(group_stmt)
+    for column, index in [
+        (DBResidence.street, "ix_residence_street_lower"),
+        (DBResidence.unit_no, "ix_residence_unit_no_lower"),
+    ]:
+        residence_stmt = select(DBResidence).where(
+            DBResidence.community_id == 1,
+            *parse_filter_operators(column, {"ieq": "apt 1"}),
+        )
+        assert index in query_plan(residence_stmt)
+    residence_stmt = select(DBResidence).where(
+        DBResidence.community_id == 1,
+        *parse_filter_operators(DBResidence.street, {"startsWith": "8260"}),
+    )
+    assert "ix_residence_street" in query_plan(residence_stmt)
+    charge_stmt = select(DBBillingCharge).where(
+        DBBillingCharge.community_id == 1,
+        *parse_filter_operators(DBBillingCharge.due_date, {"lt": "2024-01-01"}),
+    )
+    assert "ix_billing_charge_due_date" in query_plan(charge_stmt)
+
+
+def test_gql_reused_nodes(test_schema, db_session):
+    query = """
+{
+  activeCommunity {
+    groups {
+      edges {
+        node {
+          id
+          name
+          customMembers {
+            id
+            fullName
+            groups {
+              id
+              name
+            }
+          }
+        }
+      }
+    }
+  }
+}"""
+    context = {"user_id": 1, "community_id": 1}
+    result = test_schema.execute_sync(query, context_value=context)
+    assert result.errors is None
+    reused = test_schema.execute_sync(
+        query, context_value={**context, "reuse_nodes": True}
+    )
+    assert reused.errors is None
+    assert reused.data == result.data
+
+    info = SimpleNamespace(context=SchemaContext([], db_session, reuse_nodes=True))
+    group = db_session.get(DBGroup, 1)
+    edge = build_connection(info, Group, DBGroup, [group], {}, lambda: 1).edges[0]
+    assert edge.node is node_for(info, Group, group)
+    assert edge.node.id() is edge.node.id()
+    assert not hasattr(edge, "__dict__") and not hasattr(edge.node, "__dict__")
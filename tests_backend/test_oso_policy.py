@@ -1,6 +1,7 @@
 import pytest
+from sqlalchemy import select
 
-from nido_backend.authorization import oso
+from nido_backend.authorization import authorized_filter, oso
 from nido_backend.db_models import (
     DBAssociate,
     DBCommunity,
@@ -12,6 +13,8 @@ from nido_backend.db_models import (
     DBUser,
 )
 from nido_backend.enums import PermissionsFlag
+from nido_backend.gql_schema import SchemaContext
+from nido_backend.principal import load_principal
 
 
 def test_group_member_role_rule():
@@ -38,3 +41,54 @@ def test_group_manager_role_rule():
     child_group.managed_by = parent_group
     parent_group.custom_members.append(associate)
     assert oso.query_rule_once("has_role", user, "manager", child_group)
+
+
+@pytest.mark.parametrize("user_id", [1, 2, 3, 6])
+def test_group_query_filter_matches_policy(db_session, user_id):
+    user = db_session.get(DBUser, user_id)
+    principal = load_principal(db_session, user_id, 1)
+    clause = authorized_filter(principal, "query", DBGroup, DBGroup)
+    filtered = set(
+        db_session.scalars(
+            select(DBGroup.id).where(DBGroup.community_id == 1).where(clause)
+        )
+    )
+    groups = db_session.scalars(select(DBGroup).where(DBGroup.community_id == 1))
+    assert filtered == {g.id for g in groups if oso.is_allowed(user, "query", g)}
+
+
+def test_community_groups_are_filtered_in_sql(test_schema, db_session, sql_statements):
+    query = "{activeCommunity{groups{edges{node{name}}}}}"
+    user = db_session.get(DBUser, 3)
+    expected = {
+        g.name
+        for g in db_session.scalars(select(DBGroup).where(DBGroup.community_id == 1))
+        if oso.is_allowed(user, "query", g)
+    }
+    sql_statements.clear()
+    result = test_schema.execute_sync(
+        query, context_value={"user_id": 3, "community_id": 1}
+    )
+    assert result.errors is None
+    edges = result.data["activeCommunity"]["groups"]["edges"]
+    assert {e["node"]["name"] for e in edges} == expected
+    filtered = [s for s in sql_statements if '"group".id IN' in s]
+    assert len(filtered) == 1
+
+
+def test_decision_cache_memoizes_decisions(db_session):
+    context = SchemaContext([], db_session, user_id=1, community_id=1)
+    cache = context.authorization
+    user = context.active_user
+    group = db_session.get(DBGroup, 2)
+
+    assert cache.is_allowed(user, "update", group)
+    assert cache.is_allowed(user, "update", group)
+    cache.authorize(user, "update", group)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    principal = context.principal
+    context.permissions_changed()
+    assert cache.is_allowed(user, "update", group)
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert context.principal is principal
@@ -0,0 +1,53 @@
+from sqlalchemy import select
+
+from nido_backend.db_models import DBAssociate, DBGroup
+from nido_backend.gql_schema import SchemaContext
+
+test_is_admin_query = "{activeUser{isAdmin}}"
+
+
+def test_principal_is_cached_between_requests(test_schema, db_session, sql_statements):
+    context = {"user_id": 1, "community_id": 1}
+    first = SchemaContext([], db_session, **context).principal
+    assert first.is_admin
+
+    sql_statements.clear()
+    second = SchemaContext([], db_session, **context).principal
+    assert second is first
+    assert len(sql_statements) == 1
+
+    sql_statements.clear()
+    result = test_schema.execute_sync(test_is_admin_query, context_value=context)
+    assert result.data["activeUser"]["isAdmin"]
+    assert not any("group_membership" in s for s in sql_statements)
+
+
+def test_principal_is_invalidated_by_group_changes(db_session):
+    associate = db_session.get(DBAssociate, 3)
+    context = {"user_id": associate.user_id, "community_id": 1}
+    before = SchemaContext([], db_session, **context).principal
+    assert 3 not in before.group_ids
+
+    group = db_session.get(DBGroup, 3)
+    group.custom_members.append(associate)
+    db_session.commit()
+
+    after = SchemaContext([], db_session, **context).principal
+    assert after.permissions_version > before.permissions_version
+    assert group.id in after.group_ids
+
+
+def test_principal_is_invalidated_by_associate_changes(db_session):
+    associate = db_session.scalars(
+        select(DBAssociate).join(DBAssociate.groups).where(DBGroup.id == 1)
+    ).first()
+    context = {"user_id": associate.user_id, "community_id": 1}
+    before = SchemaContext([], db_session, **context).principal
+    assert 1 in before.group_ids
+
+    associate.user_id = None
+    db_session.commit()
+
+    after = SchemaContext([], db_session, **context).principal
+    assert after.permissions_version > before.permissions_version
+    assert 1 not in after.group_ids
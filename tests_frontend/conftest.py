@@ -0,0 +1,34 @@
+import pytest
+
+from generate_mock_data import seed_db
+from nido_backend.db_models import Base
+from nido_backend.principal import principals
+from nido_frontend import create_app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(
+        {
+            "SECRET_KEY": "test",
+            "DATABASE_URL": f"sqlite:///{tmp_path / 'nido_db.sqlite3'}",
+            "LOG_SQL": False,
+            "GRAPHQL_MAX_BATCH_SIZE": 3,
+            "GRAPHQL_GET_MAX_AGE": 30,
+        }
+    )
+    db_session = app.Session()
+    Base.metadata.create_all(bind=db_session.get_bind())
+    seed_db(db_session)
+    app.Session.remove()
+    yield app
+    principals.clear()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+        session["community_id"] = 1
+    return client
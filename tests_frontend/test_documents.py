@@ -0,0 +1,22 @@
+from flask import Flask
+
+from nido_frontend.main import find_gql_documents
+
+
+def test_find_gql_documents_in_nested_functions():
+    app = Flask(__name__)
+
+    @app.route("/")
+    def view():
+        def load():
+            def load_name():
+                return "query Name { activeUser { personalName } }"
+
+            return load_name()
+
+        return "mutation Nothing { __typename }", load()
+
+    assert sorted(find_gql_documents(app)) == [
+        "mutation Nothing { __typename }",
+        "query Name { activeUser { personalName } }",
+    ]
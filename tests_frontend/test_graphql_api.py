@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+import nido_frontend.main
+from nido_backend.gql_extensions import hash_query
+from nido_backend.gql_helpers import encode_gql_id
+
+user_query = "{ activeUser { personalName } }"
+community_query = "{ activeCommunity { name } }"
+
+rename_mutation = """
+mutation Rename($input: [RenameGroupInput!]!) {
+  groups { rename(input: $input) { groups { name } } }
+}"""
+
+
+def persisted(query_hash):
+    return json.dumps({"persistedQuery": {"version": 1, "sha256Hash": query_hash}})
+
+
+def test_api_batch(client):
+    response = client.post(
+        "/api/graphql", json=[{"query": user_query}, {"query": community_query}]
+    )
+    assert response.status_code == 200
+    results = response.get_json()
+    assert results[0]["data"] == {"activeUser": {"personalName": "Dylan"}}
+    assert results[1]["data"] == {"activeCommunity": {"name": "Nolan-Shields Condos"}}
+
+
+def test_api_batched_mutation_is_seen_by_later_operations(client):
+    group_query = '{ node(id: "%s") { ... on Group { name } } }' % encode_gql_id(
+        "group", 2
+    )
+    variables = {"input": {"group": encode_gql_id("group", 2), "name": "CEO"}}
+    response = client.post(
+        "/api/graphql",
+        json=[
+            {"query": rename_mutation, "variables": variables},
+            {"query": group_query},
+        ],
+    )
+    results = response.get_json()
+    assert "errors" not in results[0]
+    assert results[1]["data"] == {"node": {"name": "CEO"}}
+
+
+@pytest.mark.parametrize(
+    "body", [b'[{"query": ', b"[\xff]", b"[1]", b'[{"query": 1}]', b"[{}]"]
+)
+def test_api_bad_batch_body(client, body):
+    response = client.post("/api/graphql", data=body, content_type="application/json")
+    assert response.status_code == 400
+
+
+def test_api_bad_batch_runs_nothing(client):
+    variables = {"input": {"group": encode_gql_id("group", 2), "name": "CEO"}}
+    response = client.post(
+        "/api/graphql",
+        json=[{"query": rename_mutation, "variables": variables}, {"query": 1}],
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/api/graphql",
+        json={
+            "query": '{ node(id: "%s") { ... on Group { name } } }'
+            % encode_gql_id("group", 2)
+        },
+    )
+    assert response.get_json()["data"]["node"]["name"] != "CEO"
+
+
+def test_api_batch_over_max_batch_size(client):
+    response = client.post("/api/graphql", json=[{"query": user_query}] * 4)
+    assert response.status_code == 400
+
+
+def test_api_rejects_form_posts(client):
+    response = client.post("/api/graphql", data={"query": user_query})
+    assert response.status_code == 400
+
+
+def test_api_persisted_query_miss_then_register(client):
+    query = "{ activeUser { familyName } }"
+    extensions = persisted(hash_query(query))
+    response = client.get("/api/graphql", query_string={"extensions": extensions})
+    error = response.get_json()["errors"][0]
+    assert error["extensions"]["code"] == "PERSISTED_QUERY_NOT_FOUND"
+    assert "max-age" not in response.headers.get("Cache-Control", "")
+
+    response = client.get(
+        "/api/graphql", query_string={"extensions": extensions, "query": query}
+    )
+    assert response.get_json()["data"] == {"activeUser": {"familyName": "Grossier"}}
+
+    response = client.get("/api/graphql", query_string={"extensions": extensions})
+    assert response.get_json()["data"] == {"activeUser": {"familyName": "Grossier"}}
+    assert response.cache_control.private
+    assert response.cache_control.max_age == 30
+    assert response.headers["X-Accel-Expires"] == "30"
+
+
+def test_api_get_requires_persisted_query(client):
+    response = client.get("/api/graphql", query_string={"query": user_query})
+    assert response.status_code == 400
+
+
+def test_api_encode_json(app, monkeypatch):
+    view = app.view_functions["graphql_view"].view_class(schema=None)
+    results = [{"data": {"name": "Résidence"}, "errors": None}]
+    if nido_frontend.main.orjson is not None:
+        assert json.loads(view.encode_json(results)) == results
+    monkeypatch.setattr(nido_frontend.main, "orjson", None)
+    assert json.loads(view.encode_json(results)) == results
@@ -0,0 +1,44 @@
+import pytest
+from jinja2 import Template
+
+from nido_frontend.main import to_graphql_data
+
+
+def test_graphql_data_nested_lists():
+    data = to_graphql_data(
+        {"residences": {"edges": [{"node": {"unitNo": "1"}}, {"node": None}]}}
+    )
+    edges = data.residences.edges
+    assert isinstance(edges, list)
+    assert edges[0].node.unit_no == "1"
+    assert edges[1].node is None
+    assert to_graphql_data([[{"id": 1}], []])[0][0].id == 1
+
+
+def test_graphql_data_aliases():
+    data = to_graphql_data(
+        {"emails": [{"email": "a@example.com"}], "allGroups": [{"name": "Board"}]}
+    )
+    assert data.emails[0].email == "a@example.com"
+    assert data.all_groups[0].name == "Board"
+
+
+def test_graphql_data_attributes_and_keys():
+    data = to_graphql_data({"fullName": "Dylan Grossier", "isAdmin": False})
+    assert data.full_name == data["fullName"] == "Dylan Grossier"
+    assert data.is_admin is False
+    assert data["isAdmin"] is False
+    with pytest.raises(KeyError):
+        data["full_name"]
+    with pytest.raises(AttributeError):
+        data.fullName
+
+
+def test_graphql_data_unselected_fields():
+    data = to_graphql_data({"name": "Board"})
+    with pytest.raises(AttributeError):
+        data.members
+    with pytest.raises(KeyError):
+        data["members"]
+    # Templates see them as undefined.
+    assert Template("{{ g.name }}{{ g.members or '-' }}").render(g=data) == "Board-"